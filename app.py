@@ -1,30 +1,81 @@
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, request, jsonify, make_response, Response, stream_with_context
 from flask_cors import CORS
 import os
-from supabase import create_client, Client
 import datetime
 from dotenv import load_dotenv
-from model.inference import PD_Model
-import numpy as np
-import cv2
+from model.worker_pool import InferenceBusyError, InferenceTimeoutError
+from model import metrics
+from model.template_cache import template_id
+from jobs import JobManager, JobQueueFullError
+from cache import TTLCache, RedisBackend, ReadThroughCache, SingleFlightCache, cache_backend_from_env
+from db import CachedDatabase
+from bulk import BulkError, IdempotencyKeys, ingest, validate_assessments, validate_patients
 import base64
-from io import BytesIO
-from PIL import Image
-from google import genai
-
-model = PD_Model()
+import hashlib
+import itertools
+import json
+import re
+import services
 
 load_dotenv()
 
 
 # port = 10000
 
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
-
-model = PD_Model()
-client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+# Scoring model, database (see db.py) and Gemini client: each built on first
+# use, once per process (see services.py). WARM_UP=1 builds them when the app loads.
+model = services.model
+client = services.llm
+
+# Single patients and their assessments are read through a cache (RECORD_CACHE,
+# see cache.py); the writes below go through it too and invalidate what they change.
+record_cache = cache_backend_from_env()
+db = CachedDatabase(services.db, ReadThroughCache(record_cache, ttl=float(os.environ.get("RECORD_CACHE_TTL", "30"))))
+if os.environ.get("WARM_UP", "").lower() in ("1", "true"):
+    services.warm_up()
+
+# gunicorn runs several worker processes (GUNICORN_WORKERS, see gunicorn.conf.py),
+# and any of them can get a client's next request. State that has to outlive a
+# request is shared through Redis when the record cache is there; without it,
+# features that depend on such state are refused with several workers.
+SEVERAL_WORKERS = int(os.environ.get("GUNICORN_WORKERS", "1")) > 1
+
+def shared_store(name):
+    """ A RedisBackend for name's keys, next to the record cache's, or None if that isn't Redis. """
+    if isinstance(record_cache, RedisBackend):
+        return RedisBackend(record_cache.client, f"{record_cache.prefix}{name}:")
+    return None
+
+# Maximum number of drawings accepted by /submit-images/batch
+BATCH_MAX_ITEMS = int(os.environ.get("SUBMIT_BATCH_MAX_ITEMS", "32"))
+
+# Largest multipart/form-data or raw image body accepted by /submit-images and /templates
+UPLOAD_MAX_BYTES = int(os.environ.get("SUBMIT_MAX_UPLOAD_BYTES", str(16 * 1024 * 1024)))
+
+# Templates uploaded to /templates, referenced by template_id (their content
+# hash) in submissions. Raw image/png submissions carry only the drawing, so
+# they need one. A submission can reach another worker than the upload, so
+# with several workers the templates are kept in Redis, as base64 text.
+TEMPLATE_STORE_TTL = float(os.environ.get("TEMPLATE_STORE_TTL", "86400"))
+template_store = shared_store("templates")
+if template_store is not None:
+    templates = template_store
+else:
+    templates = TTLCache(maxsize=int(os.environ.get("TEMPLATE_STORE_SIZE", "64")), ttl=TEMPLATE_STORE_TTL)
+TEMPLATE_UPLOADS = template_store is not None or not SEVERAL_WORKERS
+
+# Background scoring for asynchronous /submit-images requests, polled via
+# /jobs/<id>. The poll can reach another worker than the job, so with several
+# workers async submissions need the job statuses in Redis.
+job_store = shared_store("jobs")
+jobs = JobManager(
+    workers=int(os.environ.get("JOB_WORKERS", "2")),
+    max_pending=int(os.environ.get("JOB_MAX_PENDING", "32")),
+    max_jobs=int(os.environ.get("JOB_MAX_STORED", "1024")),
+    result_ttl=float(os.environ.get("JOB_RESULT_TTL", "600")),
+    store=job_store,
+)
+ASYNC_SUBMISSIONS = job_store is not None or not SEVERAL_WORKERS
 
 app = Flask(__name__)
 # Configure CORS to allow all origins and methods
@@ -37,9 +88,62 @@ app = Flask(__name__)
 # }})
 CORS(app)
 
+# Gemini reports by a hash of their prompt (see gemini_report): refreshing a
+# report whose patient, notes, treatments and assessments haven't changed
+# reuses it, and concurrent requests for the same report share one call
+REPORT_MODEL = "gemini-2.0-flash"
+reports = SingleFlightCache(TTLCache(
+    maxsize=int(os.environ.get("REPORT_CACHE_SIZE", "256")),
+    ttl=float(os.environ.get("REPORT_CACHE_TTL", "3600")),
+))
+
+# Bulk ingestion (see bulk.py): most rows and bytes per request, and rows per
+# database insert unless the request asks for ?chunk_size=
+BULK_MAX_ROWS = int(os.environ.get("BULK_MAX_ROWS", "10000"))
+BULK_MAX_BYTES = int(os.environ.get("BULK_MAX_BYTES", str(32 * 1024 * 1024)))
+BULK_CHUNK_SIZE = int(os.environ.get("BULK_CHUNK_SIZE", "500"))
+
+# Responses to bulk requests by Idempotency-Key, kept for BULK_IDEMPOTENCY_TTL
+# seconds. A retry can reach any server worker, so with RECORD_CACHE=redis the
+# keys live in Redis next to the record cache. Otherwise they can only be kept
+# per process, which is only safe with a single worker: with more,
+# Idempotency-Key is refused rather than silently not deduplicated.
+BULK_IDEMPOTENCY_TTL = float(os.environ.get("BULK_IDEMPOTENCY_TTL", "86400"))
+idempotency_store = shared_store("idempotency")
+if idempotency_store is not None:
+    idempotency = IdempotencyKeys(idempotency_store, BULK_IDEMPOTENCY_TTL)
+elif SEVERAL_WORKERS:
+    idempotency = None
+else:
+    idempotency = IdempotencyKeys(TTLCache(maxsize=int(os.environ.get("BULK_IDEMPOTENCY_SIZE", "1024")),
+                                           ttl=BULK_IDEMPOTENCY_TTL),
+                                  BULK_IDEMPOTENCY_TTL)
+
+# Listing endpoints: rows fetched per database query while streaming, and the
+# largest page a client may ask for with ?limit=
+LIST_BATCH_SIZE = int(os.environ.get("LIST_BATCH_SIZE", "500"))
+LIST_MAX_PAGE = int(os.environ.get("LIST_MAX_PAGE", "1000"))
+
+# Adds a Server-Timing header with the pipeline/Supabase/Gemini spans of each request
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "").lower() in ("1", "true")
+
+@app.before_request
+def before_request():
+    if SERVER_TIMING:
+        metrics.start_collecting()
+
 @app.after_request
 def after_request(response):
-    app.logger.info(f"Response Headers: {dict(response.headers)}")
+    if SERVER_TIMING:
+        timings = metrics.stop_collecting()
+        if timings:
+            response.headers["Server-Timing"] = metrics.server_timing(timings)
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    response = make_response(metrics.REGISTRY.render())
+    response.headers["Content-Type"] = "text/plain; version=0.0.4"
     return response
 
 @app.route('/test')
@@ -51,31 +155,144 @@ def test():
 def hello_world():
     return 'Hello, World!'
 
-@app.route('/patient')
-def get_all_patients():
+class ListingError(Exception):
+    """ Invalid listing parameters, answered with 400. """
+
+def iso_date(value):
+    return datetime.date.fromisoformat(value).isoformat()
+
+# Range filters of the listing endpoints: parameter -> (column, operator, parser)
+PATIENT_FILTERS = {
+    "severity_min": ("severity", "gte", float),
+    "severity_max": ("severity", "lte", float),
+}
+ASSESSMENT_FILTERS = {
+    "patient_id": ("patientId", "eq", int),
+    "severity_min": ("severity", "gte", float),
+    "severity_max": ("severity", "lte", float),
+    "date_from": ("date", "gte", iso_date),
+    "date_to": ("date", "lte", iso_date),
+}
+
+COLUMN_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(json.dumps({"id": last_id}).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
     try:
-        response = supabase.table("patients").select("*").execute()
-        
-        if not response.data:
-            return jsonify({"success": False, "error": "Patient not found"}), 404
-        
-        app.logger.info(response.data)
-            
-        return jsonify({"success": True, "data": response.data}), 200
-        
+        return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))["id"]
+    except (ValueError, KeyError, TypeError):
+        raise ListingError("Invalid cursor")
+
+def listing_query(filters):
+    """
+    Reads ?fields=a,b&limit=n&after=<cursor> and the range filters allowed
+    for the table. Returns (columns, filters, after id, limit, requested
+    fields or None).
+    """
+    fields = None
+    columns = "*"
+    if request.args.get("fields"):
+        fields = [f.strip() for f in request.args["fields"].split(",") if f.strip()]
+        if not fields or not all(COLUMN_NAME.match(f) for f in fields):
+            raise ListingError("fields must be a comma-separated list of column names")
+        # Paging needs the id, even if it isn't returned
+        columns = ",".join(fields if "id" in fields else ["id"] + fields)
+
+    conditions = []
+    for param, (column, op, parse) in filters.items():
+        if param in request.args:
+            try:
+                conditions.append((column, op, parse(request.args[param])))
+            except ValueError:
+                raise ListingError(f"Invalid {param}: {request.args[param]}")
+
+    limit = None
+    if "limit" in request.args:
+        try:
+            limit = int(request.args["limit"])
+        except ValueError:
+            raise ListingError("limit must be an integer")
+        if not 1 <= limit <= LIST_MAX_PAGE:
+            raise ListingError(f"limit must be between 1 and {LIST_MAX_PAGE}")
+
+    after = decode_cursor(request.args["after"]) if request.args.get("after") else None
+    return columns, conditions, after, limit, fields
+
+def stream_listing(table, filters, not_found):
+    """
+    Lists a table as {"data": [...], "next_cursor": ..., "success": true},
+    streamed row by row while the rows are fetched in batches, so neither
+    the result set nor the response body is held in memory. Without ?limit=
+    every matching row is returned and next_cursor is null.
+
+    An empty table answers 404 with not_found, as these endpoints always
+    have. Filters that match nothing, and pages past the end, answer 200
+    with an empty list.
+    """
+    try:
+        columns, conditions, after, limit, fields = listing_query(filters)
+    except ListingError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    # One more row than the page, to tell whether there is a next page
+    rows = db.iter_rows(table, columns, conditions, after, None if limit is None else limit + 1,
+                        batch=LIST_BATCH_SIZE)
+    try:
+        first = next(rows, None)
     except Exception as e:
-        app.logger.error(f"error fetching patient data: {str(e)}")
+        app.logger.error(f"error listing {table}: {str(e)}")
         return jsonify({"success": False, "error": str(e)}), 500
+    if first is None and after is None and not conditions:
+        return jsonify({"success": False, "error": not_found}), 404
+
+    def project(row):
+        return row if fields is None else {field: row.get(field) for field in fields}
+
+    def generate():
+        yield '{"data": ['
+        count, last_id, more = 0, None, False
+        try:
+            for row in itertools.chain([first] if first is not None else [], rows):
+                if count == limit:
+                    more = True  # the extra row: there is a next page
+                    break
+                yield ("," if count else "") + app.json.dumps(project(row))
+                count, last_id = count + 1, row["id"]
+        except Exception as e:
+            # Too late for an error status: end the document with the error
+            app.logger.error(f"error listing {table}: {str(e)}")
+            yield f'], "success": false, "error": {json.dumps(str(e))}}}'
+            return
+        next_cursor = encode_cursor(last_id) if more else None
+        yield f'], "next_cursor": {json.dumps(next_cursor)}, "success": true}}'
+
+    return Response(stream_with_context(generate()), status=200, mimetype="application/json")
+
+@app.route('/patient')
+def get_all_patients():
+    return stream_listing("patients", PATIENT_FILTERS, "Patient not found")
+
+def record_response(data, etag):
+    """ {"success": true, "data": data} tagged with etag, or an empty 304 if the client already has it. """
+    if request.if_none_match.contains_weak(etag):
+        response = make_response("", 304)
+    else:
+        response = make_response(jsonify({"success": True, "data": data}), 200)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
 @app.route('/patient/<patient_id>')
 def get_patient(patient_id):
     try:
-        response = supabase.table("patients").select("*").eq("id", patient_id).execute()
+        patient, etag = db.patient(patient_id)
         
-        if not response.data:
+        if patient is None:
             return jsonify({"success": False, "error": "Patient not found"}), 404
             
-        return jsonify({"success": True, "data": response.data[0]}), 200
+        return record_response(patient, etag)
         
     except Exception as e:
         app.logger.error(f"error fetching patient data: {str(e)}")
@@ -88,12 +305,12 @@ def update_patient(patient_id):
         return jsonify({"success": False, "error": "No data provided"}), 400
     new_severity = request_data.get("severity")
     try:
-        response = supabase.table("patients").update({"severity": new_severity}).eq("id", patient_id).execute()
+        updated = db.update_patient(patient_id, {"severity": new_severity})
 
-        if not response.data:
+        if not updated:
             return jsonify({"success": False, "error": "Patient not found"}), 404
         
-        return jsonify({"success": True, "data": response.data}), 200
+        return jsonify({"success": True, "data": updated}), 200
 
     except Exception as e:
         app.logger.error(f"error updating patient data: {str(e)}")
@@ -101,27 +318,17 @@ def update_patient(patient_id):
     
 @app.route('/assessments')
 def get_all_assessments():
-    try:
-        response = supabase.table("assessments").select("*").execute()
-        
-        if not response.data:
-            return jsonify({"success": False, "error": "No assessments found"}), 404
-            
-        return jsonify({"success": True, "data": response.data}), 200
-        
-    except Exception as e:
-        app.logger.error(f"error fetching assessment data: {str(e)}")
-        return jsonify({"success": False, "error": str(e)}), 500
+    return stream_listing("assessments", ASSESSMENT_FILTERS, "No assessments found")
     
 @app.route('/assessments/<patient_id>')
 def get_assessments(patient_id):
     try:
-        response = supabase.table("assessments").select("*").eq("patientId", patient_id).execute()
+        assessments, etag = db.assessments(patient_id)
         
-        if not response.data:
+        if not assessments:
             return jsonify({"success": False, "error": "No assessments found for this patient"}), 404
             
-        return jsonify({"success": True, "data": response.data}), 200
+        return record_response(assessments, etag)
         
     except Exception as e:
         app.logger.error(f"error fetching assessment data: {str(e)}")
@@ -130,31 +337,19 @@ def get_assessments(patient_id):
 
 @app.route('/add_patient', methods=["OPTIONS"])
 def handle_options():
-    app.logger.info("OPTIONS request received for /add_patient")
     response = make_response()
     response.headers.add("Access-Control-Allow-Origin", "*")
     response.headers.add("Access-Control-Allow-Headers", "Content-Type,Authorization")
     response.headers.add("Access-Control-Allow-Methods", "GET,POST,OPTIONS")
-    app.logger.info(f"Responding to OPTIONS with headers: {dict(response.headers)}")
     return response
 
 @app.route('/add_patient', methods=["POST"])
 def add_patient():
     try:
-        # Log the incoming request
-        app.logger.info("POST request received for /add_patient")
-        app.logger.info(f"Request headers: {dict(request.headers)}")
-        app.logger.info(f"Request method: {request.method}")
-        app.logger.info(f"Request content type: {request.content_type}")
-        
         # Get data from request body
         request_data = request.get_json(silent=True)
         if not request_data:
-            app.logger.error("No JSON data received in request")
-            app.logger.info(f"Request body: {request.get_data(as_text=True)}")
             return jsonify({"success": False, "error": "No data provided or invalid JSON"}), 400
-            
-        app.logger.info(f"Received data: {request_data}")
         
         # Extract data with validation
         fName = request_data.get("fName")
@@ -176,7 +371,6 @@ def add_patient():
         required_fields = ["fName", "lName", "bDate"]
         missing_fields = [field for field in required_fields if not request_data.get(field)]
         if missing_fields:
-            app.logger.error(f"Missing required fields: {missing_fields}")
             return jsonify({"success": False, "error": f"Missing required fields: {missing_fields}"}), 400
 
         # Calculate age from birth date
@@ -185,7 +379,6 @@ def add_patient():
             today = datetime.datetime.now()
             age = today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
         except ValueError as e:
-            app.logger.error(f"Invalid date format: {birthDate}")
             return jsonify({"success": False, "error": "Invalid date format. Use YYYY-MM-DD"}), 400
 
         data = {
@@ -206,11 +399,9 @@ def add_patient():
             "notes": []
         }
         
-        app.logger.info("Attempting to insert data into Supabase")
-        response = supabase.table("patients").insert(data).execute()
-        app.logger.info("Successfully inserted data")
+        inserted = db.insert_patient(data)
         
-        response = jsonify({"success": True, "data": response.data})
+        response = jsonify({"success": True, "data": inserted})
         return response, 201
 
     except Exception as e:
@@ -229,8 +420,6 @@ def add_assessment():
     tremor = request_data.get("tremor")
     deviation = request_data.get("deviation")
 
-    print("Received data:", date, assessment_type, patient_id, severity, tremor, deviation)
-
     try:
         data = {
             "date": date,
@@ -241,13 +430,67 @@ def add_assessment():
             "deviation": float(deviation),
         }
         
-        response = supabase.table("assessments").insert(data).execute()
-        return jsonify({"success": True, "data": response.data}), 201
+        inserted = db.insert_assessment(data)
+        return jsonify({"success": True, "data": inserted}), 201
 
     except Exception as e:
         app.logger.error(f"error inserting assessment data: {str(e)}")
         return jsonify({"success": False, "error": str(e)}), 500
     
+def bulk_insert(validate, insert):
+    """
+    Inserts the rows of a bulk request (JSON array or NDJSON) in chunks of
+    ?chunk_size= rows, answering with the id or error of every row. A request
+    repeated with the same Idempotency-Key header gets the first answer back.
+    """
+    key = request.headers.get("Idempotency-Key")
+    try:
+        chunk_size = int(request.args.get("chunk_size", BULK_CHUNK_SIZE))
+        if chunk_size < 1:
+            raise BulkError("chunk_size must be at least 1")
+        if key and idempotency is None:
+            raise BulkError("Idempotency-Key needs a shared store with several server workers (RECORD_CACHE=redis)")
+        body = bytes(read_upload(request.stream, BULK_MAX_BYTES))
+        if key:
+            key = f"{request.path}:{key}"
+            fingerprint = hashlib.sha256(body).hexdigest()
+            stored = idempotency.claim(key, fingerprint)
+            if stored is not None:
+                status, result = stored
+                response = jsonify(result)
+                response.headers["Idempotent-Replayed"] = "true"
+                return response, status
+    except ValueError:
+        return jsonify({"success": False, "error": "chunk_size must be an integer"}), 400
+    except (BulkError, UploadError) as e:
+        return jsonify({"success": False, "error": str(e)}), e.status
+
+    try:
+        status, result = ingest(body, request.mimetype, validate, insert, chunk_size, BULK_MAX_ROWS)
+    except BulkError as e:
+        status, result = e.status, {"success": False, "error": str(e)}
+    except Exception as e:
+        if key:
+            idempotency.release(key)
+        app.logger.error(f"error in bulk insert: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+    if key:
+        # Nothing was inserted if the database failed: let the client retry
+        if status == 502:
+            idempotency.release(key)
+        else:
+            idempotency.complete(key, fingerprint, status, result)
+    return jsonify(result), status
+
+@app.route('/patients/bulk', methods=["POST"])
+def add_patients_bulk():
+    return bulk_insert(validate_patients, db.insert_patients)
+
+@app.route('/assessments/bulk', methods=["POST"])
+def add_assessments_bulk():
+    return bulk_insert(validate_assessments, db.insert_assessments)
+
 @app.route('/add_treatment', methods=["POST"])
 def add_treatment():
     patient_id = request.args.get("id")
@@ -261,20 +504,13 @@ def add_treatment():
     }
     
     try:
-        # Get current treatments for the patient
-        response = supabase.table("patients").select("medication").eq("id", patient_id).execute()
+        # Add the treatment to the patient's treatments
+        updated = db.append_to_patient(patient_id, "medication", treatment)
         
-        if not response.data:
+        if not updated:
             return jsonify({"success": False, "error": "Patient not found"}), 404
             
-        current_treatments = response.data[0].get("medication", [])
-        
-        # Add new treatment to the array
-        updated_treatments = current_treatments + [treatment] if current_treatments else [treatment]
-        
-        # Update the patient's treatments
-        update_response = supabase.table("patients").update({"medication": updated_treatments}).eq("id", patient_id).execute()
-        return jsonify({"success": True, "data": update_response.data}), 200
+        return jsonify({"success": True, "data": updated}), 200
         
     except Exception as e:
         app.logger.error(f"error updating patient treatments: {str(e)}")
@@ -286,14 +522,6 @@ def add_note():
     note = request.args.get("note")
     
     try:
-        # Get current notes for the patient
-        response = supabase.table("patients").select("notes").eq("id", patient_id).execute()
-        
-        if not response.data:
-            return jsonify({"success": False, "error": "Patient not found"}), 404
-            
-        current_notes = response.data[0].get("notes", [])
-        
         # Create new note object
         note_obj = {
             "date": datetime.datetime.now().strftime("%Y-%m-%d"),
@@ -301,56 +529,286 @@ def add_note():
             "doctor": "Dr. Johnson"
         }
         
-        # Add new note to the array
-        updated_notes = current_notes + [note_obj] if current_notes else [note_obj]
+        # Add the note to the patient's notes
+        updated = db.append_to_patient(patient_id, "notes", note_obj)
         
-        # Update the patient's notes
-        update_response = supabase.table("patients").update({"notes": updated_notes}).eq("id", patient_id).execute()
-        return jsonify({"success": True, "data": update_response.data}), 200
+        if not updated:
+            return jsonify({"success": False, "error": "Patient not found"}), 404
+            
+        return jsonify({"success": True, "data": updated}), 200
         
     except Exception as e:
         app.logger.error(f"error updating patient notes: {str(e)}")
         return jsonify({"success": False, "error": str(e)}), 500
     
 
-@app.route('/submit-images', methods=["POST"])
-def submit_images():
-    data = request.get_json()
+def strip_data_url(image):
+    # Remove the prefix (data:image/png;base64,) if it exists
+    if image.startswith('data:image/png;base64,'):
+        image = image.replace('data:image/png;base64,', '')
+    return image
+
+class UploadError(Exception):
+    """ A submission that can't be read; status is the HTTP status to answer with. """
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({"success": False, "error": f"Request body too large (limit {UPLOAD_MAX_BYTES} bytes)"}), 413
+
+def read_upload(stream, limit=None):
+    """ Reads a request body or uploaded file into one buffer, failing as soon as it exceeds limit bytes. """
+    limit = limit or UPLOAD_MAX_BYTES
+    buf = bytearray()
+    while True:
+        chunk = stream.read(64 * 1024)
+        if not chunk:
+            return buf
+        if len(buf) + len(chunk) > limit:
+            raise UploadError(f"Upload too large (limit {limit} bytes)", 413)
+        buf += chunk
+
+def stored_template(template_key):
+    template = templates.get(template_key)
+    if template is None:
+        raise UploadError("Unknown or expired template_id; upload the template to /templates first", 404)
+    return template
+
+def submitted_drawing(data):
+    """ The drawing of a JSON submission: base64 image in "trace", or parsed "strokes". """
+    if 'strokes' in data:
+        from model.strokes import parse_strokes  # imports cv2, which is slow to import
+        try:
+            return parse_strokes(data['strokes'], data.get('canvas'))
+        except ValueError as e:
+            raise UploadError(f"Invalid strokes: {str(e)}")
+    return strip_data_url(data['trace'])
+
+def read_submission():
+    """
+    (trace, template, age, async) of a /submit-images request, in one of three forms:
+    - JSON: {"trace": base64, "template": base64 or "template_id": id, "age": n, "async": bool},
+      or with "strokes": [[[x, y, t, pressure], ...], ...] (and optionally
+      "canvas": {"width": w, "height": h}) instead of "trace"; see model/strokes.py
+    - multipart/form-data: trace (and template) files, age (and template_id) fields
+    - raw image/png body holding the trace, with template_id and age query parameters
+    Images from multipart and raw bodies are passed on as bytes, skipping base64.
+    """
+    run_async = request.args.get('async', '').lower() in ('1', 'true')
+
+    if request.mimetype == 'multipart/form-data':
+        request.max_content_length = UPLOAD_MAX_BYTES
+        trace_file = request.files.get('trace')
+        if trace_file is None or 'age' not in request.form:
+            raise UploadError("Invalid request: trace file and age are required")
+        trace_image = read_upload(trace_file.stream)
+        if 'template' in request.files:
+            template_image = read_upload(request.files['template'].stream)
+        elif 'template_id' in request.form:
+            template_image = stored_template(request.form['template_id'])
+        else:
+            raise UploadError("Invalid request: template file or template_id is required")
+        age = request.form['age']
+        run_async = run_async or request.form.get('async', '').lower() in ('1', 'true')
+    elif request.mimetype in ('image/png', 'application/octet-stream'):
+        request.max_content_length = UPLOAD_MAX_BYTES
+        if 'template_id' not in request.args or 'age' not in request.args:
+            raise UploadError("Invalid request: template_id and age query parameters are required")
+        trace_image = read_upload(request.stream)
+        template_image = stored_template(request.args['template_id'])
+        age = request.args['age']
+    else:
+        data = request.get_json(silent=True)
+        if not data or ('trace' not in data and 'strokes' not in data) or ('template' not in data and 'template_id' not in data) or 'age' not in data:
+            raise UploadError("Invalid request")
+        trace_image = submitted_drawing(data)
+        if 'template' in data:
+            template_image = strip_data_url(data['template'])
+        else:
+            template_image = stored_template(data['template_id'])
+        age = data['age']
+        run_async = run_async or data.get('async') is True
 
-    if not data or 'trace' not in data or 'template' not in data or 'age' not in data:
-        return jsonify({"success": False, "error": "Invalid request"}), 400
+    try:
+        age = float(age)
+    except (TypeError, ValueError):
+        raise UploadError("Invalid request: age must be a number")
+    return trace_image, template_image, age, run_async
+
+@app.route('/templates', methods=["POST"])
+def upload_template():
+    """ Stores a template image (raw body, multipart "template" file or JSON base64) and returns its id. """
+    if not TEMPLATE_UPLOADS:
+        return jsonify({"success": False, "error": "Template uploads need a shared store with several server workers (RECORD_CACHE=redis)"}), 400
+    try:
+        if request.mimetype == 'multipart/form-data':
+            request.max_content_length = UPLOAD_MAX_BYTES
+            if 'template' not in request.files:
+                raise UploadError("Invalid request: template file is required")
+            template_image = bytes(read_upload(request.files['template'].stream))
+        elif request.mimetype in ('image/png', 'application/octet-stream'):
+            request.max_content_length = UPLOAD_MAX_BYTES
+            template_image = bytes(read_upload(request.stream))
+        else:
+            data = request.get_json(silent=True)
+            if not data or 'template' not in data:
+                raise UploadError("Invalid request")
+            template_image = base64.b64decode(strip_data_url(data['template']))
+        from model.extract_features import decode_image  # imports cv2, which is slow to import
+        decode_image(template_image)
+    except UploadError as e:
+        return jsonify({"success": False, "error": str(e)}), e.status
+    except Exception as e:
+        return jsonify({"success": False, "error": f"Invalid template image: {str(e)}"}), 400
 
-    trace_image = data['trace']
-    template_image = data['template']
-    age = data['age']
+    key = template_id(template_image)
+    if template_store is not None:
+        # Redis holds JSON; the pipeline takes base64 text as it takes bytes
+        templates.set(key, base64.b64encode(template_image).decode(), TEMPLATE_STORE_TTL)
+    else:
+        templates.set(key, template_image)
+    return jsonify({"success": True, "data": {"template_id": key}}), 201
 
-    # Remove the prefix (data:image/png;base64,) if it exists
-    if trace_image.startswith('data:image/png;base64,'):
-        trace_image = trace_image.replace('data:image/png;base64,', '')
-    if template_image.startswith('data:image/png;base64,'):
-        template_image = template_image.replace('data:image/png;base64,', '')
+@app.route('/submit-images', methods=["POST"])
+def submit_images():
+    try:
+        trace_image, template_image, age, run_async = read_submission()
+    except UploadError as e:
+        return jsonify({"success": False, "error": str(e)}), e.status
+
+    # Asynchronous mode: answer 202 with a job id right away; poll /jobs/<id>
+    if run_async:
+        if not ASYNC_SUBMISSIONS:
+            return jsonify({"success": False, "error": "async needs a shared job store with several server workers (RECORD_CACHE=redis)"}), 400
+        try:
+            job_id = jobs.submit(score_images, trace_image, template_image, age)
+        except JobQueueFullError as e:
+            response = jsonify({"success": False, "error": str(e)})
+            response.headers["Retry-After"] = str(e.retry_after)
+            return response, 503
+        response = jsonify({"success": True, "data": {"job_id": job_id, "status": "queued"}})
+        response.headers["Location"] = f"/jobs/{job_id}"
+        return response, 202
 
     try:
-        severity_score, mean_tremor, dtw_distance = model.run_inference(trace_image, template_image, age)
-        print("Severity Score:", severity_score, "Mean Tremor:", mean_tremor, "DTW Distance:", dtw_distance)
+        result = score_images(trace_image, template_image, age)
+    except InferenceBusyError as e:
+        response = jsonify({"success": False, "error": str(e)})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 503
+    except InferenceTimeoutError as e:
+        return jsonify({"success": False, "error": str(e)}), 504
     except Exception as e:
-        print(str(e))
+        app.logger.error(f"error running model inference: {str(e)}")
         return jsonify({"success": False, "error": "Error running model inference:" +  str(e)}), 500
     
-    return jsonify({"success": True, "data": {
+    return jsonify({"success": True, "data": result}), 201
+
+def score_images(trace_image, template_image, age):
+    severity_score, mean_tremor, dtw_distance = model.run_inference(trace_image, template_image, age)
+    payload = score_payload(severity_score, mean_tremor, dtw_distance)
+    # Timestamped strokes also get pen kinematics (speed, jerk, 4-12 Hz tremor power)
+    kinematics = model.kinematic_features(trace_image)
+    if kinematics is not None:
+        payload["kinematics"] = {name: str(value) for name, value in kinematics.items()}
+    return payload
+
+def score_payload(severity_score, mean_tremor, dtw_distance):
+    return {
         "severity_score": str(severity_score),
         "mean_tremor": str(mean_tremor),
         "dtw_distance": str(dtw_distance)
-        }
-    }), 201
+    }
+
+@app.route('/jobs/<job_id>', methods=["GET"])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Job not found or expired"}), 404
+
+    data = {"job_id": job_id, "status": job["status"]}
+    if "result" in job:
+        data["data"] = job["result"]
+    if "error" in job:
+        data["error"] = "Error running model inference:" + job["error"]
+    return jsonify({"success": True, "data": data}), 200
+
+def batch_item(item):
+    """ (trace, template, age) of one /submit-images/batch item; raises UploadError if it is malformed. """
+    if not isinstance(item, dict) or 'trace' not in item or 'template' not in item or 'age' not in item:
+        raise UploadError("Invalid item: trace, template and age are required")
+    if not isinstance(item['trace'], str) or not isinstance(item['template'], str):
+        raise UploadError("Invalid item: trace and template must be base64 strings")
+    try:
+        age = float(item['age'])
+    except (TypeError, ValueError):
+        raise UploadError("Invalid item: age must be a number")
+    return strip_data_url(item['trace']), strip_data_url(item['template']), age
+
+@app.route('/submit-images/batch', methods=["POST"])
+def submit_images_batch():
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else data
+
+    if not isinstance(items, list) or not items:
+        return jsonify({"success": False, "error": "Invalid request: expected a non-empty list of items"}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"success": False, "error": f"Too many items: at most {BATCH_MAX_ITEMS} per batch"}), 413
+
+    # Items that are malformed are reported individually; the rest are scored together.
+    results = [None] * len(items)
+    valid, inputs = [], []
+    for index, item in enumerate(items):
+        try:
+            inputs.append(batch_item(item))
+            valid.append(index)
+        except UploadError as e:
+            results[index] = {"index": index, "success": False, "error": str(e)}
+
+    try:
+        outcomes = model.run_inference_batch(inputs)
+    except Exception as e:
+        app.logger.error(f"error running batch inference: {str(e)}")
+        return jsonify({"success": False, "error": "Error running model inference:" + str(e)}), 500
+
+    for index, outcome in zip(valid, outcomes):
+        if isinstance(outcome, Exception):
+            results[index] = {"index": index, "success": False, "error": "Error running model inference:" + str(outcome)}
+        else:
+            results[index] = {"index": index, "success": True, "data": score_payload(*outcome)}
+
+    return jsonify({"success": True, "data": results}), 201
+
+@app.route('/debug/diagnostics', methods=["GET"])
+def list_diagnostics():
+    from model.diagnostics import MemoryDiagnosticsSink  # imports cv2, which is slow to import
+    if not isinstance(model.diagnostics, MemoryDiagnosticsSink):
+        return jsonify({"success": False, "error": "In-memory diagnostics are disabled (set DIAGNOSTICS=memory)"}), 404
+    records = [{"id": request_id, "created_at": datetime.datetime.fromtimestamp(ts).isoformat(), "artifacts": names}
+               for request_id, ts, names in model.diagnostics.list()]
+    return jsonify({"success": True, "data": records}), 200
+
+@app.route('/debug/diagnostics/<request_id>/<name>', methods=["GET"])
+def get_diagnostic(request_id, name):
+    from model.diagnostics import MemoryDiagnosticsSink  # imports cv2, which is slow to import
+    if not isinstance(model.diagnostics, MemoryDiagnosticsSink):
+        return jsonify({"success": False, "error": "In-memory diagnostics are disabled (set DIAGNOSTICS=memory)"}), 404
+    artifact = model.diagnostics.get(request_id, name)
+    if artifact is None:
+        return jsonify({"success": False, "error": "Diagnostics not found"}), 404
+    response = make_response(artifact)
+    response.headers["Content-Type"] = "image/png"
+    return response
 
 @app.route('/gemini_report/<patient_id>', methods=["GET"])
 def gemini_report(patient_id):
     try:
-        patient_info = supabase.table("patients").select("*").eq('id', patient_id).execute()
-        assessment_info = supabase.table("assessments").select("*").eq('patientId', 7).execute()
+        # Both queries at once, for this patient (not a fixed one)
+        patient, assessment_rows = db.patient_with_assessments(patient_id)
 
-        if not patient_info.data or not assessment_info.data:
+        if patient is None or not assessment_rows:
             return jsonify({"success": False, "error": "Patient/Assessment not found"}), 404
         
         
@@ -358,14 +816,15 @@ def gemini_report(patient_id):
         app.logger.error(f"error fetching patient data: {str(e)}")
         return jsonify({"success": False, "error": str(e)}), 500
     
-    name = patient_info.data[0]['fName'] + " " + patient_info.data[0]['lName']
-    age = patient_info.data[0]['age']
-    sex = patient_info.data[0]['gender']
-    phone_number = patient_info.data[0]['contactPhone']
-    email = patient_info.data[0]['email']
-    notes = patient_info.data[0]['notes']
-    treatments = patient_info.data[0]['medication']
-    assessments = patient_info.data[0]
+    name = patient['fName'] + " " + patient['lName']
+    age = patient['age']
+    sex = patient['gender']
+    phone_number = patient['contactPhone']
+    email = patient['email']
+    notes = patient['notes']
+    treatments = patient['medication']
+    # In a stable order, so the same rows always make the same prompt
+    assessments = sorted(assessment_rows, key=lambda row: (str(row.get('date')), str(row.get('id'))))
 
     prompt = f"""
     Generate a markdown report summarizing a Parkinson's disease patient's medical history and assessment data in a consistent, medically helpful format. The report must include the following sections in this exact order, using the provided data:
@@ -424,12 +883,24 @@ def gemini_report(patient_id):
     [Specific, data-driven advice for next steps in patient care.]
     """
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash", 
-        contents=prompt
-    )
+    def generate():
+        with metrics.span("gemini"):
+            response = client.models.generate_content(
+                model=REPORT_MODEL, 
+                contents=prompt
+            )
+        return response.text[12:len(response.text)-4]
+
+    # The prompt holds every input of the report, so any change to the
+    # patient's record or assessments makes a new key
+    key = hashlib.sha256(f"{REPORT_MODEL}\n{prompt}".encode()).hexdigest()
+    try:
+        report = reports.get_or_compute(key, generate)
+    except Exception as e:
+        app.logger.error(f"error generating report: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 502
 
-    return jsonify({"success": True, "response": response.text[12:len(response.text)-4]}), 201
+    return jsonify({"success": True, "response": report}), 201
 
 
 if __name__ == '__main__':
@@ -0,0 +1,263 @@
+import datetime
+import json
+
+import numpy as np
+
+from db import DatabaseError
+
+# Bulk ingestion for /patients/bulk and /assessments/bulk.
+#
+# Migrating a clinic's history or syncing an offline tablet used to take one
+# /add_patient or /add-assessment request per row. A bulk request carries the
+# rows as a JSON array or as NDJSON (one object per line). read_rows() parses
+# them, validate_patients() / validate_assessments() check every row in one
+# column-wise pass with pandas, and insert_in_chunks() writes the valid rows
+# chunk_size at a time. Problems are reported per row, by the row's index in
+# the request, and an Idempotency-Key lets a client retry a request without
+# inserting its rows twice (IdempotencyKeys).
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/json-lines")
+
+
+class BulkError(Exception):
+    """ A bulk request that can't be processed at all; status is the HTTP status to answer with. """
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def read_rows(body: bytes, mimetype: str, max_rows: int):
+    """
+    The objects of a JSON array or NDJSON body, as (rows, errors): rows keeps
+    the request's indices, with None where an item is not a JSON object, and
+    errors is a list of {"index": i, "error": message}.
+    """
+    if mimetype in NDJSON_TYPES:
+        items = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                items.append(ValueError(f"Invalid JSON: {e}"))
+    else:
+        try:
+            items = json.loads(body)
+        except ValueError as e:
+            raise BulkError(f"Invalid JSON: {e}")
+        if not isinstance(items, list):
+            raise BulkError("Expected a JSON array of rows, or NDJSON")
+    if not items:
+        raise BulkError("No rows provided")
+    if len(items) > max_rows:
+        raise BulkError(f"Too many rows: {len(items)} (limit {max_rows})", 413)
+
+    rows, errors = [], []
+    for index, item in enumerate(items):
+        if isinstance(item, dict):
+            rows.append(item)
+            continue
+        rows.append(None)
+        errors.append({"index": index, "error": str(item) if isinstance(item, ValueError) else "Row is not a JSON object"})
+    return rows, errors
+
+
+class _Checks:
+    """ The rows as a DataFrame, and the error messages collected for them column by column. """
+    def __init__(self, rows, columns):
+        import pandas as pd  # only needed here, and slow to import
+        self.pd = pd
+        self.frame = pd.DataFrame.from_records([row or {} for row in rows], columns=columns)
+        self.messages = [[] if row is not None else None for row in rows]
+
+    def flag(self, mask, message: str):
+        for index in np.flatnonzero(np.asarray(mask, dtype=bool)):
+            if self.messages[index] is not None:
+                self.messages[index].append(message)
+
+    def present(self, column: str):
+        values = self.frame[column]
+        blank = values.astype("string").str.strip().eq("").fillna(False)
+        return ~(values.isna() | blank).to_numpy()
+
+    def required(self, columns):
+        for column in columns:
+            self.flag(~self.present(column), f"Missing {column}")
+
+    def number(self, column: str, integer: bool = False):
+        """ The column as float64 (NaN where missing or invalid), flagging values that aren't numbers. """
+        values = self.pd.to_numeric(self.frame[column], errors="coerce").to_numpy(dtype=np.float64)
+        invalid = self.present(column) & ~np.isfinite(values)
+        if integer:
+            invalid |= np.isfinite(values) & (values != np.floor(values))
+        self.flag(invalid, f"{column} must be {'an integer' if integer else 'a number'}")
+        return values
+
+    def date(self, column: str):
+        """ The column parsed as YYYY-MM-DD dates (NaT where missing or invalid), flagging invalid ones. """
+        dates = self.pd.to_datetime(self.frame[column].astype("string"), format="%Y-%m-%d", errors="coerce")
+        self.flag(self.present(column) & dates.isna().to_numpy(), f"{column} must be a date (YYYY-MM-DD)")
+        return dates
+
+    @staticmethod
+    def iso(dates):
+        """ The dates as a list of "YYYY-MM-DD" strings, None where missing. """
+        return [date if isinstance(date, str) else None for date in dates.dt.strftime("%Y-%m-%d").astype(object)]
+
+    def result(self, build):
+        """ ([(index, build(index)) for valid rows], [{"index", "error"} for the others]) """
+        valid, errors = [], []
+        for index, messages in enumerate(self.messages):
+            if messages:
+                errors.append({"index": index, "error": "; ".join(messages)})
+            elif messages is not None:
+                valid.append((index, build(index)))
+        return valid, errors
+
+
+# Fields of a patient row copied as given, as /add_patient does
+PATIENT_FIELDS = ("fName", "lName", "gender", "email", "phoneNum", "address", "contactName",
+                  "diagnosis", "severity", "medHist")
+
+
+def validate_patients(rows, today: datetime.date = None):
+    """ Patient rows as /add_patient builds them, age included: (valid (index, row)s, errors). """
+    today = today or datetime.date.today()
+    checks = _Checks(rows, ["fName", "lName", "bDate"])
+    checks.required(["fName", "lName", "bDate"])
+    births = checks.date("bDate")
+    # Whole years since the birth date
+    month, day = births.dt.month.to_numpy(), births.dt.day.to_numpy()
+    before_birthday = (month > today.month) | ((month == today.month) & (day > today.day))
+    ages = today.year - births.dt.year.to_numpy() - before_birthday
+    birth_dates = checks.iso(births)
+
+    def build(index):
+        data = rows[index]
+        medication = data.get("medication")
+        row = {field: data.get(field) for field in PATIENT_FIELDS}
+        row.update({
+            "birthDate": birth_dates[index],
+            "age": int(ages[index]),
+            "contactPhone": data.get("contactNum"),
+            "medication": medication if isinstance(medication, list) else [] if medication is None else [medication],
+            "notes": [],
+        })
+        return row
+    return checks.result(build)
+
+
+def validate_assessments(rows):
+    """ Assessment rows as /add-assessment builds them: (valid (index, row)s, errors). """
+    checks = _Checks(rows, ["date", "type", "patientId", "severity", "tremor", "deviation"])
+    checks.required(["patientId", "severity", "tremor", "deviation"])
+    dates = checks.iso(checks.date("date"))
+    patient_ids = checks.number("patientId", integer=True)
+    scores = {column: checks.number(column) for column in ("severity", "tremor", "deviation")}
+
+    def build(index):
+        return {
+            "date": dates[index],
+            "type": rows[index].get("type"),
+            "patientId": int(patient_ids[index]),
+            **{column: float(values[index]) for column, values in scores.items()},
+        }
+    return checks.result(build)
+
+
+def insert_in_chunks(insert, indexed_rows, chunk_size: int):
+    """
+    Inserts [(index, row)] with insert(rows), chunk_size rows per call.
+    Returns ({index: inserted row}, errors). When the database rejects a
+    chunk's data (a 4xx answer), its rows are retried one by one so only
+    the bad ones fail; any other error fails the whole chunk.
+    """
+    inserted, errors = {}, []
+    for start in range(0, len(indexed_rows), chunk_size):
+        chunk = indexed_rows[start:start + chunk_size]
+        try:
+            inserted.update(zip([index for index, _ in chunk], insert([row for _, row in chunk])))
+        except DatabaseError as e:
+            if len(chunk) > 1 and e.status is not None and 400 <= e.status < 500:
+                more, failed = insert_in_chunks(insert, chunk, 1)
+                inserted.update(more)
+                errors += failed
+            else:
+                errors += [{"index": index, "error": str(e), "retryable": _retryable(e)} for index, _ in chunk]
+    return inserted, errors
+
+
+def _retryable(e: DatabaseError) -> bool:
+    return e.status is None or e.status >= 500
+
+
+def ingest(body: bytes, mimetype: str, validate, insert, chunk_size: int, max_rows: int):
+    """
+    Parses, validates and inserts a bulk request: (HTTP status, response).
+    201 when every row was inserted, 207 when only some were, 400 when none
+    were because of the rows, 502 when none were because of the database.
+    """
+    rows, errors = read_rows(body, mimetype, max_rows)
+    valid, invalid = validate(rows)
+    inserted, failed = insert_in_chunks(insert, valid, chunk_size)
+    errors = sorted(errors + invalid + failed, key=lambda error: error["index"])
+
+    if not errors:
+        status = 201
+    elif inserted:
+        status = 207
+    else:
+        status = 502 if any(error.get("retryable") for error in errors) else 400
+    response = {
+        "success": not errors,
+        "data": {
+            "received": len(rows),
+            "inserted": len(inserted),
+            "failed": len(errors),
+            "ids": [inserted[index].get("id") if index in inserted else None for index in range(len(rows))],
+        },
+        "errors": errors,
+    }
+    if errors:
+        response["error"] = f"{len(errors)} of {len(rows)} rows were not inserted"
+    return status, response
+
+
+class IdempotencyKeys:
+    """
+    Responses to bulk requests by Idempotency-Key, kept in store for ttl
+    seconds, so a retried request is answered from here instead of
+    inserting its rows again. Reusing a key with a different body, or while
+    its first request is running, is refused.
+
+    store needs get / set / add / delete, with add() setting a key only if
+    it is absent, atomically: a cache.TTLCache within one process, or a
+    cache.RedisBackend (SET NX) to share the keys between server workers.
+    A claimed key holds a pending marker until the response is stored;
+    the marker expires after pending_ttl seconds in case its worker died.
+    """
+    def __init__(self, store, ttl: float, pending_ttl: float = 600.0):
+        self.store = store
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+
+    def claim(self, key: str, fingerprint: str):
+        """ The stored (status, response) to replay, or None once the caller may process the request. """
+        while not self.store.add(key, {"fingerprint": fingerprint, "pending": True}, self.pending_ttl):
+            stored = self.store.get(key)
+            if stored is None:
+                continue  # expired or released since add(); claim it again
+            if stored["fingerprint"] != fingerprint:
+                raise BulkError("Idempotency-Key was already used with a different request", 422)
+            if stored.get("pending"):
+                raise BulkError("A request with this Idempotency-Key is still being processed", 409)
+            return stored["status"], stored["response"]
+        return None
+
+    def complete(self, key: str, fingerprint: str, status: int, response: dict):
+        self.store.set(key, {"fingerprint": fingerprint, "status": status, "response": response}, self.ttl)
+
+    def release(self, key: str):
+        """ Forgets a claimed key without storing a response, so the request can be retried. """
+        self.store.delete(key)
@@ -0,0 +1,327 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Small caches shared by the app's features.
+
+
+class TTLCache:
+    """
+    Thread-safe mapping that keeps at most maxsize entries, each for at most
+    ttl seconds. Expired entries are dropped lazily; when full, the least
+    recently used entry is evicted.
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def add(self, key, value, ttl: float = None) -> bool:
+        """ set(), unless key already has an entry; True if it was set. """
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and item[0] > time.monotonic():
+                return False
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            self._evict()
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _evict(self):
+        now = time.monotonic()
+        expired = [key for key, (expires_at, _) in self._entries.items() if expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class RedisBackend:
+    """
+    ReadThroughCache backend shared by all workers, on a Redis client (or
+    anything with its get / set(ex=) / delete / eval / pipeline). Values are
+    stored as JSON.
+
+    Each key also has a generation counter in Redis, which invalidate()
+    increments. A load stores its value only if the generation it read
+    before loading is still current, checked and set in one script, so a
+    write in any worker keeps the loads running in every other worker from
+    putting back the data it replaced.
+    """
+    # Seconds a generation counter outlives its last invalidation; far
+    # longer than any load
+    GENERATION_TTL = 86400
+
+    _SET_IF_GENERATION = """
+    if tonumber(redis.call('GET', KEYS[2]) or '0') ~= tonumber(ARGV[2]) then
+        return 0
+    end
+    if tonumber(ARGV[3]) > 0 then
+        redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+    else
+        redis.call('SET', KEYS[1], ARGV[1])
+    end
+    return 1
+    """
+
+    def __init__(self, client, prefix: str = "trace:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key, default=None):
+        data = self.client.get(self.prefix + key)
+        return default if data is None else json.loads(data)
+
+    def set(self, key, value, ttl: float = None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=max(1, int(ttl)) if ttl else None)
+
+    def add(self, key, value, ttl: float = None) -> bool:
+        """ set(), unless key already has a value (SET NX); True if it was set. """
+        return bool(self.client.set(self.prefix + key, json.dumps(value), ex=max(1, int(ttl)) if ttl else None, nx=True))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def generation(self, key) -> int:
+        return int(self.client.get(self._generation_key(key)) or 0)
+
+    def set_if_generation(self, key, value, ttl: float, generation: int) -> bool:
+        """ set(), unless key was invalidated since generation(key) returned generation. """
+        return bool(self.client.eval(self._SET_IF_GENERATION, 2, self.prefix + key, self._generation_key(key),
+                                     json.dumps(value), generation, max(1, int(ttl)) if ttl else 0))
+
+    def invalidate(self, key):
+        """ Deletes key and moves its generation on, in one transaction. """
+        pipe = self.client.pipeline()
+        pipe.incr(self._generation_key(key))
+        pipe.expire(self._generation_key(key), self.GENERATION_TTL)
+        pipe.delete(self.prefix + key)
+        pipe.execute()
+
+    def _generation_key(self, key) -> str:
+        return self.prefix + "generation:" + key
+
+
+def etag_of(value) -> str:
+    """ Strong ETag (unquoted) of a JSON-serializable value. """
+    data = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str).encode()
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+class ReadThroughCache:
+    """
+    Caches loader results under string keys, with their ETag, for ttl
+    seconds in backend (a TTLCache, RedisBackend or None for no caching).
+    invalidate() drops keys; a load that was in flight when its key was
+    invalidated is not stored, so it can't put back data older than the write.
+    With a RedisBackend that holds across workers (its generation counters);
+    otherwise it only covers loads in this process, which is all a per-process
+    TTLCache can see anyway.
+    """
+    def __init__(self, backend=None, ttl: float = 30.0):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._loading = {}  # key -> tokens of the loads in flight that are still valid
+        self._lock = threading.Lock()
+        self._shared = hasattr(backend, "set_if_generation")
+
+    def get_or_load(self, key: str, loader, cache_if=lambda value: True):
+        """ (value, etag) for key, calling loader() on a miss; values failing cache_if are not stored. """
+        if self.backend is not None:
+            cached = self.backend.get(key)
+            if cached is not None:
+                with self._lock:
+                    self.hits += 1
+                return cached[0], cached[1]
+
+        with self._lock:
+            self.misses += 1
+        if self._shared:
+            # Read before loading: any invalidation from here on makes it stale
+            generation = self.backend.generation(key)
+            value = loader()
+            etag = etag_of(value)
+            if cache_if(value):
+                self.backend.set_if_generation(key, [value, etag], self.ttl, generation)
+            return value, etag
+
+        token = object()
+        with self._lock:
+            self._loading.setdefault(key, set()).add(token)
+        try:
+            value = loader()
+        finally:
+            with self._lock:
+                tokens = self._loading.get(key, set())
+                valid = token in tokens
+                tokens.discard(token)
+                if not tokens:
+                    self._loading.pop(key, None)
+        etag = etag_of(value)
+        if valid and self.backend is not None and cache_if(value):
+            self.backend.set(key, [value, etag], self.ttl)
+        return value, etag
+
+    def invalidate(self, *keys: str):
+        for key in keys:
+            if self._shared:
+                self.backend.invalidate(key)
+                continue
+            with self._lock:
+                self._loading.pop(key, None)
+            if self.backend is not None:
+                self.backend.delete(key)
+
+
+class SingleFlightCache:
+    """
+    Caches the results of an expensive compute() (e.g. an LLM call) under
+    string keys in backend (a TTLCache), and coalesces concurrent calls for
+    the same missing key: one caller computes while the others wait for its
+    result, or its exception, instead of starting their own computation.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._running = {}  # key -> Future of the computation in flight
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: str, compute):
+        value = self.backend.get(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value
+
+        with self._lock:
+            future = self._running.get(key)
+            leader = future is None
+            if leader:
+                future = self._running[key] = Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            self.backend.set(key, value)
+            future.set_result(value)
+        finally:
+            with self._lock:
+                self._running.pop(key, None)
+        return value
+
+
+def cache_backend_from_env():
+    """
+    The backend named by RECORD_CACHE: "memory" (default; a TTLCache of
+    RECORD_CACHE_SIZE entries per process), "redis" (shared, at
+    RECORD_CACHE_REDIS_URL) or "off". With "memory", a write only invalidates
+    the cache of the worker that handled it; the others can serve the old
+    record for up to RECORD_CACHE_TTL seconds. Use "redis" with several
+    workers when that matters.
+    """
+    mode = os.environ.get("RECORD_CACHE", "memory").lower()
+    if mode == "redis":
+        try:
+            import redis
+            return RedisBackend(redis.Redis.from_url(os.environ.get("RECORD_CACHE_REDIS_URL", "redis://localhost:6379/0")))
+        except ImportError:
+            print("Warning: RECORD_CACHE=redis needs the redis package; using the in-process cache", file=sys.stderr)
+            mode = "memory"
+    if mode == "memory":
+        return TTLCache(maxsize=int(os.environ.get("RECORD_CACHE_SIZE", "4096")), ttl=float(os.environ.get("RECORD_CACHE_TTL", "30")))
+    if mode not in ("off", "", "0", "false"):
+        print(f"Warning: unknown RECORD_CACHE mode {mode!r}, record cache disabled", file=sys.stderr)
+    return None
+
+
+if __name__ == "__main__":
+    # Concurrent misses for one key make a single call; the others get its result
+    calls = []
+
+    def slow_report():
+        calls.append(1)
+        time.sleep(0.2)
+        return "report"
+
+    flights = SingleFlightCache(TTLCache(maxsize=8, ttl=60))
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.get_or_compute("k", slow_report)))
+               for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["report"] * 16 and len(calls) == 1, (results, calls)
+    assert flights.get_or_compute("k", slow_report) == "report" and len(calls) == 1
+    assert (flights.misses, flights.coalesced, flights.hits) == (1, 15, 1)
+
+    # A failure reaches every waiter and isn't cached
+    def failing():
+        time.sleep(0.1)
+        raise RuntimeError("upstream down")
+    errors = []
+
+    def call():
+        try:
+            flights.get_or_compute("f", failing)
+        except RuntimeError as e:
+            errors.append(str(e))
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == ["upstream down"] * 4 and flights.backend.get("f") is None
+    print("cache: all checks passed")
@@ -0,0 +1,581 @@
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from urllib.parse import unquote
+
+import httpx
+
+from model import metrics
+
+# Data access for the app's Supabase tables.
+#
+# Routes used to call supabase.table(...).execute() on one module-global
+# client, one blocking query after the other. Here each operation is a Query
+# (a PostgREST request: select, insert, update or rpc) and the operations on
+# patients and assessments are written once, against three executors:
+#   Database          httpx.Client with an explicitly sized keep-alive pool;
+#                     gather() runs independent queries on parallel threads
+#   AsyncDatabase     the same over httpx.AsyncClient, for async servers
+#   InMemoryDatabase  tables in memory, answering the same Queries; its
+#                     transport() also serves them over HTTP as a local
+#                     PostgREST stand-in for Database/AsyncDatabase
+# Every round trip is timed as the "supabase" stage (see model/metrics.py).
+
+OPERATORS = ("eq", "neq", "gt", "gte", "lt", "lte", "in", "is")
+
+# Patient columns holding JSON arrays that append_to_patient can extend
+APPENDABLE = ("notes", "medication")
+
+
+class DatabaseError(Exception):
+    """ A query failed; status is the HTTP status of the answer, if there was one. """
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+class Query:
+    """
+    One PostgREST request. kind is "select", "insert", "update" or "rpc";
+    table is the table (or function) name. filters is a list of
+    (column, operator, value); order a PostgREST order ("date.desc,id.asc").
+    single queries return their first row, or None.
+    """
+    def __init__(self, kind: str, table: str, columns: str = "*", filters=(), order: str = None,
+                 limit: int = None, body=None, single: bool = False):
+        if kind not in ("select", "insert", "update", "rpc"):
+            raise ValueError(f"Unknown query kind: {kind}")
+        for _, op, _ in filters:
+            if op not in OPERATORS:
+                raise ValueError(f"Unknown filter operator: {op}")
+        self.kind = kind
+        self.table = table
+        self.columns = columns
+        self.filters = list(filters)
+        self.order = order
+        self.limit = limit
+        self.body = body
+        self.single = single
+
+    def request(self):
+        """ (method, path under /rest/v1, query params, JSON body, headers) """
+        params = [("select", self.columns)] if self.kind != "rpc" else []
+        params += [(column, f"{op}.{_encode(value)}") for column, op, value in self.filters]
+        if self.order:
+            params.append(("order", self.order))
+        if self.limit is not None:
+            params.append(("limit", str(self.limit)))
+        headers = {"Prefer": "return=representation"} if self.kind in ("insert", "update") else {}
+        method = {"select": "GET", "insert": "POST", "update": "PATCH", "rpc": "POST"}[self.kind]
+        path = f"/rpc/{self.table}" if self.kind == "rpc" else f"/{self.table}"
+        return method, path, params, self.body, headers
+
+    @classmethod
+    def from_request(cls, method: str, path: str, params, body) -> "Query":
+        """ Inverse of request(), for serving Queries from HTTP requests (filter values stay strings). """
+        name = path.rstrip("/").rsplit("/", 1)[-1]
+        if "/rpc/" in path:
+            return cls("rpc", name, body=body)
+        kind = {"GET": "select", "POST": "insert", "PATCH": "update"}.get(method)
+        if kind is None:
+            raise ValueError(f"Unsupported method: {method}")
+        columns, order, limit, filters = "*", None, None, []
+        for key, value in params:
+            if key == "select":
+                columns = value
+            elif key == "order":
+                order = value
+            elif key == "limit":
+                limit = int(value)
+            else:
+                op, _, operand = value.partition(".")
+                filters.append((key, op, _decode(op, operand)))
+        return cls(kind, name, columns, filters, order, limit, body)
+
+    def result(self, rows):
+        return (rows[0] if rows else None) if self.single else rows
+
+
+def _encode(value) -> str:
+    if isinstance(value, (list, tuple)):
+        return "(" + ",".join(_encode(v) for v in value) + ")"
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _decode(op: str, operand: str):
+    if op == "in":
+        return [unquote(v) for v in operand.strip("()").split(",") if v != ""]
+    if op == "is":
+        return {"null": None, "true": True, "false": False}.get(operand, operand)
+    return unquote(operand)
+
+
+class _Operations:
+    """
+    The app's queries, written once for every executor. Each returns
+    self._run(query): the result itself for synchronous executors, an
+    awaitable for AsyncDatabase.
+    """
+    def _run(self, query: Query):
+        raise NotImplementedError
+
+    def list_patients(self, columns: str = "*"):
+        return self._run(Query("select", "patients", columns))
+
+    def get_patient(self, patient_id, columns: str = "*"):
+        """ The patient's row, or None. """
+        return self._run(Query("select", "patients", columns, [("id", "eq", patient_id)], single=True))
+
+    def insert_patient(self, row: dict):
+        return self._run(Query("insert", "patients", body=row))
+
+    def insert_patients(self, rows: list):
+        """ Inserts rows (all with the same keys) in one statement; the inserted rows, in order. """
+        return self._run(Query("insert", "patients", body=rows))
+
+    def update_patient(self, patient_id, fields: dict):
+        """ The updated rows (empty if there is no such patient). """
+        return self._run(Query("update", "patients", filters=[("id", "eq", patient_id)], body=fields))
+
+    def list_assessments(self, columns: str = "*"):
+        return self._run(Query("select", "assessments", columns))
+
+    def get_assessments(self, patient_id, columns: str = "*"):
+        return self._run(Query("select", "assessments", columns, [("patientId", "eq", patient_id)]))
+
+    def insert_assessment(self, row: dict):
+        return self._run(Query("insert", "assessments", body=row))
+
+    def insert_assessments(self, rows: list):
+        """ Inserts rows (all with the same keys) in one statement; the inserted rows, in order. """
+        return self._run(Query("insert", "assessments", body=rows))
+
+    def append_to_patient(self, patient_id, column: str, item):
+        """
+        Appends item to one of the patient's APPENDABLE array columns in a
+        single atomic statement (the append_patient_item function, see
+        supabase/migrations), sending only the new element. Returns the
+        updated rows: empty if there is no such patient.
+        """
+        if column not in APPENDABLE:
+            raise ValueError(f"Can't append to {column}")
+        return self._run(Query("rpc", "append_patient_item",
+                               body={"patient_id": patient_id, "list_column": column, "item": item}))
+
+    def select_page(self, table: str, columns: str = "*", filters=(), after=None, limit: int = 100):
+        """ Up to limit rows of table in id order, starting after id `after` (keyset pagination). """
+        if after is not None:
+            filters = list(filters) + [("id", "gt", after)]
+        return self._run(Query("select", table, columns, filters, order="id.asc", limit=limit))
+
+
+class _SyncOperations(_Operations):
+    _executor = None
+
+    def gather(self, *calls):
+        """ Runs independent zero-argument calls concurrently; returns their results in order. """
+        if self._executor is None or len(calls) < 2:
+            return [call() for call in calls]
+
+        def timed(call):
+            with metrics.collect() as timings:
+                return call(), timings
+
+        outcomes = [future.result() for future in [self._executor.submit(timed, call) for call in calls]]
+        for _, timings in outcomes:
+            metrics.extend(timings)
+        return [result for result, _ in outcomes]
+
+    def iter_rows(self, table: str, columns: str = "*", filters=(), after=None, limit: int = None,
+                  batch: int = 500):
+        """
+        Rows of table in id order after id `after`, at most limit (all if
+        None), fetched batch rows per query so only one batch is held at a
+        time. columns must include id.
+        """
+        while limit is None or limit > 0:
+            size = batch if limit is None else min(batch, limit)
+            rows = self.select_page(table, columns, filters, after, size)
+            yield from rows
+            if len(rows) < size:
+                return
+            after = rows[-1]["id"]
+            if limit is not None:
+                limit -= len(rows)
+
+    def patient_with_assessments(self, patient_id):
+        """ (patient row or None, assessment rows), fetched concurrently. """
+        patient, assessments = self.gather(lambda: self.get_patient(patient_id),
+                                           lambda: self.get_assessments(patient_id))
+        return patient, assessments
+
+
+def _pool_limits(max_connections: int, max_keepalive: int, keepalive_expiry: float) -> httpx.Limits:
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive,
+                        keepalive_expiry=keepalive_expiry)
+
+
+def _headers(key: str) -> dict:
+    return {"apikey": key, "Authorization": f"Bearer {key}", "Accept": "application/json"}
+
+
+def _rows(response: httpx.Response):
+    if response.status_code >= 400:
+        try:
+            error = response.json()
+            message = error.get("message") or error.get("error") or response.text
+        except ValueError:
+            message = response.text
+        raise DatabaseError(message, response.status_code)
+    return response.json() if response.content else []
+
+
+class Database(_SyncOperations):
+    """
+    PostgREST client for url (the Supabase project URL) with a pool of at
+    most max_connections, max_keepalive of which are kept open between
+    requests. parallel is the number of threads gather() uses. transport
+    replaces the network, e.g. with InMemoryDatabase.transport().
+    """
+    def __init__(self, url: str, key: str, max_connections: int = 20, max_keepalive: int = 10,
+                 keepalive_expiry: float = 30.0, timeout: float = 10.0, parallel: int = 4,
+                 transport: httpx.BaseTransport = None):
+        if not url or not key:
+            raise DatabaseError("A database URL and key are required")
+        self._client = httpx.Client(base_url=f"{url.rstrip('/')}/rest/v1", headers=_headers(key),
+                                    limits=_pool_limits(max_connections, max_keepalive, keepalive_expiry),
+                                    timeout=timeout, transport=transport)
+        self._executor = ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="db") if parallel > 1 else None
+
+    @classmethod
+    def from_env(cls, transport: httpx.BaseTransport = None) -> "Database":
+        return cls(os.environ.get("SUPABASE_URL"), os.environ.get("SUPABASE_KEY"), **_settings_from_env(),
+                   parallel=int(os.environ.get("DB_PARALLEL", "4")), transport=transport)
+
+    def _run(self, query: Query):
+        method, path, params, body, headers = query.request()
+        with metrics.span("supabase"):
+            try:
+                response = self._client.request(method, path, params=params, json=body, headers=headers)
+            except httpx.HTTPError as e:
+                raise DatabaseError(f"Database request failed: {e}") from e
+            return query.result(_rows(response))
+
+    def close(self):
+        self._client.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+class AsyncDatabase(_Operations):
+    """ Database for asyncio code: every operation is a coroutine, and gather() is asyncio.gather. """
+    def __init__(self, url: str, key: str, max_connections: int = 20, max_keepalive: int = 10,
+                 keepalive_expiry: float = 30.0, timeout: float = 10.0,
+                 transport: httpx.AsyncBaseTransport = None):
+        if not url or not key:
+            raise DatabaseError("A database URL and key are required")
+        self._client = httpx.AsyncClient(base_url=f"{url.rstrip('/')}/rest/v1", headers=_headers(key),
+                                         limits=_pool_limits(max_connections, max_keepalive, keepalive_expiry),
+                                         timeout=timeout, transport=transport)
+
+    @classmethod
+    def from_env(cls, transport: httpx.AsyncBaseTransport = None) -> "AsyncDatabase":
+        return cls(os.environ.get("SUPABASE_URL"), os.environ.get("SUPABASE_KEY"), **_settings_from_env(),
+                   transport=transport)
+
+    async def _run(self, query: Query):
+        method, path, params, body, headers = query.request()
+        with metrics.span("supabase"):
+            try:
+                response = await self._client.request(method, path, params=params, json=body, headers=headers)
+            except httpx.HTTPError as e:
+                raise DatabaseError(f"Database request failed: {e}") from e
+            return query.result(_rows(response))
+
+    async def gather(self, *awaitables):
+        return list(await asyncio.gather(*awaitables))
+
+    async def patient_with_assessments(self, patient_id):
+        patient, assessments = await self.gather(self.get_patient(patient_id), self.get_assessments(patient_id))
+        return patient, assessments
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+class CachedDatabase:
+    """
+    A synchronous database with a read-through cache (cache.ReadThroughCache)
+    in front of single-patient and per-patient assessment reads. Its write
+    operations invalidate exactly the entries they change; everything else
+    is passed through to db. Other processes sharing an in-process backend
+    only see a write once their entry expires.
+    """
+    def __init__(self, db, cache):
+        self.db = db
+        self.cache = cache
+
+    def __getattr__(self, attr):
+        return getattr(self.db, attr)
+
+    @staticmethod
+    def _patient_key(patient_id) -> str:
+        return f"patient:{patient_id}"
+
+    @staticmethod
+    def _assessments_key(patient_id) -> str:
+        return f"assessments:{patient_id}"
+
+    def patient(self, patient_id):
+        """ (patient row or None, its ETag); missing patients are not cached. """
+        return self.cache.get_or_load(self._patient_key(patient_id), lambda: self.db.get_patient(patient_id),
+                                      cache_if=lambda row: row is not None)
+
+    def assessments(self, patient_id):
+        """ (the patient's assessment rows, their ETag) """
+        return self.cache.get_or_load(self._assessments_key(patient_id), lambda: self.db.get_assessments(patient_id))
+
+    def get_patient(self, patient_id, columns: str = "*"):
+        if columns != "*":
+            return self.db.get_patient(patient_id, columns)
+        return self.patient(patient_id)[0]
+
+    def get_assessments(self, patient_id, columns: str = "*"):
+        if columns != "*":
+            return self.db.get_assessments(patient_id, columns)
+        return self.assessments(patient_id)[0]
+
+    def patient_with_assessments(self, patient_id):
+        patient, assessments = self.db.gather(lambda: self.get_patient(patient_id),
+                                              lambda: self.get_assessments(patient_id))
+        return patient, assessments
+
+    # Writes: invalidate after the write, so a concurrent read can't re-cache the old row
+
+    def update_patient(self, patient_id, fields: dict):
+        try:
+            return self.db.update_patient(patient_id, fields)
+        finally:
+            self.cache.invalidate(self._patient_key(patient_id))
+
+    def append_to_patient(self, patient_id, column: str, item):
+        try:
+            return self.db.append_to_patient(patient_id, column, item)
+        finally:
+            self.cache.invalidate(self._patient_key(patient_id))
+
+    def insert_assessment(self, row: dict):
+        try:
+            return self.db.insert_assessment(row)
+        finally:
+            self.cache.invalidate(self._assessments_key(row.get("patientId")))
+
+    def insert_assessments(self, rows: list):
+        try:
+            return self.db.insert_assessments(rows)
+        finally:
+            self.cache.invalidate(*{self._assessments_key(row.get("patientId")) for row in rows})
+
+
+def _settings_from_env() -> dict:
+    return {
+        "max_connections": int(os.environ.get("DB_POOL_SIZE", "20")),
+        "max_keepalive": int(os.environ.get("DB_POOL_KEEPALIVE", "10")),
+        "keepalive_expiry": float(os.environ.get("DB_KEEPALIVE_SECONDS", "30")),
+        "timeout": float(os.environ.get("DB_TIMEOUT", "10")),
+    }
+
+
+class InMemoryDatabase(_SyncOperations):
+    """
+    Tables as lists of dicts, answering Queries like PostgREST would (ids are
+    assigned on insert). For tests and local development; thread-safe.
+    """
+    def __init__(self, tables: Optional[dict] = None, parallel: int = 4):
+        self.tables = {name: [dict(row) for row in rows] for name, rows in (tables or {}).items()}
+        # rpc name -> fn(db, **params), run under the lock like a transaction
+        self.functions = {"append_patient_item": _append_patient_item}
+        self.queries = 0
+        self._next_id = {}
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="db") if parallel > 1 else None
+
+    def _run(self, query: Query):
+        with self._lock:
+            self.queries += 1
+            return query.result(self._execute(query))
+
+    def _execute(self, query: Query):
+        if query.kind == "rpc":
+            fn = self.functions.get(query.table)
+            if fn is None:
+                raise DatabaseError(f"Unknown function: {query.table}", 404)
+            return fn(self, **(query.body or {}))
+
+        table = self.tables.setdefault(query.table, [])
+        if query.kind == "insert":
+            inserted = []
+            for row in query.body if isinstance(query.body, list) else [query.body]:
+                row = dict(row)
+                if "id" not in row:
+                    row["id"] = self._new_id(query.table)
+                table.append(row)
+                inserted.append(row)
+            return [self._project(row, query.columns) for row in inserted]
+
+        rows = [row for row in table if all(_matches(row.get(column), op, value)
+                                            for column, op, value in query.filters)]
+        if query.kind == "update":
+            for row in rows:
+                row.update(json.loads(json.dumps(query.body)))
+        for part in reversed(query.order.split(",") if query.order else []):
+            column, _, direction = part.partition(".")
+            rows = sorted(rows, key=lambda row: (row.get(column) is None, row.get(column)),
+                          reverse=direction.startswith("desc"))
+        if query.limit is not None:
+            rows = rows[:query.limit]
+        return [self._project(row, query.columns) for row in rows]
+
+    def _new_id(self, table: str) -> int:
+        current = self._next_id.get(table)
+        if current is None:
+            current = max([row["id"] for row in self.tables[table] if isinstance(row.get("id"), int)], default=0)
+        self._next_id[table] = current + 1
+        return current + 1
+
+    @staticmethod
+    def _project(row: dict, columns: str) -> dict:
+        # Copies, so callers never share rows with the tables
+        row = json.loads(json.dumps(row))
+        if columns == "*":
+            return row
+        return {column: row.get(column) for column in columns.split(",")}
+
+    def transport(self) -> "httpx.MockTransport":
+        """ An httpx transport serving this database as a PostgREST endpoint, for Database(transport=...). """
+        def handle(request: httpx.Request) -> httpx.Response:
+            path = request.url.path.split("/rest/v1", 1)[-1]
+            body = json.loads(request.content) if request.content else None
+            try:
+                query = Query.from_request(request.method, path, request.url.params.multi_items(), body)
+                rows = self._run(query)
+            except DatabaseError as e:
+                return httpx.Response(e.status or 400, json={"message": str(e)})
+            except (ValueError, TypeError) as e:
+                return httpx.Response(400, json={"message": str(e)})
+            return httpx.Response(201 if query.kind == "insert" else 200, json=rows)
+        return httpx.MockTransport(handle)
+
+
+def _append_patient_item(db: InMemoryDatabase, patient_id, list_column: str, item):
+    """ The fake's append_patient_item (see supabase/migrations). """
+    if list_column not in APPENDABLE:
+        raise DatabaseError(f"cannot append to column {list_column}", 400)
+    rows = [row for row in db.tables.get("patients", []) if _matches(row.get("id"), "eq", patient_id)]
+    for row in rows:
+        row[list_column] = (row.get(list_column) or []) + [json.loads(json.dumps(item))]
+    return [db._project(row, "*") for row in rows]
+
+
+def _matches(stored, op: str, value) -> bool:
+    if op == "is":
+        return stored is value
+    if op == "in":
+        return stored in [_coerce(stored, v) for v in value]
+    if stored is None:
+        return False
+    value = _coerce(stored, value)
+    try:
+        return {"eq": stored == value, "neq": stored != value, "gt": stored > value,
+                "gte": stored >= value, "lt": stored < value, "lte": stored <= value}[op]
+    except TypeError:
+        return False
+
+
+def _coerce(stored, value):
+    """ A filter value (possibly a string from a URL) as the type of the stored column value. """
+    if isinstance(value, str) and isinstance(stored, (int, float)) and not isinstance(stored, bool):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    if isinstance(stored, str) and not isinstance(value, str):
+        return str(value)
+    return value
+
+
+if __name__ == "__main__":
+    # Exercises the HTTP client, the async client and the fake against each other
+    import time
+
+    fake = InMemoryDatabase({
+        "patients": [{"id": 1, "fName": "Ada", "lName": "L", "severity": 0.4, "notes": [], "medication": []}],
+        "assessments": [{"id": 1, "patientId": 1, "date": "2024-01-02", "severity": 0.4},
+                        {"id": 2, "patientId": 1, "date": "2024-02-03", "severity": 0.5},
+                        {"id": 3, "patientId": 2, "date": "2024-02-03", "severity": 0.9}],
+    })
+    db = Database("http://stand-in", "key", transport=fake.transport())
+
+    assert db.get_patient(1)["fName"] == "Ada"
+    assert db.get_patient(99) is None
+    patient, assessments = db.patient_with_assessments(1)
+    assert patient["id"] == 1 and [a["id"] for a in assessments] == [1, 2]
+    assert db.insert_assessment({"patientId": 1, "date": "2024-03-01", "severity": 0.6})[0]["id"] == 4
+    assert db.update_patient(1, {"severity": 0.6})[0]["severity"] == 0.6
+    assert db.append_to_patient(1, "notes", {"note": "hi"})[0]["notes"] == [{"note": "hi"}]
+    assert db.append_to_patient(99, "notes", {"note": "hi"}) == []
+    assert fake.get_assessments(1) == db.get_assessments(1)
+    assert [r["id"] for r in db.iter_rows("assessments", "id,date", [("date", "gte", "2024-02-01")], batch=1)] == [2, 3, 4]
+    assert [r["id"] for r in db.iter_rows("assessments", "id", after=1, limit=2, batch=1)] == [2, 3]
+
+    async def check_async():
+        adb = AsyncDatabase("http://stand-in", "key", transport=fake.transport())
+        patient, assessments = await adb.patient_with_assessments(1)
+        assert patient["severity"] == 0.6 and len(assessments) == 3
+        await adb.aclose()
+    asyncio.run(check_async())
+
+    # Independent queries overlap: two 50 ms round trips take ~50 ms, not ~100 ms
+    def slow(request):
+        time.sleep(0.05)
+        return fake.transport().handle_request(request)
+    slow_db = Database("http://stand-in", "key", transport=httpx.MockTransport(slow))
+    start = time.perf_counter()
+    slow_db.patient_with_assessments(1)
+    elapsed = time.perf_counter() - start
+    assert elapsed < 0.09, elapsed
+
+    # Concurrent appends over HTTP lose nothing, even with slow round trips,
+    # where read-modify-write of the whole array does
+    def read_modify_write(db, patient_id, column, item):
+        patient = db.get_patient(patient_id, column)
+        return db.update_patient(patient_id, {column: patient[column] + [item]})
+
+    def run_appends(append, threads=8, per_thread=25):
+        store = InMemoryDatabase({"patients": [{"id": 1, "notes": []}]})
+        transport = store.transport()
+
+        def jittery(request):
+            time.sleep(0.001)
+            return transport.handle_request(request)
+        client = Database("http://stand-in", "key", transport=httpx.MockTransport(jittery), max_connections=threads)
+        workers = [threading.Thread(target=lambda t=t: [append(client, 1, "notes", {"t": t, "i": i})
+                                                        for i in range(per_thread)]) for t in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return len(store.tables["patients"][0]["notes"]), threads * per_thread
+
+    kept, sent = run_appends(lambda db, *args: db.append_to_patient(*args))
+    assert kept == sent, (kept, sent)
+    lost = sent - run_appends(read_modify_write)[0]
+    print(f"db: all checks passed (parallel patient + assessments in {elapsed * 1000:.0f} ms; "
+          f"{sent} concurrent appends kept, read-modify-write lost {lost})")
@@ -0,0 +1,42 @@
+import os
+
+# gunicorn settings for app:app, read from the environment:
+#   gunicorn app:app    (this file is picked up from the working directory)
+#
+# GUNICORN_PRELOAD=1 imports the app once in the master and builds the model
+# there before forking, so workers start warm and share its memory
+# copy-on-write. Otherwise each worker builds its clients in parallel right
+# after it starts (WARM_UP), or on first use with WARM_UP=0.
+
+bind = os.environ.get("GUNICORN_BIND", f"0.0.0.0:{os.environ.get('PORT', '10000')}")
+workers = int(os.environ.get("GUNICORN_WORKERS", "2"))
+# Read by app.py: with several workers, state shared between requests needs Redis
+os.environ["GUNICORN_WORKERS"] = str(workers)
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+preload_app = os.environ.get("GUNICORN_PRELOAD", "").lower() in ("1", "true")
+
+if preload_app:
+    # The master's preload is all the warming workers need
+    os.environ.setdefault("WARM_UP", "0")
+else:
+    os.environ.setdefault("WARM_UP", "1")
+
+
+def on_starting(server):
+    # Workers memory-map the model's tree artifact; build it once here if
+    # it is missing or stale, rather than have every worker parse the JSON
+    from model.tree_predictor import ensure_artifact, ARTIFACT_PATH
+    try:
+        if ensure_artifact():
+            server.log.info(f"Built {ARTIFACT_PATH}")
+    except OSError as e:
+        server.log.warning(f"Could not build {ARTIFACT_PATH}: {e}")
+
+
+def when_ready(server):
+    if preload_app:
+        import services
+        for name, outcome in services.preload().items():
+            if isinstance(outcome, float):
+                server.log.info(f"Preloaded {name} in the master in {outcome:.2f}s")
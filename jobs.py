@@ -0,0 +1,91 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import TTLCache
+
+# Background jobs for long-running requests.
+#
+# A job runs on a small thread pool. Its status and result are kept in a
+# bounded, TTL-evicted store so clients can poll for them, e.g. /jobs/<id>
+# after an asynchronous /submit-images. Finished jobs are forgotten after
+# result_ttl seconds. With several server processes the store has to be
+# shared (a cache.RedisBackend): the poll can reach any of them, while the
+# job only runs in the one that accepted it.
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueueFullError(Exception):
+    """ Too many jobs are queued or running. retry_after is a hint in seconds. """
+    def __init__(self, retry_after: int):
+        super().__init__(f"Too many pending jobs, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class JobManager:
+    """
+    Runs callables in the background and remembers their outcome.
+
+    workers: threads running jobs.
+    max_pending: jobs accepted at once (queued + running) before rejecting.
+    max_jobs / result_ttl: bound and lifetime of the status store.
+    store: where statuses are kept (get / set / delete, JSON values), e.g. a
+    cache.RedisBackend shared by every server process; by default a TTLCache
+    of max_jobs entries in this process.
+    """
+    def __init__(self, workers: int = 2, max_pending: int = 32, max_jobs: int = 1024,
+                 result_ttl: float = 600.0, retry_after: int = 2, store=None):
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self.result_ttl = result_ttl
+        self._store = store if store is not None else TTLCache(maxsize=max_jobs, ttl=result_ttl)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args) -> str:
+        """ Queues fn(*args) and returns the new job's id. """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise JobQueueFullError(self.retry_after)
+            self._pending += 1
+
+        job_id = uuid.uuid4().hex
+        self._store.set(job_id, {"job_id": job_id, "status": QUEUED, "created_at": time.time()}, self.result_ttl)
+        try:
+            self._executor.submit(self._run, job_id, fn, args)
+        except Exception:
+            self._finish_pending()
+            self._store.delete(job_id)
+            raise
+        return job_id
+
+    def _run(self, job_id, fn, args):
+        self._update(job_id, status=RUNNING)
+        try:
+            result = fn(*args)
+        except Exception as e:
+            self._update(job_id, status=FAILED, error=str(e), finished_at=time.time())
+        else:
+            self._update(job_id, status=DONE, result=result, finished_at=time.time())
+        finally:
+            self._finish_pending()
+
+    def _update(self, job_id, **fields):
+        job = self._store.get(job_id)
+        if job is None:
+            return  # evicted; nobody can poll for it anymore
+        self._store.set(job_id, {**job, **fields}, self.result_ttl)
+
+    def _finish_pending(self):
+        with self._lock:
+            self._pending -= 1
+
+    def get(self, job_id: str):
+        """ The job's status dict, or None if it is unknown or has expired. """
+        return self._store.get(job_id)
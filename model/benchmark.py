@@ -0,0 +1,579 @@
+import argparse
+import base64
+import datetime
+import glob
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from model.extract_features import RadiusAngle, zhang_suen, dtw_distance, dtw_distance_reference, extract_points, find_origin
+from model.dtw import nearest_references
+from model import metrics
+
+# Benchmarks for the spiral feature pipeline. Runs offline on synthetic spirals:
+#   python -m model.benchmark thinning --size 400
+# End to end, per stage, with JSON output to compare commits:
+#   python -m model.benchmark pipeline --json before.json
+#   python -m model.benchmark pipeline --compare before.json
+
+
+def make_spiral_image(size: int, turns: int = 3, thickness: int = 4, tremor: float = 0.0, seed: int = 0) -> np.ndarray:
+    """
+    Draws an Archimedean spiral on a white square canvas (255 background, 0 stroke),
+    i.e. the thresholded form the pipeline thins. tremor adds a radial
+    oscillation with that amplitude in pixels, plus matching jitter.
+    """
+    rng = np.random.default_rng(seed)
+    img = np.full((size, size), 255, dtype=np.uint8)
+    center = size / 2.0
+    max_radius = size * 0.42
+
+    theta = np.linspace(0, 2 * np.pi * turns, 360 * turns * 4)
+    radius = max_radius * theta / theta[-1]
+    if tremor > 0:
+        radius = radius + tremor * np.sin(theta * 9) + rng.normal(0, tremor / 3, theta.shape)
+    x = center + radius * np.cos(theta)
+    y = center + radius * np.sin(theta)
+
+    pts = np.round(np.stack([x, y], axis=1)).astype(np.int32).reshape(-1, 1, 2)
+    cv2.polylines(img, [pts], False, 0, thickness)
+    return img
+
+
+def timed(fn, *args, repeat: int = 1):
+    """ Runs fn(*args) repeat times; returns (best seconds, last result). """
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_thinning(size: int, repeat: int, engines):
+    """ Times every thinning engine on the same spiral and checks they agree bit for bit. """
+    source = make_spiral_image(size)
+    outputs = {}
+
+    for engine in engines:
+        def run():
+            img = source.copy()
+            zhang_suen(img, engine=engine)
+            return img
+
+        # The reference engine is slow; one run is enough to time it.
+        seconds, outputs[engine] = timed(run, repeat=1 if engine == "reference" else repeat)
+        print(f"{engine:>10}: {seconds * 1000:10.2f} ms  ({size}x{size})")
+
+    baseline = outputs[engines[0]]
+    for engine in engines[1:]:
+        if not np.array_equal(baseline, outputs[engine]):
+            diff = np.count_nonzero(baseline != outputs[engine])
+            print(f"PARITY FAILURE: {engine} differs from {engines[0]} in {diff} pixels", file=sys.stderr)
+            return False
+    print(f"parity: {', '.join(engines)} identical")
+    return True
+
+
+def bench_sampler(size: int, repeat: int):
+    """ Times ray sampling (reference loop, exact cold/warm cache, batched) and checks exact parity. """
+    from model.ray_sampler import ray_table
+
+    skeleton = make_spiral_image(size, tremor=2.0)
+    zhang_suen(skeleton)
+    yc, xc = find_origin(skeleton, size // 2, size // 2)
+    start_x = float(size + 350)
+
+    def run(sampler):
+        return extract_points(skeleton.copy(), yc, xc, start_x, sampler=sampler)
+
+    ref_seconds, reference = timed(run, "reference")
+    ray_table.cache_clear()
+    cold_seconds, _ = timed(run, "exact")
+    warm_seconds, exact = timed(run, "exact", repeat=repeat)
+    batched_seconds, batched = timed(run, "batched", repeat=repeat)
+
+    print(f" reference: {ref_seconds * 1000:10.2f} ms  ({len(reference)} points, {size}x{size})")
+    print(f"exact cold: {cold_seconds * 1000:10.2f} ms  (builds the ray table)")
+    print(f"exact warm: {warm_seconds * 1000:10.2f} ms")
+    print(f"   batched: {batched_seconds * 1000:10.2f} ms  ({len(batched)} points)")
+
+    if not (np.array_equal(reference.x, exact.x) and np.array_equal(reference.y, exact.y)):
+        print("PARITY FAILURE: exact sampler points differ from line_idda", file=sys.stderr)
+        return False
+    print("parity: exact sampler identical to line_idda")
+    return True
+
+
+def make_radius_sequence(length: int, tremor: float = 0.0, seed: int = 0) -> np.ndarray:
+    """ Radii of a 3-turn spiral sampled at length points, with optional noise. """
+    rng = np.random.default_rng(seed)
+    radius = np.linspace(0, 170, length)
+    if tremor > 0:
+        radius = radius + rng.normal(0, tremor, length)
+    return radius
+
+
+def bench_dtw(length: int, repeat: int, window):
+    """ Times the reference DTW against the vectorized engine and checks the exact mode matches. """
+    a = make_radius_sequence(length, seed=1)
+    b = make_radius_sequence(length - length // 50, tremor=3.0, seed=2)
+
+    seq_a = [RadiusAngle(float(r)) for r in a]
+    seq_b = [RadiusAngle(float(r)) for r in b]
+
+    ref_seconds, reference = timed(dtw_distance_reference, seq_a, seq_b)
+    print(f" reference: {ref_seconds * 1000:10.2f} ms  ({len(a)}x{len(b)})  {reference:.6f}")
+    exact_seconds, exact = timed(dtw_distance, seq_a, seq_b, repeat=repeat)
+    print(f"     exact: {exact_seconds * 1000:10.2f} ms  {exact:.6f}")
+    if window is not None:
+        band_seconds, banded = timed(dtw_distance, seq_a, seq_b, window, repeat=repeat)
+        print(f"  band={window:<4}: {band_seconds * 1000:10.2f} ms  {banded:.6f}")
+
+    if exact != reference:
+        print(f"PARITY FAILURE: exact DTW {exact!r} != reference {reference!r}", file=sys.stderr)
+        return False
+    print("parity: exact DTW identical to reference")
+    return True
+
+
+def bench_knn(references: int, length: int, k: int, window):
+    """
+    Top-k search of one drawing against a library of reference spirals:
+    pruned search vs computing every DTW, with the share of pairs each
+    pruning step decided.
+    """
+    rng = np.random.default_rng(3)
+    query = make_radius_sequence(length, tremor=2.0, seed=4)
+    library = []
+    for idx in range(references):
+        scale = rng.uniform(0.6, 1.4)
+        ref_length = int(length * rng.uniform(0.85, 1.15))
+        library.append(make_radius_sequence(ref_length, tremor=rng.uniform(0, 6), seed=100 + idx) * scale)
+
+    def brute_force():
+        scored = [(idx, dtw_distance(query, ref, window)) for idx, ref in enumerate(library)]
+        return sorted(scored, key=lambda pair: (pair[1], pair[0]))[:k]
+
+    stats = {}
+    brute_seconds, expected = timed(brute_force)
+    pruned_seconds, found = timed(nearest_references, query, library, k, window, stats)
+
+    print(f"brute force: {brute_seconds * 1000:10.2f} ms  ({references} references, {length} points)")
+    print(f"     pruned: {pruned_seconds * 1000:10.2f} ms")
+    for outcome in ("kim", "keogh", "abandoned", "computed"):
+        count = stats.get(outcome, 0)
+        print(f"  {outcome:>10}: {count:5d}  ({100.0 * count / references:5.1f}%)")
+
+    if found != expected:
+        print(f"PARITY FAILURE: pruned top-{k} {found} != brute force {expected}", file=sys.stderr)
+        return False
+
+    # Ties: one bump at different positions costs the same against a flat
+    # query, but the bumps at the ends have the larger LB_Kim and are
+    # visited last although their indices come first
+    flat = np.zeros(length)
+    bumps = []
+    for position in [0, length - 1] + list(range(1, length - 1, max(1, length // 8))):
+        bump = np.zeros(length)
+        bump[position] = 1.0
+        bumps.append(bump)
+    for tie_k in range(1, len(bumps) + 1):
+        tied = nearest_references(flat, bumps, tie_k, window)
+        expected = sorted(((idx, dtw_distance(flat, bump, window)) for idx, bump in enumerate(bumps)),
+                          key=lambda pair: (pair[1], pair[0]))[:tie_k]
+        if tied != expected:
+            print(f"PARITY FAILURE: tied top-{tie_k} {tied} != brute force {expected}", file=sys.stderr)
+            return False
+    print(f"parity: pruned top-{k} matches brute force, ties included")
+    return True
+
+
+def encode_png(img: np.ndarray) -> str:
+    ok, buf = cv2.imencode('.png', img)
+    return base64.b64encode(buf.tobytes()).decode()
+
+
+def make_case(size: int, tremor: float, seed: int = 0):
+    """
+    A (traced, template) pair encoded the way the app receives them: the
+    drawing as an RGBA PNG whose stroke is the opaque pixels, the template as
+    a PNG with a light stroke on a dark background. Both base64.
+    """
+    drawn = make_spiral_image(size, tremor=tremor, seed=seed, thickness=3)
+    template = make_spiral_image(size, thickness=2)
+    rgba = np.zeros((size, size, 4), dtype=np.uint8)
+    rgba[drawn == 0] = [0, 0, 0, 255]
+    return encode_png(rgba), encode_png(255 - cv2.cvtColor(template, cv2.COLOR_GRAY2BGR))
+
+
+def load_fixtures(directory: str):
+    """ Cases saved as <name>_trace.png / <name>_template.png pairs, as {name: (traced, template)}. """
+    cases = {}
+    for trace_path in sorted(glob.glob(os.path.join(directory, "*_trace.png"))):
+        name = os.path.basename(trace_path)[:-len("_trace.png")]
+        with open(trace_path, "rb") as f:
+            traced = base64.b64encode(f.read()).decode()
+        with open(os.path.join(directory, f"{name}_template.png"), "rb") as f:
+            template = base64.b64encode(f.read()).decode()
+        cases[name] = (traced, template)
+    return cases
+
+
+def save_fixtures(directory: str, cases):
+    os.makedirs(directory, exist_ok=True)
+    for name, (traced, template) in cases.items():
+        with open(os.path.join(directory, f"{name}_trace.png"), "wb") as f:
+            f.write(base64.b64decode(traced))
+        with open(os.path.join(directory, f"{name}_template.png"), "wb") as f:
+            f.write(base64.b64decode(template))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_case(model, traced: str, template: str, repeat: int) -> dict:
+    """
+    Scores one case repeat times with a cold template cache and repeat times
+    with a warm one. Reports, per mode, the median milliseconds of each
+    metrics span and of the whole run_inference call, and the peak
+    Python-tracked memory of one cold run (tracemalloc sees NumPy buffers,
+    not OpenCV's).
+    """
+    stages = {"cold": {}, "warm": {}}
+    end_to_end = {"cold": [], "warm": []}
+    for mode in ("cold", "warm"):
+        for _ in range(repeat):
+            if mode == "cold":
+                model.template_cache.clear()
+            with metrics.collect() as timings:
+                start = time.perf_counter()
+                model.run_inference(traced, template, 60)
+                end_to_end[mode].append(time.perf_counter() - start)
+            for stage, seconds in timings:
+                stages[mode].setdefault(stage, []).append(seconds)
+
+    model.template_cache.clear()
+    tracemalloc.start()
+    severity_score, mean_tremor, dtw_distance = model.run_inference(traced, template, 60)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "stages_ms": {mode: {stage: statistics.median(values) * 1000 for stage, values in sorted(by_stage.items())}
+                      for mode, by_stage in stages.items()},
+        "end_to_end_ms": {mode: statistics.median(values) * 1000 for mode, values in end_to_end.items()},
+        "peak_memory_bytes": peak,
+        "result": {"severity_score": float(severity_score), "mean_tremor": float(mean_tremor),
+                   "dtw_distance": float(dtw_distance)},
+    }
+
+
+def compare_reports(old: dict, new: dict):
+    """ Prints new vs old end-to-end and per-stage medians of the cases both reports have. """
+    print(f"comparing {old.get('commit')} -> {new.get('commit')}")
+    for name, case in new["cases"].items():
+        before = old["cases"].get(name)
+        if before is None:
+            continue
+        rows = [(f"end_to_end:{mode}", before["end_to_end_ms"][mode], ms) for mode, ms in case["end_to_end_ms"].items()]
+        rows += [(f"{mode}:{stage}", before["stages_ms"][mode][stage], ms)
+                 for mode, by_stage in case["stages_ms"].items() for stage, ms in by_stage.items()
+                 if stage in before["stages_ms"].get(mode, {})]
+        print(name)
+        for label, old_ms, new_ms in rows:
+            ratio = new_ms / old_ms if old_ms else float('inf')
+            print(f"  {label:>24}: {old_ms:9.2f} -> {new_ms:9.2f} ms  ({ratio:5.2f}x)")
+        if case["result"] != before["result"]:
+            print(f"  RESULT CHANGED: {before['result']} -> {case['result']}")
+
+
+def bench_pipeline(sizes, tremors, repeat: int, fixtures=None, save=None, json_path=None, compare=None):
+    """ End-to-end and per-stage timing of run_inference on synthetic or saved cases. """
+    from model.inference import PD_Model
+
+    if fixtures:
+        cases = load_fixtures(fixtures)
+        if not cases:
+            print(f"No *_trace.png / *_template.png fixtures in {fixtures}", file=sys.stderr)
+            return False
+    else:
+        cases = {f"{size}px_tremor{tremor:g}": make_case(size, tremor, seed)
+                 for seed, (size, tremor) in enumerate((size, tremor) for size in sizes for tremor in tremors)}
+    if save:
+        save_fixtures(save, cases)
+
+    model = PD_Model(execution="inline")
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "repeat": repeat,
+        "cases": {},
+    }
+    for name, (traced, template) in cases.items():
+        case = report["cases"][name] = bench_case(model, traced, template, repeat)
+        print(f"{name:>20}: cold {case['end_to_end_ms']['cold']:8.2f} ms  warm {case['end_to_end_ms']['warm']:8.2f} ms  "
+              f"peak {case['peak_memory_bytes'] / 2 ** 20:6.1f} MiB")
+        for mode, by_stage in case["stages_ms"].items():
+            print(f"{mode:>24}  " + "  ".join(f"{stage}={ms:.1f}" for stage, ms in by_stage.items()))
+
+    if json_path == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif json_path:
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent=2)
+    if compare:
+        with open(compare) as f:
+            compare_reports(json.load(f), report)
+    return True
+
+
+def make_timed_spiral(seconds: float, rate: float = 120.0, tremor_hz: float = 6.0, tremor: float = 1.5,
+                      size: int = 600, seed: int = 0):
+    """ One timestamped stroke (x, y, t) of a 3-turn spiral drawn in `seconds`, with a sinusoidal tremor and jittered timing. """
+    rng = np.random.default_rng(seed)
+    t = np.cumsum(rng.uniform(0.5, 1.5, int(seconds * rate)) / rate)
+    progress = t / t[-1]
+    theta = 2 * np.pi * 3 * progress
+    radius = size * 0.42 * progress + tremor * np.sin(2 * np.pi * tremor_hz * t)
+    return np.column_stack([size / 2 + radius * np.cos(theta), size / 2 + radius * np.sin(theta), t])
+
+
+def bench_kinematics(seconds: float, long_seconds: float, repeat: int):
+    """
+    Times kinematic_features on a timestamped drawing against get_features on
+    the same drawing as an image, checks the streaming Welch estimate against
+    scipy.signal.welch, and measures peak memory on a long recording.
+    """
+    from model.strokes import Strokes
+    from model.kinematics import kinematic_features, WelchBandPower, DEFAULT_FS, DEFAULT_WINDOW
+    from model.extract_features import get_features
+
+    stroke = make_timed_spiral(seconds)
+    strokes = Strokes([stroke])
+    kin_seconds, features = timed(kinematic_features, strokes, repeat=repeat)
+
+    size = 600
+    rgba = np.zeros((size, size, 4), dtype=np.uint8)
+    cv2.polylines(rgba, [np.round(stroke[:, :2]).astype(np.int32).reshape(-1, 1, 2)], False, (0, 0, 0, 255), 3)
+    template = encode_png(255 - cv2.cvtColor(make_spiral_image(size, thickness=2), cv2.COLOR_GRAY2BGR))
+    image_seconds, _ = timed(get_features, encode_png(rgba), template, repeat=repeat)
+
+    print(f"kinematics: {kin_seconds * 1000:10.2f} ms  ({len(stroke)} points, {seconds:g} s)")
+    print(f"     image: {image_seconds * 1000:10.2f} ms  (get_features, {size}x{size}, cold template)")
+    print(f"     tremor: {features['TREMOR_PEAK_FREQUENCY']:.2f} Hz peak, "
+          f"{100 * features['TREMOR_RELATIVE_POWER']:.1f}% of velocity power in band")
+
+    # Long recording, fed in chunks: memory should not grow with its length
+    long_strokes = Strokes([make_timed_spiral(long_seconds, seed=1)])
+    tracemalloc.start()
+    long_seconds_taken, _ = timed(kinematic_features, long_strokes)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    input_bytes = long_strokes.strokes[0].nbytes
+    print(f"  long run: {long_seconds_taken * 1000:10.2f} ms  ({long_seconds:g} s recording, "
+          f"input {input_bytes / 2 ** 20:.1f} MiB, peak working memory {peak / 2 ** 20:.2f} MiB)")
+
+    try:
+        from scipy.signal import welch
+    except ImportError:
+        print("parity: scipy not installed, Welch check skipped")
+        return True
+    rng = np.random.default_rng(5)
+    velocity = rng.normal(size=(20000, 2))
+    stream = WelchBandPower(DEFAULT_FS, DEFAULT_WINDOW)
+    for start in range(0, len(velocity), 777):
+        stream.push(velocity[start:start + 777])
+    _, expected = welch(velocity.T, fs=DEFAULT_FS, nperseg=DEFAULT_WINDOW)
+    error = np.max(np.abs(stream.psd() - expected.sum(axis=0))) / expected.max()
+    if error > 1e-9:
+        print(f"PARITY FAILURE: streaming Welch PSD differs from scipy by {error:.3g} (relative)", file=sys.stderr)
+        return False
+    print(f"parity: streaming Welch matches scipy.signal.welch (max rel. error {error:.1e})")
+    return True
+
+
+def bench_parity(sizes, tremors, seeds: int, pen_width: int, tolerance: float, repeat: int):
+    """
+    Checks that a drawing scores the same submitted as strokes and as the
+    PNG the frontend would make of them: the strokes are drawn on an RGBA
+    canvas (antialiased, pen_width pixels, split by pen lifts), and every
+    feature of get_features must match get_stroke_features within tolerance
+    (relative). Also times both paths.
+    """
+    from model.strokes import Strokes, get_stroke_features
+    from model.extract_features import get_features
+    from model.template_cache import TemplateCache
+
+    worst = {}
+    times = {"image": [], "strokes": []}
+    for size in sizes:
+        template = encode_png(255 - cv2.cvtColor(make_spiral_image(size, thickness=2), cv2.COLOR_GRAY2BGR))
+        cache = TemplateCache()
+        for tremor in tremors:
+            for seed in range(seeds):
+                stroke = make_timed_spiral(15, tremor=tremor, size=size, seed=seed)
+                lifts = np.sort(np.random.default_rng(seed).choice(np.arange(50, len(stroke) - 50), 2, replace=False))
+                strokes = Strokes(np.split(stroke, lifts))
+
+                rgba = np.zeros((size, size, 4), dtype=np.uint8)
+                for part in strokes.strokes:
+                    points = np.round(part[:, :2] * 16).astype(np.int32).reshape(-1, 1, 2)
+                    cv2.polylines(rgba, [points], False, (0, 0, 0, 255), pen_width, cv2.LINE_AA, shift=4)
+                traced = encode_png(rgba)
+
+                image_seconds, expected = timed(get_features, traced, template, "exact", cache, repeat=repeat)
+                stroke_seconds, features = timed(get_stroke_features, strokes, template, "exact", cache, repeat=repeat)
+                times["image"].append(image_seconds)
+                times["strokes"].append(stroke_seconds)
+                for name, value in expected.items():
+                    error = abs(features[name] - value) / max(abs(value), 1e-12)
+                    worst[name] = max(worst.get(name, 0.0), error)
+
+    print(f"{'feature':<50} {'max rel. error':>14}")
+    for name, error in worst.items():
+        print(f"{name:<50} {error:14.2e}")
+    print(f"image: {statistics.median(times['image']) * 1000:.1f} ms, "
+          f"strokes: {statistics.median(times['strokes']) * 1000:.1f} ms (median, warm template)")
+    failed = [name for name, error in worst.items() if error > tolerance]
+    if failed:
+        print(f"PARITY FAILURE: {', '.join(failed)} differ by more than {tolerance:g}", file=sys.stderr)
+        return False
+    print(f"parity: stroke features match the rasterized drawing within {tolerance:g}")
+    return True
+
+
+def bench_predict(batch: int, repeat: int):
+    """
+    Times TreeEnsemble against the old per-call path (pandas DataFrame,
+    xgb.DMatrix, Booster.predict) for one row and a batch, and checks that
+    the predictions are identical.
+    """
+    import pandas as pd
+    import xgboost as xgb
+    from model.tree_predictor import TreeEnsemble, MODEL_PATH
+
+    ensemble = TreeEnsemble.from_json(MODEL_PATH)
+    booster = xgb.Booster()
+    booster.load_model(MODEL_PATH)
+
+    rng = np.random.default_rng(0)
+    nodes = ensemble.left != np.arange(len(ensemble.left))
+    rows = np.column_stack([rng.choice(ensemble.threshold[nodes & (ensemble.feature == f)], batch)
+                            for f in range(ensemble.num_features)]).astype(np.float32)
+
+    def booster_predict(X):
+        return booster.predict(xgb.DMatrix(pd.DataFrame(X, columns=ensemble.feature_names)))
+
+    ok = True
+    for name, X in (("1 row", rows[:1]), (f"{batch} rows", rows)):
+        old_seconds, expected = timed(booster_predict, X, repeat=repeat)
+        new_seconds, predicted = timed(ensemble.predict, X, repeat=repeat)
+        print(f"{name:>12}: booster {old_seconds * 1000:8.3f} ms  tree arrays {new_seconds * 1000:8.3f} ms  "
+              f"({old_seconds / new_seconds:.1f}x)")
+        if not np.array_equal(predicted, expected):
+            print(f"PARITY FAILURE: {name}: max difference {np.abs(predicted - expected).max():.3g}", file=sys.stderr)
+            ok = False
+    if ok:
+        print("parity: identical to Booster.predict")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Spiral pipeline benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    thinning = sub.add_parser("thinning", help="Zhang-Suen engines: timing and parity")
+    thinning.add_argument("--size", type=int, default=400)
+    thinning.add_argument("--repeat", type=int, default=5)
+    thinning.add_argument("--engines", nargs="+", default=["reference", "lut", "frontier"])
+
+    dtw = sub.add_parser("dtw", help="DTW engines: timing and parity")
+    dtw.add_argument("--length", type=int, default=1000)
+    dtw.add_argument("--repeat", type=int, default=5)
+    dtw.add_argument("--window", type=int, default=50)
+
+    knn = sub.add_parser("knn", help="Top-k nearest references: pruning rate and parity")
+    knn.add_argument("--references", type=int, default=200)
+    knn.add_argument("--length", type=int, default=400)
+    knn.add_argument("--k", type=int, default=5)
+    knn.add_argument("--window", type=int, default=None)
+
+    sampler = sub.add_parser("sampler", help="Ray sampling: timing and parity")
+    sampler.add_argument("--size", type=int, default=400)
+    sampler.add_argument("--repeat", type=int, default=5)
+
+    pipeline = sub.add_parser("pipeline", help="run_inference end to end and per stage, with JSON output")
+    pipeline.add_argument("--sizes", type=int, nargs="+", default=[300, 500, 800])
+    pipeline.add_argument("--tremors", type=float, nargs="+", default=[0.0, 3.0, 8.0])
+    pipeline.add_argument("--repeat", type=int, default=5)
+    pipeline.add_argument("--fixtures", help="directory of saved <name>_trace.png/<name>_template.png pairs to use")
+    pipeline.add_argument("--save-fixtures", help="directory to save the cases to, for reuse with --fixtures")
+    pipeline.add_argument("--json", help="write the report to this file ('-' for stdout)")
+    pipeline.add_argument("--compare", help="report JSON of an earlier run to compare against")
+
+    kinematics = sub.add_parser("kinematics", help="Stroke kinematics: timing vs get_features, memory, Welch parity")
+    kinematics.add_argument("--seconds", type=float, default=15.0)
+    kinematics.add_argument("--long-seconds", type=float, default=1800.0)
+    kinematics.add_argument("--repeat", type=int, default=5)
+
+    parity = sub.add_parser("parity", help="Stroke vs rasterized image features: parity and timing")
+    parity.add_argument("--sizes", type=int, nargs="+", default=[400, 600, 800])
+    parity.add_argument("--tremors", type=float, nargs="+", default=[1.5, 6.0, 15.0])
+    parity.add_argument("--seeds", type=int, default=3)
+    parity.add_argument("--pen-width", type=int, default=3, help="pen width of the rasterized drawing")
+    parity.add_argument("--tolerance", type=float, default=1e-9, help="largest relative difference allowed")
+    parity.add_argument("--repeat", type=int, default=1)
+
+    predict = sub.add_parser("predict", help="Tree-array predictor vs Booster.predict: timing and parity")
+    predict.add_argument("--batch", type=int, default=32)
+    predict.add_argument("--repeat", type=int, default=50)
+
+    args = parser.parse_args(argv)
+
+    if args.bench == "thinning":
+        ok = bench_thinning(args.size, args.repeat, args.engines)
+        return 0 if ok else 1
+    if args.bench == "dtw":
+        ok = bench_dtw(args.length, args.repeat, args.window)
+        return 0 if ok else 1
+    if args.bench == "sampler":
+        ok = bench_sampler(args.size, args.repeat)
+        return 0 if ok else 1
+    if args.bench == "knn":
+        ok = bench_knn(args.references, args.length, args.k, args.window)
+        return 0 if ok else 1
+    if args.bench == "kinematics":
+        ok = bench_kinematics(args.seconds, args.long_seconds, args.repeat)
+        return 0 if ok else 1
+    if args.bench == "parity":
+        ok = bench_parity(args.sizes, args.tremors, args.seeds, args.pen_width, args.tolerance, args.repeat)
+        return 0 if ok else 1
+    if args.bench == "predict":
+        ok = bench_predict(args.batch, args.repeat)
+        return 0 if ok else 1
+    if args.bench == "pipeline":
+        ok = bench_pipeline(args.sizes, args.tremors, args.repeat, args.fixtures, args.save_fixtures,
+                            args.json, args.compare)
+        return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
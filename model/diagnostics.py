@@ -0,0 +1,161 @@
+import abc
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# Optional debug artifacts of the feature pipeline.
+#
+# get_features used to write drawn_image.png, template_image.png and a
+# matplotlib figure (extracted_points.png) into the working directory on every
+# call. That work now goes to a sink, off by default. Enabled sinks render and
+# encode on a background thread, off the request path, and give each request
+# its own id. At most DIAGNOSTICS_PENDING requests wait to be rendered; the
+# diagnostics of further requests are dropped (and counted) rather than queued
+# in memory behind a slow disk:
+#   DIAGNOSTICS=file    writes DIAGNOSTICS_DIR/<id>/*.png
+#   DIAGNOSTICS=memory  keeps the last DIAGNOSTICS_KEEP requests in memory
+#                       (served by the /debug/diagnostics endpoints; only
+#                       sees requests handled in this process)
+
+
+class Diagnostics:
+    """ Everything a sink may render for one request. """
+    def __init__(self, drawn_gray: np.ndarray, drawn_skeleton: np.ndarray, template_skeleton: np.ndarray,
+                 drawn_points, template_points):
+        self.drawn_gray = drawn_gray
+        self.drawn_skeleton = drawn_skeleton
+        self.template_skeleton = template_skeleton
+        self.drawn_points = drawn_points
+        self.template_points = template_points
+
+
+def render_artifacts(diag: Diagnostics):
+    """ Encodes the request's debug images as {file name: PNG bytes}. """
+    # The object-oriented Figure API keeps no global pyplot state, so it is
+    # safe across threads and the figure is freed with its last reference.
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from io import BytesIO
+
+    fig = Figure(figsize=(10, 5))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 2, 1)
+    ax.imshow(diag.drawn_skeleton, cmap='gray')
+    ax.scatter(diag.drawn_points.x, diag.drawn_points.y, color='red', s=1)
+    ax.set_title('Extracted Points from Drawn Spiral')
+    ax = fig.add_subplot(1, 2, 2)
+    ax.imshow(diag.template_skeleton, cmap='gray')
+    ax.scatter(diag.template_points.x, diag.template_points.y, color='blue', s=1)
+    ax.set_title('Extracted Points from Template Spiral')
+
+    figure_png = BytesIO()
+    fig.savefig(figure_png, format='png')
+
+    return {
+        'drawn_image.png': cv2.imencode('.png', diag.drawn_gray)[1].tobytes(),
+        'template_image.png': cv2.imencode('.png', diag.template_skeleton)[1].tobytes(),
+        'extracted_points.png': figure_png.getvalue(),
+    }
+
+
+class DiagnosticsSink:
+    """ Default sink: diagnostics are disabled and nothing is rendered. """
+    enabled = False
+
+    def record(self, diag: Diagnostics):
+        """ Accepts a request's diagnostics; returns the id they are stored under, or None. """
+        return None
+
+
+class _AsyncSink(DiagnosticsSink, abc.ABC):
+    """ Renders and writes on one background thread, with at most max_pending requests waiting. """
+    enabled = True
+
+    def __init__(self, max_pending: int = 8):
+        self.max_pending = max_pending
+        self.dropped = 0  # requests whose diagnostics were dropped because too many were pending
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._dropped_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="diagnostics")
+
+    def record(self, diag: Diagnostics):
+        if not self._pending.acquire(blocking=False):
+            with self._dropped_lock:
+                self.dropped += 1
+                first = self.dropped == 1
+            if first:
+                print(f"Warning: diagnostics are being dropped ({self.max_pending} requests pending)", file=sys.stderr)
+            return None
+        request_id = uuid.uuid4().hex
+        self._executor.submit(self._write_safely, request_id, diag)
+        return request_id
+
+    def _write_safely(self, request_id, diag):
+        try:
+            self.write(request_id, render_artifacts(diag))
+        except Exception as e:
+            print(f"Warning: could not write diagnostics for {request_id}: {e}", file=sys.stderr)
+        finally:
+            self._pending.release()
+
+    @abc.abstractmethod
+    def write(self, request_id: str, artifacts: dict):
+        """ Stores a request's artifacts ({file name: PNG bytes}). """
+
+
+class FileDiagnosticsSink(_AsyncSink):
+    """ Writes each request's artifacts to directory/<request id>/. """
+    def __init__(self, directory: str, max_pending: int = 8):
+        super().__init__(max_pending)
+        self.directory = directory
+
+    def write(self, request_id, artifacts):
+        path = os.path.join(self.directory, request_id)
+        os.makedirs(path, exist_ok=True)
+        for name, data in artifacts.items():
+            with open(os.path.join(path, name), 'wb') as f:
+                f.write(data)
+
+
+class MemoryDiagnosticsSink(_AsyncSink):
+    """ Keeps the artifacts of the last maxsize requests in memory. """
+    def __init__(self, maxsize: int = 20, max_pending: int = 8):
+        super().__init__(max_pending)
+        self.maxsize = maxsize
+        self._records = OrderedDict()  # request id -> (timestamp, artifacts)
+        self._lock = threading.Lock()
+
+    def write(self, request_id, artifacts):
+        with self._lock:
+            self._records[request_id] = (time.time(), artifacts)
+            while len(self._records) > self.maxsize:
+                self._records.popitem(last=False)
+
+    def list(self):
+        """ [(request id, timestamp, artifact names)], newest first. """
+        with self._lock:
+            return [(request_id, ts, sorted(artifacts)) for request_id, (ts, artifacts) in reversed(self._records.items())]
+
+    def get(self, request_id: str, name: str):
+        with self._lock:
+            record = self._records.get(request_id)
+        return record[1].get(name) if record else None
+
+
+def sink_from_env() -> DiagnosticsSink:
+    mode = os.environ.get("DIAGNOSTICS", "off").lower()
+    max_pending = int(os.environ.get("DIAGNOSTICS_PENDING", "8"))
+    if mode == "file":
+        return FileDiagnosticsSink(os.environ.get("DIAGNOSTICS_DIR", "diagnostics"), max_pending)
+    if mode == "memory":
+        return MemoryDiagnosticsSink(int(os.environ.get("DIAGNOSTICS_KEEP", "20")), max_pending)
+    if mode not in ("off", "", "0", "false"):
+        print(f"Warning: unknown DIAGNOSTICS mode {mode!r}, diagnostics disabled", file=sys.stderr)
+    return DiagnosticsSink()
@@ -0,0 +1,204 @@
+import heapq
+import math
+import sys
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Dynamic Time Warping on radius sequences.
+#
+# The cost matrix is filled one anti-diagonal at a time: every cell on
+# diagonal i + j = d depends only on diagonals d - 1 and d - 2, so a diagonal
+# is one vectorized step, and only three diagonals are ever kept in memory.
+# Each cell is still computed as cost + min(up, left, diagonal) on float64,
+# so the full-window result is bit-identical to the textbook double loop.
+#
+# For searches against many references, dtw_distance accepts a best-so-far
+# threshold: cheap lower bounds (LB_Kim, then LB_Keogh) reject hopeless pairs
+# first, and the matrix fill stops as soon as every path already exceeds it.
+
+
+def radii(seq) -> np.ndarray:
+    """ Radius sequence as a float64 array; accepts arrays or lists of RadiusAngle. """
+    if isinstance(seq, np.ndarray):
+        return seq.astype(np.float64, copy=False)
+    return np.fromiter((p.radius for p in seq), dtype=np.float64, count=len(seq))
+
+
+def band_limits(d: int, n: int, m: int, window: Optional[int]):
+    """ First and last row i of anti-diagonal d inside the matrix and the band. """
+    lo = max(1, d - m)
+    hi = min(n, d - 1)
+    if window is not None:
+        lo = max(lo, math.ceil((d - window) / 2))
+        hi = min(hi, (d + window) // 2)
+    return lo, hi
+
+
+def effective_window(n: int, m: int, window: Optional[int]) -> Optional[int]:
+    """ Band half-width actually used: widened to |n - m| so the end cell stays reachable. """
+    if window is None:
+        return None
+    return max(int(window), abs(n - m))
+
+
+def dtw_cost(a: np.ndarray, b: np.ndarray, window: Optional[int] = None,
+             abandon_above: float = math.inf) -> float:
+    """
+    Unnormalized DTW cost between two float64 sequences, with absolute
+    difference as the local cost.
+
+    window is the Sakoe-Chiba band half-width in samples: only cells with
+    |i - j| <= window are considered. It is widened to |n - m| so the end cell
+    stays reachable. None means no band (exact DTW).
+
+    If every cell of two consecutive anti-diagonals exceeds abandon_above, no
+    warping path can finish below it (each path crosses one of them and costs
+    are non-negative), so the fill stops early and inf is returned.
+    """
+    # DTW is symmetric; keep the shorter sequence along the buffers.
+    if len(a) > len(b):
+        a, b = b, a
+    n, m = len(a), len(b)
+    if n == 0:
+        return 0.0 if m == 0 else math.inf
+    window = effective_window(n, m, window)
+
+    prev2 = np.full(n + 1, np.inf)  # diagonal d - 2, indexed by row i
+    prev1 = np.full(n + 1, np.inf)  # diagonal d - 1
+    cur = np.empty(n + 1)
+    prev2[0] = 0.0  # cell (0, 0)
+    check_abandon = abandon_above < math.inf
+    prev_min = 0.0
+
+    for d in range(2, n + m + 1):
+        cur.fill(np.inf)
+        lo, hi = band_limits(d, n, m, window)
+        if lo <= hi:
+            cost = np.abs(a[lo - 1:hi] - b[d - hi - 1:d - lo][::-1])
+            best = np.minimum(np.minimum(prev1[lo - 1:hi],   # (i - 1, j)
+                                         prev1[lo:hi + 1]),  # (i, j - 1)
+                              prev2[lo - 1:hi])              # (i - 1, j - 1)
+            cur[lo:hi + 1] = cost + best
+            if check_abandon:
+                cur_min = cur[lo:hi + 1].min()
+                if min(cur_min, prev_min) > abandon_above:
+                    return math.inf
+                prev_min = cur_min
+        prev2, prev1, cur = prev1, cur, prev2
+
+    return float(prev1[n])
+
+
+def lb_kim(a: np.ndarray, b: np.ndarray) -> float:
+    """
+    Lower bound on the unnormalized DTW cost: every warping path matches the
+    first samples with each other and the last samples with each other.
+    """
+    if len(a) == 0 or len(b) == 0:
+        return 0.0
+    bound = abs(a[0] - b[0])
+    if len(a) > 1 or len(b) > 1:
+        bound += abs(a[-1] - b[-1])
+    return float(bound)
+
+
+def lb_keogh(a: np.ndarray, b: np.ndarray, window: Optional[int] = None) -> float:
+    """
+    Lower bound on the unnormalized DTW cost: every sample of a is matched to
+    at least one sample of b inside its band, so it costs at least its distance
+    to the band's [min, max] envelope of b.
+    """
+    n, m = len(a), len(b)
+    if n == 0 or m == 0:
+        return 0.0
+    window = effective_window(n, m, window)
+    if window is None:
+        lower = b.min()
+        upper = b.max()
+    else:
+        # Row i (0-based) may match b[i - window : i + window + 1]
+        pad_right = window + max(0, n - m)
+        span = 2 * window + 1
+        lower = np.lib.stride_tricks.sliding_window_view(
+            np.pad(b, (window, pad_right), constant_values=np.inf), span)[:n].min(axis=1)
+        upper = np.lib.stride_tricks.sliding_window_view(
+            np.pad(b, (window, pad_right), constant_values=-np.inf), span)[:n].max(axis=1)
+    above = np.maximum(a - upper, 0.0)
+    below = np.maximum(lower - a, 0.0)
+    return float(above.sum() + below.sum())
+
+
+def dtw_distance(seq1, seq2, window: Optional[int] = None, best_so_far: float = math.inf,
+                 stats: Optional[dict] = None) -> float:
+    """
+    Normalized DTW distance (cost divided by the longer length) between two
+    radius sequences. With window=None this equals NORMALIZED_DTW_DISTANCE as
+    computed by extract_features.dtw_distance_reference.
+
+    With a finite best_so_far, pairs that provably cannot reach it are cut short
+    (LB_Kim, then LB_Keogh, then early abandoning) and inf is returned instead.
+    If a stats dict is given, the step that decided the pair is counted in it
+    under "kim", "keogh", "abandoned" or "computed".
+    """
+    a = radii(seq1)
+    b = radii(seq2)
+    longest = max(len(a), len(b))
+    if longest == 0:
+        return 0
+
+    outcome = "computed"
+    distance = math.inf
+    if best_so_far < math.inf:
+        # Rounded up a little: best_so_far was itself divided by a length, and
+        # a pair that ties it must be computed, not pruned
+        threshold = best_so_far * longest * (1 + 4 * sys.float_info.epsilon)
+        if lb_kim(a, b) > threshold:
+            outcome = "kim"
+        elif lb_keogh(a, b, window) > threshold:
+            outcome = "keogh"
+        else:
+            distance = dtw_cost(a, b, window, abandon_above=threshold) / longest
+            if distance == math.inf:
+                outcome = "abandoned"
+    else:
+        distance = dtw_cost(a, b, window) / longest
+
+    if stats is not None:
+        stats[outcome] = stats.get(outcome, 0) + 1
+    return distance
+
+
+def nearest_references(query, references, k: int = 1, window: Optional[int] = None,
+                       stats: Optional[dict] = None) -> List[Tuple[int, float]]:
+    """
+    The k references closest to query by normalized DTW distance, as
+    (index, distance) pairs sorted by distance. Sequences may be lists of
+    RadiusAngle or radius arrays.
+
+    References are visited in order of their LB_Kim bound so good matches are
+    found early and tighten the threshold used to prune the rest. Equal
+    distances are ranked by index, as sorting every distance would. Pass a
+    dict as stats to collect how many pairs each pruning step decided.
+    """
+    q = radii(query)
+    refs = [radii(r) for r in references]
+    if k <= 0 or not refs:
+        return []
+
+    order = sorted(range(len(refs)),
+                   key=lambda idx: lb_kim(q, refs[idx]) / max(len(q), len(refs[idx]), 1))
+
+    heap = []  # max-heap of the current k best, as (-distance, -index)
+    for idx in order:
+        best_so_far = -heap[0][0] if len(heap) == k else math.inf
+        distance = dtw_distance(q, refs[idx], window, best_so_far, stats)
+        if distance == math.inf:
+            continue
+        if len(heap) < k:
+            heapq.heappush(heap, (-distance, -idx))
+        elif (distance, idx) < (-heap[0][0], -heap[0][1]):
+            # A tie with the worst kept pair still wins if its index is lower
+            heapq.heapreplace(heap, (-distance, -idx))
+
+    return sorted(((-neg_idx, -neg_dist) for neg_dist, neg_idx in heap), key=lambda pair: (pair[1], pair[0]))
@@ -4,8 +4,12 @@ import math
 import sys
 from typing import List, Tuple
 import base64
-from io import BytesIO
-from PIL import Image
+from model.thinning import zhang_suen_lut, zhang_suen_frontier
+from model import dtw
+from model.ray_sampler import sample_rays
+from model.template_cache import TemplateCache, TemplateEntry, template_key
+from model.diagnostics import Diagnostics, DiagnosticsSink
+from model import metrics
 
 # Constants
 DISPLACEMENT = 10
@@ -26,6 +30,35 @@ class RadiusAngle:
         self.radius = radius
         self.angle = angle
 
+class SpiralPoints:
+    """
+    Points sampled from one spiral, kept as contiguous float64 arrays
+    (x, y and, once to_polar has run, radius and angle around the origin).
+    Vertex / RadiusAngle lists are only built on request for legacy callers.
+    """
+    def __init__(self, x, y):
+        self.x = np.ascontiguousarray(x, dtype=np.float64)
+        self.y = np.ascontiguousarray(y, dtype=np.float64)
+        self.radius = None
+        self.angle = None
+
+    def __len__(self):
+        return len(self.x)
+
+    def to_polar(self, yc: float, xc: float) -> "SpiralPoints":
+        """ Fills radius and angle relative to the origin (xc, yc). """
+        dx = self.x - xc
+        dy = self.y - yc
+        self.radius = np.sqrt(dx * dx + dy * dy)
+        self.angle = np.arctan2(dy, dx)  # Use atan2 for quadrant safety
+        return self
+
+    def vertices(self) -> List[Vertex]:
+        return [Vertex(x, y) for x, y in zip(self.x.tolist(), self.y.tolist())]
+
+    def radius_angles(self) -> List[RadiusAngle]:
+        return [RadiusAngle(r, a) for r, a in zip(self.radius.tolist(), self.angle.tolist())]
+
 # Helper functions to get neighbors
 # P9 P2 P3
 # P8 P1 P4
@@ -41,223 +74,206 @@ def P7(dest, r, c): return dest[r+1, c-1]
 def P8(dest, r, c): return dest[r, c-1]
 def P9(dest, r, c): return dest[r-1, c-1]
 
-def get_features(traced, template):
+def image_bytes(data):
+    """ Encoded image bytes from base64 text, or the raw bytes-like object (bytes, bytearray, uint8 array) as is. """
+    if isinstance(data, str):
+        return base64.b64decode(data)
+    return data
+
+def decode_image(data, flags: int = cv2.IMREAD_COLOR) -> np.ndarray:
+    """ Decodes an encoded image (base64 text or raw bytes) with OpenCV, without intermediate copies. """
+    img = cv2.imdecode(np.frombuffer(image_bytes(data), dtype=np.uint8), flags)
+    if img is None:
+        raise ValueError("Could not decode image")
+    return img
+
+def get_features(traced, template, sampler: str = "exact", template_cache: TemplateCache = None,
+                 diagnostics: DiagnosticsSink = None):
+    """
+    Features of a drawn spiral against its template. traced is a PNG whose
+    stroke is the non-transparent pixels, template a PNG with a light stroke
+    on a dark background; each as base64 text or raw bytes.
+    Returns None if the images can't be decoded or no points are found.
+    """
     try:
-        # img_drawn_color = cv2.imdecode(np.frombuffer(base64.b64decode(traced), dtype=np.uint8), cv2.IMREAD_COLOR)
-        img_data = base64.b64decode(traced)
-        image = np.array(Image.open(BytesIO(img_data)))
-        rgb = image[:, :, :3]  # RGB channels
-        alpha = image[:, :, 3]  # Alpha channel
-        mask = alpha > 0
-        img_drawn_color = np.ones_like(rgb) * 255
-        img_drawn_color[mask] = [0, 0, 0]
-        img_drawn_color = cv2.cvtColor(img_drawn_color, cv2.COLOR_RGBA2BGR)
-
-        img_template_color = cv2.imdecode(np.frombuffer(base64.b64decode(template), dtype=np.uint8), cv2.IMREAD_COLOR)
-        img_template_color = cv2.bitwise_not(img_template_color)
+        with metrics.span("decode"):
+            image = decode_image(traced, cv2.IMREAD_UNCHANGED)
+            if image.ndim != 3 or image.shape[2] != 4:
+                raise ValueError("Drawn image has no alpha channel")
+            # Stroke (any opacity) -> black, transparent background -> white
+            img_drawn_gray = np.where(image[:, :, 3] > 0, 0, 255).astype(np.uint8)
+
+        # The template only depends on its own content and the drawn image
+        # shape, so it is processed once and reused from the cache if given.
+        with metrics.span("template"):
+            template = image_bytes(template)
+            key = template_key(template, img_drawn_gray.shape, sampler)
+            entry = template_cache.get(key) if template_cache is not None else None
+            if entry is None:
+                entry = prepare_template(template, img_drawn_gray.shape, sampler)
+                if template_cache is not None:
+                    template_cache.put(key, entry)
     except Exception as e:
         print(f"Error decoding images: {e}", file=sys.stderr)
         return None
-    
-    cv2.imwrite('drawn_image.png', img_drawn_color)
-    cv2.imwrite('template_image.png', img_template_color)
+
+    # Threshold (using same values as C++) - Binary Threshold
+    _, img_drawn_thresh = cv2.threshold(img_drawn_gray, 220, 255, cv2.THRESH_BINARY)
+
+    # Apply Zhang-Suen Thinning (modifies images in-place)
+    with metrics.span("thinning"):
+        zhang_suen(img_drawn_thresh)
+
+    # Origin found on the template (as in C++ code: origem(img1_, &yc, &xc))
+    yc, xc = entry.yc, entry.xc
+    img_template_thresh = entry.skeleton
+
+    # --- Extract Points ---
+    # Rays start far right of the image, vertically centered at the origin
+    # (adjusted starting x to be well outside image bounds based on C++ logic)
+    start_x = float(img_drawn_thresh.shape[1] + 350)
+
+    # Need a copy because ray sampling modifies the image by erasing pixels
+    with metrics.span("ray_sampling"):
+        ptosdesenhada = extract_points(img_drawn_thresh.copy(), yc, xc, start_x, sampler=sampler) # Points from drawn spiral
+    ptosoriginal = SpiralPoints(entry.x, entry.y) # Points from template spiral
+    ptosoriginal.radius = entry.radius
+    ptosoriginal.angle = entry.angle
+
+    n_drawn = len(ptosdesenhada)
+    n_orig = len(ptosoriginal)
+    min_points = min(n_drawn, n_orig)
+
+    if min_points == 0:
+        print("Error: Failed to extract any points from one or both spirals. Check images and origin.", file=sys.stderr)
+        return None
+
+    # print(f"Extracted {n_drawn} points from drawn, {n_orig} from template.", file=sys.stderr)
+
+    # Debug images (thresholded inputs, extracted points) are rendered off the
+    # request path, and only if a diagnostics sink is enabled
+    if diagnostics is not None and diagnostics.enabled:
+        diagnostics.record(Diagnostics(img_drawn_gray, img_drawn_thresh, img_template_thresh,
+                                       ptosdesenhada, ptosoriginal))
+
+    # --- Feature Calculation ---
+    # Transformation to polar coordinates (using origin xc, yc)
+    ptosdesenhada.to_polar(yc, xc)
+
+    features = spiral_statistics(ptosoriginal.radius, ptosdesenhada.radius)
+
+    return features
+
+def prepare_template(template, drawn_shape: Tuple[int, ...], sampler: str = "exact") -> TemplateEntry:
+    """
+    Decodes, inverts, thresholds and thins a template image, finds the
+    spiral origin near the center of the drawn image and samples the template
+    points. Raises if the template cannot be decoded.
+    """
+    img_template_color = decode_image(template, cv2.IMREAD_COLOR)
+    img_template_color = cv2.bitwise_not(img_template_color)
 
     # Ensure template image has same dimensions (resize if necessary, or error out)
     # For simplicity, assuming they are the same size as in C++ code
-    if img_drawn_color.shape != img_template_color.shape:
-        print(f"Warning: Drawn image shape {img_drawn_color.shape} differs from template shape {img_template_color.shape}. Results may be inaccurate.", file=sys.stderr)
+    if tuple(drawn_shape[:2]) != img_template_color.shape[:2]:
+        print(f"Warning: Drawn image shape {tuple(drawn_shape[:2])} differs from template shape {img_template_color.shape[:2]}. Results may be inaccurate.", file=sys.stderr)
         # Consider resizing template to match drawn, or vice-versa if needed.
-        # img_template_color = cv2.resize(img_template_color, (img_drawn_color.shape[1], img_drawn_color.shape[0]))
 
-    # Convert to grayscale
-    img_drawn_gray = cv2.cvtColor(img_drawn_color, cv2.COLOR_BGR2GRAY)
     img_template_gray = cv2.cvtColor(img_template_color, cv2.COLOR_BGR2GRAY)
 
-    cv2.imwrite('drawn_image.png', img_drawn_gray)
-    cv2.imwrite('template_image.png', img_template_gray)
-
-    # Threshold (using same values as C++) - Binary Threshold
-    _, img_drawn_thresh = cv2.threshold(img_drawn_gray, 220, 255, cv2.THRESH_BINARY)
     _, img_template_thresh = cv2.threshold(img_template_gray, 220, 255, cv2.THRESH_BINARY)
-
-
-    # Apply Zhang-Suen Thinning (modifies images in-place)
-    # print("Thinning drawn image...", file=sys.stderr)
-    zhang_suen(img_drawn_thresh)
-    # print("Thinning template image...", file=sys.stderr)
-    zhang_suen(img_template_thresh)
+    with metrics.span("template_thinning"):
+        zhang_suen(img_template_thresh)
 
     # --- Find Spiral Origin ---
-    # Use center as initial guess
-    yc_guess = img_drawn_thresh.shape[0] // 2
-    xc_guess = img_drawn_thresh.shape[1] // 2
+    # Use center of the drawn image as initial guess
+    yc_guess = drawn_shape[0] // 2
+    xc_guess = drawn_shape[1] // 2
 
-    # Find origin using the template image (as in C++ code: origem(img1_, &yc, &xc))
     # The C++ code uses img1_ which is the *template* image for finding the origin
-    # print(f"Finding origin near ({xc_guess}, {yc_guess})...", file=sys.stderr)
-    yc, xc = find_origin(img_template_thresh, yc_guess, xc_guess) # Pass the thinned template
-    # print(f"Using origin: ({xc}, {yc})", file=sys.stderr)
+    with metrics.span("find_origin"):
+        yc, xc = find_origin(img_template_thresh, yc_guess, xc_guess) # Pass the thinned template
 
+    start_x = float(drawn_shape[1] + 350)
+    with metrics.span("template_ray_sampling"):
+        points = extract_points(img_template_thresh.copy(), yc, xc, start_x, sampler=sampler)
+    points.to_polar(yc, xc)
 
-    # --- Extract Points ---
-    ptosoriginal: List[Vertex] = [] # Points from template spiral
-    ptosdesenhada: List[Vertex] = [] # Points from drawn spiral
+    return TemplateEntry(img_template_thresh, yc, xc, points.x, points.y, points.radius, points.angle)
 
-    # Need copies because line_idda modifies the image by erasing pixels
-    img_drawn_copy = img_drawn_thresh.copy()
-    img_template_copy = img_template_thresh.copy()
+def extract_points(img_: np.ndarray, yc: int, xc: int, start_x: float, num_turns: int = 3,
+                   num_angles: int = 360, sampler: str = "exact") -> SpiralPoints:
+    """
+    Samples a thinned spiral with num_turns x num_angles rays cast from the
+    origin (xc, yc), erasing the sampled part of each ray in img_.
+    sampler: "exact" (vectorized, same points as the line_idda loop),
+    "batched" (all rays of a turn at once, approximate near the origin) or
+    "reference" (the original line_idda loop).
+    """
+    if sampler in ("exact", "batched"):
+        x, y = sample_rays(img_, yc, xc, start_x, num_turns, num_angles, exact=sampler == "exact")
+        return SpiralPoints(x, y)
+    if sampler != "reference":
+        raise ValueError(f"Unknown ray sampler: {sampler}")
 
-    # print("Extracting points...", file=sys.stderr)
-    num_turns = 3
-    num_angles = 360
+    hits: List[Tuple[int, int]] = []
     for j in range(num_turns):
-        # Start point for rotation (far right, vertically centered at origin)
-        # Adjusted starting x to be well outside image bounds based on C++ logic
-        vert = Vertex(float(img_drawn_thresh.shape[1] + 350), float(yc))
+        vert = Vertex(start_x, float(yc))
 
         rotation(vert, float(yc), float(xc), 1) # Initial small rotation
 
         for i in range(num_angles):
             rotation(vert, float(yc), float(xc), -1) # Rotate back by 1 degree each step
 
-            # Use copies of the thinned images for extraction
-            line_idda(img_template_copy, float(yc), float(xc), vert.y, vert.x, ptosoriginal)
-            line_idda(img_drawn_copy, float(yc), float(xc), vert.y, vert.x, ptosdesenhada)
+            hit = line_idda(img_, float(yc), float(xc), vert.y, vert.x)
+            if hit is not None:
+                hits.append(hit)
 
-            # Check sizes if needed (debugging)
-            # print(f"Angle {i}: Drawn {len(ptosdesenhada)}, Original {len(ptosoriginal)}")
-
-    n_drawn = len(ptosdesenhada)
-    n_orig = len(ptosoriginal)
-    min_points = min(n_drawn, n_orig)
-
-    if min_points == 0:
-        print("Error: Failed to extract any points from one or both spirals. Check images and origin.", file=sys.stderr)
-        return None
-
-    # print(f"Extracted {n_drawn} points from drawn, {n_orig} from template.", file=sys.stderr)
-
-    # visualize the extracted points using matplotlib
-    import matplotlib
-    matplotlib.use('Agg')  # Use a non-GUI backend for saving images
-    import matplotlib.pyplot as plt
-    plt.figure(figsize=(10, 5))
-    plt.subplot(1, 2, 1)
-    plt.imshow(img_drawn_thresh, cmap='gray')
-    plt.scatter([p.x for p in ptosdesenhada], [p.y for p in ptosdesenhada], color='red', s=1)
-    plt.title('Extracted Points from Drawn Spiral')
-    plt.subplot(1, 2, 2)
-    plt.imshow(img_template_thresh, cmap='gray')
-    plt.scatter([p.x for p in ptosoriginal], [p.y for p in ptosoriginal], color='blue', s=1)
-    plt.title('Extracted Points from Template Spiral')
-   
-    # save the visualization to image
-    plt.savefig('extracted_points.png')
+    xy = np.array(hits, dtype=np.float64).reshape(-1, 2)
+    return SpiralPoints(xy[:, 0], xy[:, 1])
 
+def spiral_statistics(radius_orig: np.ndarray, radius_drawn: np.ndarray, window: int = None) -> dict:
+    """
+    Computes the model features from the radii of the template (orig) and drawn
+    spirals, sampled at matching angles. Radial differences are taken over the
+    common prefix of the two sequences.
+    """
+    min_points = min(len(radius_orig), len(radius_drawn))
 
-    # --- Feature Calculation ---
-    radiusangle_orig: List[RadiusAngle] = []
-    radiusangle_drawn: List[RadiusAngle] = []
-    difradial: List[RadiusAngle] = [] # Stores absolute radial differences
+    # Radial differences and crossings (sign changes of the difference)
+    dif_rad = radius_orig[:min_points] - radius_drawn[:min_points]
+    count_cross = int(np.count_nonzero(dif_rad[1:] * dif_rad[:-1] < 0))
 
-    # Transformation to polar coordinates (using origin xc, yc)
-    for i in range(n_orig):
-        dx = ptosoriginal[i].x - xc
-        dy = ptosoriginal[i].y - yc
-        radius = math.sqrt(dx * dx + dy * dy)
-        angle = math.atan2(dy, dx)  # Use atan2 for quadrant safety
-        radiusangle_orig.append(RadiusAngle(radius, angle))
-
-    for i in range(n_drawn):
-        dx = ptosdesenhada[i].x - xc
-        dy = ptosdesenhada[i].y - yc
-        radius = math.sqrt(dx * dx + dy * dy)
-        angle = math.atan2(dy, dx)
-        radiusangle_drawn.append(RadiusAngle(radius, angle))
-
-    # Calculate radial differences and crossings
-    dif_rad = 0.0
-    prev_rad_diff = 0.0
-    count_cross = 0
-
-    # Calculate initial difference for the first point
+    # RMS and related stats from the squared radial differences
     if min_points > 0:
-        prev_rad_diff = radiusangle_orig[0].radius - radiusangle_drawn[0].radius
-        difradial.append(RadiusAngle(abs(prev_rad_diff), 0))  # Angle not used here
-
-    for i in range(1, min_points):
-        dif_rad = radiusangle_orig[i].radius - radiusangle_drawn[i].radius
-        difradial.append(RadiusAngle(abs(dif_rad), 0))  # Store absolute difference
-        if dif_rad * prev_rad_diff < 0:  # Check for sign change (crossing)
-            count_cross += 1
-        prev_rad_diff = dif_rad
-
-    # Debugging: Print the radial differences
-    print(f"Radial differences: {[dr.radius for dr in difradial]}", file=sys.stderr)
-
-    # Calculate RMS and related stats from radial differences (difradial)
-    if difradial:  # Check if list is not empty
-        sum_sq_diff = sum(dr.radius ** 2 for dr in difradial)
-        rms = math.sqrt(sum_sq_diff / len(difradial))
-        max_rms_val = max(dr.radius ** 2 for dr in difradial)
-        min_rms_val = min(dr.radius ** 2 for dr in difradial)
-
-        # Calculate Standard Deviation of squared differences
-        mean_sq_diff = sum_sq_diff / len(difradial)
-        variance_rms = sum((dr.radius ** 2 - mean_sq_diff) ** 2 for dr in difradial) / len(difradial)
-        std_rms = math.sqrt(variance_rms)
-    else:  # Handle case with no radial differences calculated
+        sq_diff = dif_rad * dif_rad
+        mean_sq_diff = sq_diff.mean()
+        rms = math.sqrt(mean_sq_diff)
+        max_rms_val = float(sq_diff.max())
+        min_rms_val = float(sq_diff.min())
+        std_rms = math.sqrt(np.mean((sq_diff - mean_sq_diff) ** 2))
+    else:
         rms = 0.0
         std_rms = 0.0
         min_rms_val = 0.0
         max_rms_val = 0.0
 
-    # Debugging: Print RMS and related values
-    print(f"RMS: {rms:.6f}, Max RMS: {max_rms_val:.6f}, Min RMS: {min_rms_val:.6f}", file=sys.stderr)
-
-    # Calculate the radius for tremor features
-    tremor_radii = [r.radius for r in radiusangle_orig]  # Get list of radii from original points
-
-    # Initialize tremor statistics
-    mean_tremor = 0.0
-    max_tremor = 0.0
-    min_tremor = float('inf')  # Start with a large value for min
-    std_tremor = 0.0
-    count_tremor = len(tremor_radii)
-
-    if count_tremor > 0:
-        # Calculate mean tremor
-        mean_tremor = sum(tremor_radii) / count_tremor
-
-        # Calculate max and min tremor
-        max_tremor = max(tremor_radii)
-        min_tremor = min(tremor_radii)
-
-        # Calculate standard deviation
-        variance_tremor = sum((r - mean_tremor) ** 2 for r in tremor_radii) / count_tremor
-        std_tremor = math.sqrt(variance_tremor)
+    # Tremor statistics over the radii of the original points
+    if len(radius_orig) > 0:
+        mean_tremor = float(radius_orig.mean())
+        max_tremor = float(radius_orig.max())
+        min_tremor = float(radius_orig.min())
+        std_tremor = math.sqrt(np.mean((radius_orig - mean_tremor) ** 2))
     else:
-        # Handle case with insufficient points
         mean_tremor = 0.0
         max_tremor = 0.0
         min_tremor = 0.0
         std_tremor = 0.0
 
-    # Calculate Crossings Rate
-    crossings_rate = float(count_cross) / len(difradial) if len(difradial) > 0 else 0.0
-
     # Calculate the normalized DTW distance
-    normalized_dtw = dtw_distance(radiusangle_orig, radiusangle_drawn)
-
-    # --- Output ---
-    # Print stats to stderr
-    print(f"RMS: {rms:.6f} (+/- {std_rms:.6f}) \n "
-          f"maxSqDiff: {max_rms_val:.6f} \t minSqDiff: {min_rms_val:.6f} \n "
-          f"Npoints: {n_drawn}: {n_orig} \n"
-          f"MRT: {mean_tremor:.6f}\t MaxT: {max_tremor:.6f}\t MinT: {min_tremor:.6f}\t StdT: {std_tremor:.6f} \n"
-          f"CrossRate: {crossings_rate:.6f} (Crossings: {count_cross})\n"
-          f"NormDTWdistance: {normalized_dtw:.6f}", file=sys.stderr)
-    
+    with metrics.span("dtw"):
+        normalized_dtw = dtw_distance(radius_orig, radius_drawn, window)
+
     return {
         'RMS': rms,
         'MAX_BETWEEN_ET_HT': max_rms_val,
@@ -272,9 +288,21 @@ def get_features(traced, template):
     }
 
 # Zhang-Suen Thinning Algorithm
-def zhang_suen(dest: np.ndarray):
+def zhang_suen(dest: np.ndarray, engine: str = "lut"):
     """
     Applies the Zhang-Suen thinning algorithm in place.
+    engine selects the implementation: "lut" (vectorized, default), "frontier"
+    (only revisits pixels next to deletions; fastest when the stroke covers a
+    small part of a large canvas) or "reference" (the original per-pixel loop).
+    All engines give identical output.
+    """
+    if engine not in THINNING_ENGINES:
+        raise ValueError(f"Unknown thinning engine: {engine}")
+    THINNING_ENGINES[engine](dest)
+
+def zhang_suen_reference(dest: np.ndarray):
+    """
+    Applies the Zhang-Suen thinning algorithm in place, one pixel at a time.
     Assumes input image is binary (e.g., 0 and 255).
     Modifies the image to have 0 for background and 1 for foreground during processing,
     then converts back to 255 for background and 0 for foreground.
@@ -394,17 +422,24 @@ def zhang_suen(dest: np.ndarray):
     # Invert back: Background (0) to 255, Foreground (1) to 0
     dest[:, :] = np.where(img_proc == 0, 255, 0).astype(np.uint8)
 
+THINNING_ENGINES = {
+    "lut": zhang_suen_lut,
+    "frontier": zhang_suen_frontier,
+    "reference": zhang_suen_reference,
+}
+
 
 # Function to swap values (Python returns tuples)
 def invert(ini: float, fim: float) -> Tuple[float, float]:
     return fim, ini
 
 # Line drawing algorithm (DDA variant) to find first foreground pixel
-def line_idda(img_: np.ndarray, yi: float, xi: float, yf: float, xf: float, v: List[Vertex]):
+def line_idda(img_: np.ndarray, yi: float, xi: float, yf: float, xf: float, v: List[Vertex] = None):
     """
     Traces a line from (xi, yi) to (xf, yf). Finds the first foreground pixel (0)
-    encountered along the path, adds its coordinates to list v, and marks the
-    traced path pixels as background (255) to avoid re-processing.
+    encountered along the path, returns its (x, y) (None if there is none) and,
+    if a list v is given, also appends it there as a Vertex. Marks the traced
+    path pixels as background (255) to avoid re-processing.
     """
     height, width = img_.shape
     xi, yi, xf, yf = int(round(xi)), int(round(yi)), int(round(xf)), int(round(yf))
@@ -432,7 +467,7 @@ def line_idda(img_: np.ndarray, yi: float, xi: float, yf: float, xf: float, v: L
     else:
         quant = abs(deltay)
 
-    get_point = True
+    hit = None
     entered = False
     walk = 1000  # Limit steps after finding the first point
 
@@ -441,10 +476,9 @@ def line_idda(img_: np.ndarray, yi: float, xi: float, yf: float, xf: float, v: L
         if 0 <= y < height and 0 <= x < width:
             if not entered and img_[y, x] == 0: # Found a foreground pixel (0)
                 entered = True
-                if get_point:
-                    get_point = False
-                    vert = Vertex(float(x), float(y))
-                    v.append(vert)
+                hit = (x, y)
+                if v is not None:
+                    v.append(Vertex(float(x), float(y)))
                 img_[y, x] = 255 # Mark as background to avoid reprocessing
 
         if entered:
@@ -519,6 +553,8 @@ def line_idda(img_: np.ndarray, yi: float, xi: float, yf: float, xf: float, v: L
                 erro += deltax - deltay # Adjusted for negative deltay
         q += 1
 
+    return hit
+
 # Point rotation
 def rotation(vert: Vertex, yp: float, xp: float, teta: float):
     """ Rotates a Vertex object in place around (xp, yp) by teta degrees. """
@@ -582,7 +618,19 @@ def find_origin(img_: np.ndarray, oy_guess: int, ox_guess: int) -> Tuple[int, in
     return oy_best, ox_best
 
 # Function to calculate the normalized DTW distance
-def dtw_distance(seq1: List[RadiusAngle], seq2: List[RadiusAngle]) -> float:
+def dtw_distance(seq1: List[RadiusAngle], seq2: List[RadiusAngle], window: int = None,
+                 best_so_far: float = math.inf) -> float:
+    """
+    Normalized DTW distance between the radii of two sequences, computed by the
+    vectorized engine in model.dtw. window sets a Sakoe-Chiba band half-width;
+    None (the default) is exact and matches dtw_distance_reference.
+    With a finite best_so_far, returns inf as soon as the pair provably cannot
+    beat it (see model.dtw.nearest_references for top-k search).
+    """
+    return dtw.dtw_distance(seq1, seq2, window, best_so_far)
+
+# Original full-matrix DTW, kept as the parity reference
+def dtw_distance_reference(seq1: List[RadiusAngle], seq2: List[RadiusAngle]) -> float:
     n, m = len(seq1), len(seq2)
     dtw = np.full((n + 1, m + 1), np.inf)
     dtw[0][0] = 0
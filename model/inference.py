@@ -1,52 +1,174 @@
-import xgboost as xgb
 import numpy as np
+import os
 import sys
-import pandas as pd
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from model.extract_features import get_features
+from model.strokes import Strokes, get_stroke_features
+from model.kinematics import kinematic_features
+from model.template_cache import TemplateCache
+from model.worker_pool import InferencePool
+from model.diagnostics import sink_from_env
+from model.tree_predictor import load_model
+from model import metrics
 import base64
 import cv2
 
 BLUR_RADIUS = 5
 
+# Model input columns, in training order
+FEATURE_NAMES = ['AGE', 'RMS', 'MAX_BETWEEN_ET_HT', 'MIN_BETWEEN_ET_HT', 'STD_DEVIATION_ET_HT', 'MRT',
+                 'MAX_HT', 'MIN_HT', 'STD_HT', 'CHANGES_FROM_NEGATIVE_TO_POSITIVE_BETWEEN_ET_HT']
+
+# Threads used to extract features for the drawings of a batch
+BATCH_WORKERS = int(os.environ.get("INFERENCE_BATCH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
 class PD_Model:
-    def __init__(self):
+    def __init__(self, execution: str = None):
+        """
+        execution: "inline" runs feature extraction on the calling thread;
+        "process" runs it in a pool of worker processes (see model/worker_pool.py),
+        so CPU-bound requests don't hold the server's GIL. Defaults to the
+        INFERENCE_EXECUTION environment variable, else "inline".
+        """
         self.model = self.load_model()
+        # Processed templates, keyed by template content (see model/template_cache.py).
+        # TEMPLATE_CACHE_DIR persists them across restarts and workers.
+        self.template_cache = TemplateCache(
+            maxsize=int(os.environ.get("TEMPLATE_CACHE_SIZE", "16")),
+            directory=os.environ.get("TEMPLATE_CACHE_DIR") or None,
+        )
+        # Debug artifacts of the pipeline, off unless DIAGNOSTICS is set (see model/diagnostics.py)
+        self.diagnostics = sink_from_env()
+
+        execution = execution or os.environ.get("INFERENCE_EXECUTION", "inline")
+        if execution not in ("inline", "process"):
+            raise ValueError(f"Unknown inference execution mode: {execution}")
+        if multiprocessing.current_process().name != "MainProcess":
+            # Spawned pool workers re-import the main module (and may build a
+            # PD_Model there) before they run anything; never nest pools.
+            execution = "inline"
+        self.pool = None
+        if execution == "process":
+            self.pool = InferencePool.from_env()
+            self.pool.warm_up()
 
     def load_model(self):
-
-        model = xgb.Booster()
-        model.load_model('model/xgboost_model.json')
-
-        # Feature names: 
-        # 'AGE', 'RMS', 'MAX_BETWEEN_ET_HT', 'MIN_BETWEEN_ET_HT', 'STD_DEVIATION_ET_HT', 'MRT', 
-        # 'MAX_HT', 'MIN_HT', 'STD_HT', 'CHANGES_FROM_NEGATIVE_TO_POSITIVE_BETWEEN_ET_HT'
-
-        # importance = model.get_score(importance_type='gain')
-
-        # print("Feature importance:", sorted(importance.items(), key=lambda item: item[1], reverse=True))
-
+        # Trees evaluated with NumPy, identical to xgboost's Booster.predict,
+        # memory-mapped from the built artifact if it is up to date
+        # (see model/tree_predictor.py)
+        model = load_model()
+        if model.feature_names != FEATURE_NAMES:
+            raise ValueError(f"Model features {model.feature_names} don't match {FEATURE_NAMES}")
         return model
 
-    def run_inference(self, traced, template, age):
-        print("Running inference...")
+    @staticmethod
+    def feature_row(features, age):
+        """ Model input row for extracted features and the patient's age. """
+        return [age] + [features[name] for name in FEATURE_NAMES[1:]]
+
+    def get_features(self, traced, template):
+        if self.pool is not None:
+            # The worker's own spans are merged back by the pool
+            with metrics.span("pool"):
+                return self.pool.get_features(traced, template)
+        with metrics.span("get_features"):
+            return self._extract(traced, template)
+
+    def _extract(self, traced, template):
+        # traced is an image (base64 or bytes) or, from stroke input, Strokes
+        if isinstance(traced, Strokes):
+            return get_stroke_features(traced, template, template_cache=self.template_cache)
+        return get_features(traced, template, template_cache=self.template_cache,
+                            diagnostics=self.diagnostics)
+
+    def kinematic_features(self, traced):
+        """ Pen kinematics of timestamped Strokes (see model/kinematics.py), else None. """
+        if not isinstance(traced, Strokes) or not traced.has_time:
+            return None
+        if self.pool is not None:
+            with metrics.span("pool"):
+                return self.pool.kinematic_features(traced)
+        return kinematic_features(traced)
 
-        features = get_features(traced, template)
-        dtw_distance = features.pop('NORMALIZED_DTW_DISTANCE')
-        mean_tremor = features['MRT']
+    def run_inference(self, traced, template, age):
+        if self.pool is not None:
+            with metrics.span("pool"):
+                return self.pool.run_inference(traced, template, age)
 
-        ft_df = pd.DataFrame(features, index=[0])
-        ft_df.insert(0, 'AGE', age)  # Insert 'AGE' as the first column
+        with metrics.span("run_inference"):
+            with metrics.span("get_features"):
+                features = self._extract(traced, template)
+            if features is None:
+                raise ValueError("Could not extract features from the images")
+            dtw_distance = features.pop('NORMALIZED_DTW_DISTANCE')
+            mean_tremor = features['MRT']
 
-        severity_score = self.model.predict(xgb.DMatrix(ft_df))[0]
+            with metrics.span("predict"):
+                severity_score = self.model.predict(np.array([self.feature_row(features, age)]))[0]
 
         return severity_score, mean_tremor, dtw_distance
 
+    def run_inference_batch(self, items, max_workers: int = None):
+        """
+        Scores several drawings at once. items is a list of (traced, template, age)
+        tuples. Features are extracted in parallel (threads, or the worker
+        processes in "process" mode) and all drawings are scored with a single
+        predict call.
+
+        Returns one entry per item, in order: (severity_score, mean_tremor,
+        dtw_distance) on success, or an Exception describing why that item failed.
+        """
+        def extract(item):
+            traced, template, age = item
+            try:
+                age = float(age)
+                features = self.get_features(traced, template)
+                if features is None:
+                    raise ValueError("Could not extract features from the images")
+                return age, features
+            except Exception as e:
+                return e
+
+        default_workers = self.pool.workers if self.pool is not None else BATCH_WORKERS
+        workers = max(1, min(max_workers or default_workers, len(items)))
+        if workers > 1:
+            # Spans recorded on the pool's threads are handed back to this
+            # thread's collection (the request's Server-Timing), as db.gather does
+            def extract_timed(item):
+                with metrics.collect() as timings:
+                    return extract(item), timings
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                outcomes = list(pool.map(extract_timed, items))
+            for _, timings in outcomes:
+                metrics.extend(timings)
+            extracted = [outcome for outcome, _ in outcomes]
+        else:
+            extracted = [extract(item) for item in items]
+
+        results = list(extracted)
+        scored = [i for i, item in enumerate(extracted) if not isinstance(item, Exception)]
+        if scored:
+            rows = np.array([self.feature_row(features, age) for age, features in (extracted[i] for i in scored)])
+
+            try:
+                with metrics.span("predict_batch"):
+                    severity_scores = self.model.predict(rows)
+            except Exception as e:
+                return [e if i in scored else results[i] for i in range(len(results))]
+
+            for i, severity_score in zip(scored, severity_scores):
+                _, features = extracted[i]
+                results[i] = (severity_score, features['MRT'], features['NORMALIZED_DTW_DISTANCE'])
+
+        return results
+
 
 if __name__ == "__main__":
     model = PD_Model()
 
-    input_df = pd.DataFrame({
-        'AGE': 28,
+    features = {
         'RMS': 2446.759108,
         'MAX_BETWEEN_ET_HT': 5388.771096,
         'MIN_BETWEEN_ET_HT': 33435.39545,
@@ -56,8 +178,8 @@ if __name__ == "__main__":
         'MIN_HT': 0.017068,
         'STD_HT': 1779.550502,
         'CHANGES_FROM_NEGATIVE_TO_POSITIVE_BETWEEN_ET_HT': 0.216138
-    }, index=[0])
+    }
 
-    predictions = model.model.predict(xgb.DMatrix(input_df))
+    predictions = model.model.predict(np.array([model.feature_row(features, 28)]))
     print("Predictions:", predictions)
 
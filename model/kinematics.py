@@ -0,0 +1,209 @@
+import math
+from typing import Tuple
+
+import numpy as np
+
+from model.strokes import Strokes
+from model import metrics
+
+# Kinematic features of timestamped strokes.
+#
+# get_features only sees the finished drawing, so its tremor features are
+# geometric. With pen timestamps the motion itself is available: speed,
+# acceleration and jerk of the pen, and the power of the velocity signal in
+# the 4-12 Hz band where parkinsonian and essential tremor live.
+#
+# Everything is computed as a stream: points are resampled onto a uniform
+# clock, differentiated with a few samples of carried-over context, folded
+# into running statistics, and the velocity goes through a Welch estimator
+# that only keeps one window of samples and the accumulated spectrum. Memory
+# stays constant however long the recording is.
+
+DEFAULT_FS = 100.0           # Hz, uniform resampling rate
+DEFAULT_WINDOW = 256         # samples per Welch segment (2.56 s at 100 Hz)
+TREMOR_BAND = (4.0, 12.0)    # Hz
+
+
+class RunningStats:
+    """ Count, mean, variance (population) and max of a stream of values, updated a chunk at a time. """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.max = -math.inf
+
+    def update(self, values: np.ndarray):
+        if len(values) == 0:
+            return
+        # Chan et al.'s pairwise combination of (count, mean, M2)
+        n = len(values)
+        mean = float(values.mean())
+        m2 = float(((values - mean) ** 2).sum())
+        delta = mean - self.mean
+        total = self.count + n
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.count * n / total
+        self.count = total
+        self.max = max(self.max, float(values.max()))
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / self.count) if self.count else 0.0
+
+
+class WelchBandPower:
+    """
+    Streaming Welch power spectral density of a multi-channel signal (summed
+    over channels): Hann-windowed segments of `window` samples, 50% overlap,
+    mean removed per segment, one-sided density scaling as scipy.signal.welch.
+    Only the last window of samples and the accumulated spectrum are kept.
+    Call reset() at a discontinuity (pen lift) to start new segments.
+    """
+    def __init__(self, fs: float, window: int = DEFAULT_WINDOW, channels: int = 2):
+        self.fs = fs
+        self.window = window
+        self.hop = window // 2
+        self.taper = np.hanning(window + 1)[:-1]  # periodic Hann, as scipy's get_window("hann")
+        self.scale = 1.0 / (fs * (self.taper ** 2).sum())
+        self.freqs = np.fft.rfftfreq(window, 1.0 / fs)
+        self.psd_sum = np.zeros(len(self.freqs))
+        self.segments = 0
+        self._buffer = np.empty((0, channels))
+        self._channels = channels
+
+    def reset(self):
+        self._buffer = np.empty((0, self._channels))
+
+    def push(self, samples: np.ndarray):
+        """ Adds (n, channels) samples, processing every segment they complete in one FFT call. """
+        data = np.concatenate([self._buffer, samples]) if len(self._buffer) else samples
+        if len(data) >= self.window:
+            count = (len(data) - self.window) // self.hop + 1
+            # (count, channels, window) views of the complete segments
+            segments = np.lib.stride_tricks.sliding_window_view(data, self.window, axis=0)[::self.hop][:count]
+            segments = segments - segments.mean(axis=-1, keepdims=True)
+            spectrum = np.fft.rfft(segments * self.taper, axis=-1)
+            psd = (spectrum.real ** 2 + spectrum.imag ** 2) * self.scale
+            psd[..., 1:-1 if self.window % 2 == 0 else None] *= 2
+            self.psd_sum += psd.sum(axis=(0, 1))
+            self.segments += count
+            data = data[count * self.hop:]
+        # Less than a window is left: the start of the next segment
+        self._buffer = data.copy()
+
+    def psd(self) -> np.ndarray:
+        """ Mean PSD over the segments seen so far (zeros if none completed). """
+        return self.psd_sum / self.segments if self.segments else self.psd_sum
+
+    def band_power(self, band: Tuple[float, float] = TREMOR_BAND):
+        """ (power in band, total power above DC, peak frequency in band) of the mean PSD. """
+        psd = self.psd()
+        df = self.freqs[1] - self.freqs[0]
+        in_band = (self.freqs >= band[0]) & (self.freqs <= band[1])
+        power = float(psd[in_band].sum() * df)
+        total = float(psd[1:].sum() * df)
+        peak = float(self.freqs[in_band][psd[in_band].argmax()]) if power > 0 else 0.0
+        return power, total, peak
+
+
+class KinematicsStream:
+    """
+    Speed, acceleration, jerk and tremor band power of a pen, fed in chunks
+    of raw (x, y, t) points. Positions are resampled at fs; derivatives are
+    finite differences of the resampled positions, carried across chunks of
+    one stroke. end_stroke() marks a pen lift: nothing is differentiated or
+    windowed across it.
+    """
+    def __init__(self, fs: float = DEFAULT_FS, window: int = DEFAULT_WINDOW):
+        self.fs = fs
+        self.speed = RunningStats()
+        self.acceleration = RunningStats()
+        self.jerk = RunningStats()
+        self.welch = WelchBandPower(fs, window)
+        self.duration = 0.0
+        self._last = None    # last raw point (t, x, y) of the current stroke
+        self._next_t = None  # time of the next uniform sample
+        self._context = np.empty((0, 2))  # last resampled positions, for the differences
+
+    def push(self, x: np.ndarray, y: np.ndarray, t: np.ndarray):
+        t = np.asarray(t, dtype=np.float64)
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if self._last is not None:
+            t = np.concatenate([[self._last[0]], t])
+            x = np.concatenate([[self._last[1]], x])
+            y = np.concatenate([[self._last[2]], y])
+        # Repeated or out-of-order timestamps can't be interpolated; keep the first of each
+        keep = np.ones(len(t), dtype=bool)
+        keep[1:] = t[1:] > np.maximum.accumulate(t)[:-1]
+        t, x, y = t[keep], x[keep], y[keep]
+        if len(t) == 0:
+            return
+        if self._next_t is None:
+            self._next_t = t[0]
+        self._last = (t[-1], x[-1], y[-1])
+
+        clock = np.arange(self._next_t, t[-1] + 1e-12, 1.0 / self.fs)
+        if len(clock) == 0:
+            return
+        self._next_t = clock[-1] + 1.0 / self.fs
+        self.duration += len(clock) / self.fs
+        positions = np.column_stack([np.interp(clock, t, x), np.interp(clock, t, y)])
+
+        # Differences over [context, new samples]; each derivative only
+        # yields values for samples that have enough history
+        samples = np.concatenate([self._context, positions])
+        velocity = np.diff(samples, axis=0) * self.fs
+        acceleration = np.diff(velocity, axis=0) * self.fs
+        jerk = np.diff(acceleration, axis=0) * self.fs
+        new = len(positions)
+        self.speed.update(np.hypot(*velocity[-new:].T))
+        self.acceleration.update(np.hypot(*acceleration[-new:].T))
+        self.jerk.update(np.hypot(*jerk[-new:].T))
+        self.welch.push(velocity[-new:])
+        self._context = samples[-3:]
+
+    def end_stroke(self):
+        self._last = None
+        self._next_t = None
+        self._context = np.empty((0, 2))
+        self.welch.reset()
+
+    def features(self, band: Tuple[float, float] = TREMOR_BAND) -> dict:
+        power, total, peak = self.welch.band_power(band)
+        return {
+            'DURATION': self.duration,
+            'MEAN_SPEED': self.speed.mean,
+            'STD_SPEED': self.speed.std,
+            'MAX_SPEED': max(self.speed.max, 0.0),
+            'MEAN_ACCELERATION': self.acceleration.mean,
+            'STD_ACCELERATION': self.acceleration.std,
+            'MAX_ACCELERATION': max(self.acceleration.max, 0.0),
+            'MEAN_JERK': self.jerk.mean,
+            'STD_JERK': self.jerk.std,
+            'MAX_JERK': max(self.jerk.max, 0.0),
+            'TREMOR_BAND_POWER': power,
+            'TREMOR_RELATIVE_POWER': power / total if total > 0 else 0.0,
+            'TREMOR_PEAK_FREQUENCY': peak,
+            'WELCH_SEGMENTS': self.welch.segments,
+        }
+
+
+def kinematic_features(strokes: Strokes, fs: float = DEFAULT_FS, window: int = DEFAULT_WINDOW,
+                       chunk: int = 4096) -> dict:
+    """
+    Kinematic features of timestamped strokes (t in seconds), in pixels and
+    seconds. Tremor band power needs at least one stroke of window / fs
+    seconds; shorter recordings report zero power. Raises ValueError if the
+    strokes carry no timestamps.
+    """
+    if not strokes.has_time:
+        raise ValueError("Kinematic features need timestamped strokes")
+    with metrics.span("kinematics"):
+        stream = KinematicsStream(fs, window)
+        for stroke in strokes.strokes:
+            for start in range(0, len(stroke), chunk):
+                part = stroke[start:start + chunk]
+                stream.push(part[:, 0], part[:, 1], part[:, 2])
+            stream.end_stroke()
+        return stream.features()
@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Latency instrumentation for the scoring pipeline.
+#
+# Code wraps each stage in `with metrics.span("stage"):`. Every span is
+# recorded in the process-wide REGISTRY, which keeps count, total and the last
+# METRICS_WINDOW durations of each stage and renders them as Prometheus
+# summaries (p50/p95/p99) for the /metrics endpoint. A thread can also collect
+# the spans it records between start_collecting() and stop_collecting(), which
+# is how the app builds per-request Server-Timing headers and how process-pool
+# workers send their timings back to the parent.
+
+QUANTILES = (0.5, 0.95, 0.99)
+METRIC_NAME = "trace_stage_duration_seconds"
+
+
+class Summary:
+    """ Count and sum of all observations, plus the last `window` of them for quantiles. """
+    def __init__(self, window: int = 1024):
+        self.count = 0
+        self.total = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.recent.append(value)
+
+    def quantiles(self):
+        """ {quantile: value} over the recent window (nearest rank), empty if nothing was observed. """
+        values = sorted(self.recent)
+        if not values:
+            return {}
+        return {q: values[min(int(q * len(values)), len(values) - 1)] for q in QUANTILES}
+
+
+class Registry:
+    """ Thread-safe set of per-stage duration summaries. """
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self._summaries = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            summary = self._summaries.get(stage)
+            if summary is None:
+                summary = self._summaries[stage] = Summary(self.window)
+            summary.observe(seconds)
+
+    def snapshot(self):
+        """ {stage: (count, total seconds, {quantile: seconds})} """
+        with self._lock:
+            return {stage: (s.count, s.total, s.quantiles()) for stage, s in sorted(self._summaries.items())}
+
+    def render(self) -> str:
+        """ The summaries in the Prometheus text exposition format. """
+        lines = [f"# HELP {METRIC_NAME} Duration of the stages of the scoring pipeline.",
+                 f"# TYPE {METRIC_NAME} summary"]
+        for stage, (count, total, quantiles) in self.snapshot().items():
+            for q, value in quantiles.items():
+                lines.append(f'{METRIC_NAME}{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'{METRIC_NAME}_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'{METRIC_NAME}_count{{stage="{stage}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self._summaries.clear()
+
+
+REGISTRY = Registry(int(os.environ.get("METRICS_WINDOW", "1024")))
+
+_local = threading.local()
+
+
+def record(stage: str, seconds: float):
+    """ Records a finished span in the registry and in this thread's collection, if any. """
+    REGISTRY.observe(stage, seconds)
+    timings = getattr(_local, "timings", None)
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def span(stage: str):
+    """ Times the enclosed block as one occurrence of stage. """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def start_collecting() -> list:
+    """ Starts collecting this thread's spans; returns the list they are appended to as (stage, seconds). """
+    _local.timings = []
+    return _local.timings
+
+
+def stop_collecting() -> list:
+    timings = getattr(_local, "timings", None)
+    _local.timings = None
+    return timings or []
+
+
+@contextmanager
+def collect():
+    """ Collects the spans recorded on this thread inside the block, restoring any outer collection after. """
+    outer = getattr(_local, "timings", None)
+    timings = start_collecting()
+    try:
+        yield timings
+    finally:
+        _local.timings = outer
+        if outer is not None:
+            outer.extend(timings)
+
+
+def extend(timings):
+    """ Adds spans collected on another thread (already in the registry) to this thread's collection, if any. """
+    collected = getattr(_local, "timings", None)
+    if collected is not None:
+        collected.extend(timings)
+
+
+def server_timing(timings) -> str:
+    """ Server-Timing header value for a list of (stage, seconds); repeated stages are summed. """
+    totals = {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
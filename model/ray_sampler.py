@@ -0,0 +1,164 @@
+import math
+from functools import lru_cache
+
+import numpy as np
+
+# Vectorized replacement for the line_idda ray-casting loop in get_features.
+#
+# get_features casts one ray per degree from the spiral origin towards a point
+# far outside the image, keeps the first foreground pixel along each ray and
+# erases the next WALK steps of the ray on a working copy. The rays only depend
+# on the image shape and the origin, so their pixel coordinates are generated
+# once for all angles (stepping every ray in lockstep with line_idda's octant
+# rules) and cached; sampling is then a gather + argmax per ray.
+
+WALK = 1000  # Steps erased from the first hit on, as in line_idda
+
+
+def _round(value: float) -> int:
+    # Same rounding as line_idda (Python's round-half-to-even)
+    return int(round(value))
+
+
+def ray_endpoints(start_x: float, yc: float, xc: float, num_angles: int):
+    """
+    Far endpoints (y, x) of the rays, reproducing the sequence of in-place
+    rotations get_features applies to its Vertex (+1 degree, then -1 degree
+    per angle) so the floating-point values match exactly.
+    """
+    x, y = start_x, yc
+    endpoints = []
+    for teta in [1] + [-1] * num_angles:
+        angle_rad = math.radians(teta)
+        cos_t = math.cos(angle_rad)
+        sin_t = math.sin(angle_rad)
+        x_rel = x - xc
+        y_rel = y - yc
+        x = (x_rel * cos_t - y_rel * sin_t) + xc
+        y = (x_rel * sin_t + y_rel * cos_t) + yc
+        endpoints.append((y, x))
+    return endpoints[1:]
+
+
+def trace_paths(yi: int, xi: int, yf: np.ndarray, xf: np.ndarray):
+    """
+    Pixel paths of line_idda from (xi, yi) to each (xf, yf), stepped for all
+    rays at once. Returns (ys, xs, valid), each of shape (rays, max_steps + 1);
+    valid marks the steps a ray actually takes.
+    """
+    yi_arr = np.full(len(yf), yi)
+    xi_arr = np.full(len(xf), xi)
+
+    # line_idda swaps the endpoints of rays pointing up, so every ray is
+    # traversed with deltay >= 0 and only its first four octant branches apply.
+    swap = (yi_arr > yf) | ((xf - xi_arr == 0) & (yf - yi_arr < 0))
+    x0 = np.where(swap, xf, xi_arr)
+    y0 = np.where(swap, yf, yi_arr)
+    x1 = np.where(swap, xi_arr, xf)
+    y1 = np.where(swap, yi_arr, yf)
+    deltax = x1 - x0
+    deltay = y1 - y0
+
+    quant = np.maximum(np.abs(deltax), np.abs(deltay))
+    steps = int(quant.max()) + 1 if len(quant) else 0
+
+    oct1 = (deltax >= 0) & (deltax >= deltay)
+    oct2 = (deltax >= 0) & (deltay > deltax)
+    oct4 = (deltax < 0) & (-deltax >= deltay)
+    oct3 = (deltax < 0) & (deltay > -deltax)
+
+    ys = np.empty((len(yf), steps), dtype=np.int64)
+    xs = np.empty((len(xf), steps), dtype=np.int64)
+    x = x0.astype(np.int64)
+    y = y0.astype(np.int64)
+    erro = np.zeros(len(xf), dtype=np.int64)
+
+    for q in range(steps):
+        xs[:, q] = x
+        ys[:, q] = y
+        neg = erro < 0
+        # In the x-major octants a ray keeps its row while the error is negative
+        # (or the ray is horizontal); in the y-major ones it keeps its column
+        # while the error is non-negative.
+        hold = neg | (deltay == 0)
+
+        step_x = (np.where(oct1, 1, 0) + np.where(oct2 & neg, 1, 0)
+                  - np.where(oct4, 1, 0) - np.where(oct3 & neg, 1, 0))
+        step_y = np.where((oct1 | oct4) & hold, 0, 1)
+        d_err = np.select(
+            [oct1 & hold, oct1, oct2 & neg, oct2, oct4 & hold, oct4, oct3 & neg, oct3],
+            [deltay, deltay - deltax, deltay - deltax, -deltax, deltay, deltax + deltay, deltax + deltay, deltax])
+        x = x + step_x
+        y = y + step_y
+        erro = erro + d_err
+
+    valid = np.arange(steps)[None, :] <= quant[:, None]
+    return ys, xs, valid
+
+
+@lru_cache(maxsize=16)
+def ray_table(height: int, width: int, yc: int, xc: int, start_x: float, num_angles: int):
+    """
+    In-image part of every ray for an image shape and origin, as a
+    (rays, length) array of flat pixel indices padded with -1. The in-image
+    steps of a straight ray are contiguous, so index k of a row is the k-th
+    in-image step of that ray. Cached: clinics reuse a few template shapes.
+    """
+    endpoints = ray_endpoints(start_x, float(yc), float(xc), num_angles)
+    yf = np.array([_round(y) for y, _ in endpoints], dtype=np.int64)
+    xf = np.array([_round(x) for _, x in endpoints], dtype=np.int64)
+    ys, xs, valid = trace_paths(_round(float(yc)), _round(float(xc)), yf, xf)
+
+    inside = valid & (ys >= 0) & (ys < height) & (xs >= 0) & (xs < width)
+    lengths = inside.sum(axis=1)
+    table = np.full((len(endpoints), max(int(lengths.max()), 1)), -1, dtype=np.int32)
+    for ray in range(len(endpoints)):
+        flat = ys[ray][inside[ray]] * width + xs[ray][inside[ray]]
+        table[ray, :len(flat)] = flat
+    table.flags.writeable = False
+    return table, lengths
+
+
+def sample_rays(img: np.ndarray, yc: int, xc: int, start_x: float,
+                num_turns: int = 3, num_angles: int = 360, exact: bool = True):
+    """
+    Casts num_turns x num_angles rays from (xc, yc) over the thinned image img
+    (0 = foreground), erasing each ray's first hit and the WALK steps after it
+    in img, and returns the hits as (x, y) float arrays.
+
+    exact=True processes rays one after the other, so each ray sees the pixels
+    erased by the previous ones: the points match the line_idda loop exactly.
+    exact=False evaluates all rays of a turn against the image as it was when
+    the turn started, which is fully vectorized but can differ where
+    neighbouring rays overlap near the origin.
+    """
+    height, width = img.shape
+    table, lengths = ray_table(height, width, int(yc), int(xc), float(start_x), num_angles)
+    work = img.reshape(-1)  # view: erasing writes through to img
+
+    hits = []
+    for _ in range(num_turns):
+        if exact:
+            for ray in range(len(table)):
+                flat = table[ray, :lengths[ray]]
+                if flat.size == 0:
+                    continue
+                found = work[flat] == 0
+                first = int(found.argmax())
+                if found[first]:
+                    hits.append(flat[first])
+                    work[flat[first:first + WALK]] = 255
+        else:
+            # A padded -1 reads the sentinel appended at the end, which is background
+            padded = np.append(work, 255)
+            found = padded[table] == 0
+            first = found.argmax(axis=1)
+            has_hit = found[np.arange(len(table)), first]
+            hits.extend(table[has_hit, first[has_hit]].tolist())
+
+            steps = np.arange(table.shape[1])[None, :]
+            erase = has_hit[:, None] & (steps >= first[:, None]) & (steps < first[:, None] + WALK) & (table >= 0)
+            work[table[erase]] = 255
+
+    hits = np.array(hits, dtype=np.int64)
+    return (hits % width).astype(np.float64), (hits // width).astype(np.float64)
@@ -0,0 +1,185 @@
+import os
+import sys
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from model.extract_features import (image_bytes, decode_image, prepare_template, spiral_statistics,
+                                    extract_points, zhang_suen)
+from model.template_cache import TemplateCache, template_key
+from model import metrics
+
+# Stroke input for the feature pipeline.
+#
+# The frontend records the spiral as pen strokes and rasterizes them to a PNG,
+# which get_features decodes, thresholds, thins and ray-casts. With the
+# strokes themselves the backend draws the pen line itself, the way the
+# canvas does (PEN_WIDTH pixels, antialiased, every covered pixel counting as
+# stroke, as get_features reads the PNG's alpha), and only thins the part of
+# the canvas the drawing covers. From there the path is get_features': the
+# same ray sampling of the skeleton, against the same cached template points.
+#
+# The features depend on the raster: get_features' rays erase pixels as they
+# go and slip through diagonal gaps of the skeleton, so even a one pixel
+# difference in pen width changes them by up to a third. Scoring strokes with
+# exact geometry instead would put them on a different scale than submitted
+# images; drawn like this they match (python -m model.benchmark parity).
+
+# Width of the frontend's pen, in canvas pixels
+PEN_WIDTH = int(os.environ.get("STROKE_PEN_WIDTH", "3"))
+
+# Limits on timestamped input: the kinematics resample every stroke onto a
+# uniform clock, so the work is set by the timestamps, not by the points sent
+MAX_STROKE_SECONDS = float(os.environ.get("MAX_STROKE_SECONDS", "300"))
+MAX_STROKE_SAMPLES = int(os.environ.get("MAX_STROKE_SAMPLES", "50000"))
+
+class Strokes:
+    """
+    A drawing as pen strokes in canvas pixel coordinates. Each stroke is an
+    (n, 2..4) float64 array of x, y and optionally t (seconds) and pressure
+    per point, in drawing order. canvas_shape is (height, width), if known.
+    """
+    def __init__(self, strokes: List[np.ndarray], canvas_shape: Optional[Tuple[int, int]] = None):
+        self.strokes = strokes
+        self.canvas_shape = canvas_shape
+
+    def __len__(self):
+        return sum(len(stroke) for stroke in self.strokes)
+
+    @property
+    def has_time(self) -> bool:
+        return all(stroke.shape[1] >= 3 for stroke in self.strokes)
+
+
+def parse_strokes(strokes, canvas=None) -> Strokes:
+    """
+    Builds Strokes from JSON-like input: a list of strokes, each a list of
+    [x, y], [x, y, t] or [x, y, t, pressure] points. canvas is an optional
+    {"width": w, "height": h}. Raises ValueError on malformed input, and on
+    timestamps that go backwards or exceed MAX_STROKE_SECONDS or
+    MAX_STROKE_SAMPLES (see check_timestamps).
+    """
+    if not isinstance(strokes, list) or not strokes:
+        raise ValueError("strokes must be a non-empty list of strokes")
+    arrays = []
+    for stroke in strokes:
+        try:
+            arr = np.asarray(stroke, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError("each stroke must be a list of [x, y(, t, pressure)] points")
+        if arr.ndim != 2 or not 2 <= arr.shape[1] <= 4 or not np.isfinite(arr).all():
+            raise ValueError("each stroke must be a list of [x, y(, t, pressure)] points")
+        if len(arr) > 0:
+            arrays.append(arr)
+    if not arrays:
+        raise ValueError("strokes contain no points")
+    if len({arr.shape[1] for arr in arrays}) > 1:
+        raise ValueError("all points must have the same fields")
+    if arrays[0].shape[1] >= 3:
+        check_timestamps(arrays)
+
+    canvas_shape = None
+    if canvas is not None:
+        try:
+            canvas_shape = (int(canvas["height"]), int(canvas["width"]))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("canvas must be {\"width\": w, \"height\": h}")
+    return Strokes(arrays, canvas_shape)
+
+
+def check_timestamps(arrays: List[np.ndarray], max_seconds: float = None, max_samples: int = None):
+    """
+    Raises ValueError unless the t column never decreases, within and across
+    strokes, the drawing lasts at most max_seconds, and resampling it for the
+    kinematics yields at most max_samples samples.
+    """
+    # Imported here: model.kinematics imports this module
+    from model.kinematics import DEFAULT_FS
+
+    max_seconds = MAX_STROKE_SECONDS if max_seconds is None else max_seconds
+    max_samples = MAX_STROKE_SAMPLES if max_samples is None else max_samples
+    t = np.concatenate([arr[:, 2] for arr in arrays])
+    if (np.diff(t) < 0).any():
+        raise ValueError("timestamps must not decrease")
+    duration = float(t[-1] - t[0])
+    if duration > max_seconds:
+        raise ValueError(f"drawing lasts {duration:g} s (limit {max_seconds:g} s)")
+    # One sample every 1 / DEFAULT_FS seconds of each stroke, plus its first
+    samples = sum(int((arr[-1, 2] - arr[0, 2]) * DEFAULT_FS) + 1 for arr in arrays)
+    if samples > max_samples:
+        raise ValueError(f"drawing resamples to {samples} samples (limit {max_samples})")
+
+
+def render_strokes(strokes: Strokes, canvas_shape: Tuple[int, int], pen_width: int = PEN_WIDTH) -> np.ndarray:
+    """
+    The strokes drawn as the frontend's canvas draws them, thresholded as
+    get_features thresholds a drawing: 0 wherever the pen covered the pixel
+    at all, 255 elsewhere.
+    """
+    coverage = np.zeros(canvas_shape[:2], dtype=np.uint8)
+    for stroke in strokes.strokes:
+        # Sub-pixel positions, in 1/16 pixel
+        points = np.round(stroke[:, :2] * 16).astype(np.int32).reshape(-1, 1, 2)
+        cv2.polylines(coverage, [points], False, 255, pen_width, cv2.LINE_AA, shift=4)
+    return np.where(coverage > 0, 0, 255).astype(np.uint8)
+
+
+def thin_drawing(img: np.ndarray):
+    """ zhang_suen on the bounding box of the drawing only; thinning is local, so the result is the same. """
+    ys, xs = np.nonzero(img == 0)
+    if len(ys) == 0:
+        return
+    y0, y1 = max(int(ys.min()) - 2, 0), int(ys.max()) + 3
+    x0, x1 = max(int(xs.min()) - 2, 0), int(xs.max()) + 3
+    region = img[y0:y1, x0:x1].copy()
+    zhang_suen(region)
+    img[y0:y1, x0:x1] = region
+
+
+def image_shape(data) -> Tuple[int, int]:
+    """ (height, width) of an encoded image, read from the PNG header when possible. """
+    header = bytes(data[:24])
+    if header[:8] == b"\x89PNG\r\n\x1a\n" and header[12:16] == b"IHDR":
+        return int.from_bytes(header[20:24], "big"), int.from_bytes(header[16:20], "big")
+    return decode_image(data).shape[:2]
+
+
+def get_stroke_features(strokes: Strokes, template, sampler: str = "exact",
+                        template_cache: TemplateCache = None):
+    """
+    get_features for a drawing given as Strokes: same template processing,
+    ray sampling and features, without encoding, decoding or thinning the
+    whole canvas. The drawn canvas is assumed to match the template image
+    unless strokes.canvas_shape says otherwise. Returns None on failure.
+    """
+    try:
+        with metrics.span("template"):
+            template = image_bytes(template)
+            canvas_shape = strokes.canvas_shape or image_shape(template)
+            key = template_key(template, canvas_shape, sampler)
+            entry = template_cache.get(key) if template_cache is not None else None
+            if entry is None:
+                entry = prepare_template(template, canvas_shape, sampler)
+                if template_cache is not None:
+                    template_cache.put(key, entry)
+    except Exception as e:
+        print(f"Error decoding template: {e}", file=sys.stderr)
+        return None
+
+    with metrics.span("rasterize"):
+        img_drawn = render_strokes(strokes, canvas_shape)
+    with metrics.span("thinning"):
+        thin_drawing(img_drawn)
+
+    # The same rays as get_features, from the template's origin
+    start_x = float(canvas_shape[1] + 350)
+    with metrics.span("ray_sampling"):
+        drawn = extract_points(img_drawn, entry.yc, entry.xc, start_x, sampler=sampler)
+
+    if len(drawn) == 0 or len(entry.radius) == 0:
+        print("Error: Failed to extract any points from one or both spirals. Check strokes and origin.", file=sys.stderr)
+        return None
+
+    drawn.to_polar(entry.yc, entry.xc)
+    return spiral_statistics(entry.radius, drawn.radius)
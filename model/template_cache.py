@@ -0,0 +1,140 @@
+import base64
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Cache of processed template spirals.
+#
+# Clinics use a handful of fixed templates, but every request used to decode,
+# threshold and thin the template, search its origin and ray-sample it again.
+# Entries are keyed by a content hash of the encoded template image (so a
+# template sent as base64 JSON or as a raw upload shares one entry) plus the
+# drawn image shape and ray sampler, which also shape the template points.
+# Entries are kept in memory (LRU) and, optionally, as .npz files in a
+# directory so they survive restarts and are shared between workers.
+
+
+def template_id(template) -> str:
+    """ Content hash of an encoded template image (bytes-like, or base64 text which is decoded first). """
+    data = base64.b64decode(template) if isinstance(template, str) else template
+    return hashlib.sha256(data).hexdigest()
+
+
+def template_key(template, drawn_shape: Tuple[int, int], sampler: str) -> str:
+    """ Cache key for a template sampled for a drawn image of drawn_shape. """
+    return f"{template_id(template)}-{drawn_shape[0]}x{drawn_shape[1]}-{sampler}"
+
+
+class TemplateEntry:
+    """
+    Processed template: thinned skeleton (0 = foreground), spiral origin and
+    the sampled template points in image and polar coordinates.
+    Arrays are read-only because entries are shared between requests.
+    """
+    def __init__(self, skeleton: np.ndarray, yc: int, xc: int, x: np.ndarray, y: np.ndarray,
+                 radius: np.ndarray, angle: np.ndarray):
+        self.skeleton = skeleton
+        self.yc = int(yc)
+        self.xc = int(xc)
+        self.x = x
+        self.y = y
+        self.radius = radius
+        self.angle = angle
+        for arr in (skeleton, x, y, radius, angle):
+            arr.flags.writeable = False
+
+    def save(self, path: str):
+        """ Writes the entry to path atomically, so concurrent readers never see a partial file. """
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, skeleton=self.skeleton, origin=np.array([self.yc, self.xc]),
+                     x=self.x, y=self.y, radius=self.radius, angle=self.angle)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "TemplateEntry":
+        with np.load(path) as data:
+            yc, xc = data["origin"]
+            return cls(data["skeleton"], yc, xc, data["x"], data["y"], data["radius"], data["angle"])
+
+
+class TemplateCache:
+    """
+    Thread-safe LRU cache of TemplateEntry objects holding up to maxsize
+    entries in memory. If directory is set, entries are also persisted there
+    and loaded from it on a memory miss.
+    """
+    def __init__(self, maxsize: int = 16, directory: Optional[str] = None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, key: str) -> Optional[TemplateEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        if self.directory and os.path.exists(self._path(key)):
+            try:
+                entry = TemplateEntry.load(self._path(key))
+            except Exception as e:
+                print(f"Warning: ignoring unreadable template cache file {self._path(key)}: {e}", file=sys.stderr)
+            else:
+                self._store(key, entry)
+                with self._lock:
+                    self.hits += 1
+                return entry
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, entry: TemplateEntry):
+        self._store(key, entry)
+        if self.directory:
+            try:
+                entry.save(self._path(key))
+            except OSError as e:
+                print(f"Warning: could not persist template cache entry {key}: {e}", file=sys.stderr)
+
+    def _store(self, key: str, entry: TemplateEntry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def preload(self):
+        """ Loads the most recently written entries of the cache directory into memory. """
+        if not self.directory:
+            return
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".npz")]
+        paths.sort(key=os.path.getmtime)
+        for path in paths[-self.maxsize:]:
+            try:
+                self._store(os.path.basename(path)[:-len(".npz")], TemplateEntry.load(path))
+            except Exception as e:
+                print(f"Warning: ignoring unreadable template cache file {path}: {e}", file=sys.stderr)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
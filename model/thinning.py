@@ -0,0 +1,161 @@
+import numpy as np
+
+# Vectorized Zhang-Suen thinning.
+#
+# The 8-neighbourhood of every pixel is packed into one byte and the deletion
+# rules of each sub-iteration are looked up in a 256-entry table, so a whole
+# sub-iteration is a handful of array operations instead of a Python loop over
+# every pixel.
+#
+# Bit layout of the neighbourhood code (same naming as extract_features):
+# P9 P2 P3        bit7 bit0 bit1
+# P8 P1 P4   ->   bit6  --  bit2
+# P7 P6 P5        bit5 bit4 bit3
+
+# (row, col) offsets of P2..P9, in bit order
+NEIGHBOR_OFFSETS = ((-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1))
+
+
+def _build_lookup_tables():
+    """ Returns (lut_sub1, lut_sub2): boolean tables indexed by neighbourhood code. """
+    lut_sub1 = np.zeros(256, dtype=bool)
+    lut_sub2 = np.zeros(256, dtype=bool)
+    for code in range(256):
+        p2, p3, p4, p5, p6, p7, p8, p9 = [(code >> bit) & 1 for bit in range(8)]
+
+        # Connectivity number: 0 -> 1 transitions in the sequence P2, P3, ..., P9, P2
+        ring = (p2, p3, p4, p5, p6, p7, p8, p9, p2)
+        connectivity = sum(1 for a, b in zip(ring, ring[1:]) if a == 0 and b == 1)
+        if connectivity != 1:
+            continue
+
+        neighbors = p2 + p3 + p4 + p5 + p6 + p7 + p8 + p9
+        if not (2 <= neighbors <= 6):
+            continue
+
+        if p2 * p4 * p6 != 0:
+            continue
+
+        # The first sub-iteration keeps the P2*P4*P8 check inherited from the
+        # C++ code rather than the textbook P4*P6*P8.
+        lut_sub1[code] = p2 * p4 * p8 == 0
+        lut_sub2[code] = p4 * p6 * p8 == 0
+    return lut_sub1, lut_sub2
+
+
+LUT_SUB1, LUT_SUB2 = _build_lookup_tables()
+
+
+def neighborhood_codes(img: np.ndarray) -> np.ndarray:
+    """
+    Packs the 8 neighbours of every interior pixel of a 0/1 image into a byte.
+    Returns an array of shape (height - 2, width - 2).
+    """
+    height, width = img.shape
+    codes = np.zeros((height - 2, width - 2), dtype=np.uint8)
+    for bit, (dr, dc) in enumerate(NEIGHBOR_OFFSETS):
+        codes |= img[1 + dr:height - 1 + dr, 1 + dc:width - 1 + dc] << bit
+    return codes
+
+
+def zhang_suen_lut(dest: np.ndarray):
+    """
+    Applies Zhang-Suen thinning in place, evaluating each sub-iteration for the
+    whole image at once. Produces the same skeleton as
+    extract_features.zhang_suen_reference: 255 is background, anything else is
+    foreground, and the result has 0 for foreground.
+    """
+    height, width = dest.shape
+    img_proc = (dest != 255).astype(np.uint8)
+
+    if height >= 3 and width >= 3:
+        interior = img_proc[1:height - 1, 1:width - 1]
+        thining_continue = True
+        while thining_continue:
+            thining_continue = False
+            for lut in (LUT_SUB1, LUT_SUB2):
+                # Deletions are decided on the image as it was at the start of
+                # the sub-iteration, then applied together.
+                remove = (interior == 1) & lut[neighborhood_codes(img_proc)]
+                if remove.any():
+                    interior[remove] = 0
+                    thining_continue = True
+
+    dest[:, :] = np.where(img_proc == 0, 255, 0).astype(np.uint8)
+
+
+def _sparse_codes(img: np.ndarray, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    """ Neighbourhood codes of the given interior pixels only. """
+    codes = np.zeros(rows.shape, dtype=np.uint8)
+    for bit, (dr, dc) in enumerate(NEIGHBOR_OFFSETS):
+        codes |= img[rows + dr, cols + dc] << bit
+    return codes
+
+
+def _frontier(img: np.ndarray, deleted, height: int, width: int):
+    """
+    Foreground interior pixels in the 3x3 neighbourhood of any deleted pixel,
+    as (rows, cols). deleted is a list of (rows, cols) pairs.
+    """
+    rows = np.concatenate([r for r, _ in deleted])
+    cols = np.concatenate([c for _, c in deleted])
+    if rows.size == 0:
+        return rows, cols
+
+    index = []
+    for dr in (-1, 0, 1):
+        for dc in (-1, 0, 1):
+            r = rows + dr
+            c = cols + dc
+            inside = (r >= 1) & (r < height - 1) & (c >= 1) & (c < width - 1)
+            index.append(r[inside] * width + c[inside])
+    index = np.unique(np.concatenate(index))
+    index = index[img.ravel()[index] == 1]
+    return index // width, index % width
+
+
+def zhang_suen_frontier(dest: np.ndarray):
+    """
+    Applies Zhang-Suen thinning in place, re-evaluating only pixels whose
+    neighbourhood changed. Same output as zhang_suen_lut, but the cost scales
+    with the stroke area rather than canvas area x iterations.
+
+    A pixel's fate in a sub-iteration depends only on its neighbourhood, so it
+    only needs another look once a neighbour was deleted since the last
+    sub-iteration of the same kind, i.e. in either of the two preceding
+    sub-iterations. The first sub-iteration of each kind sees all foreground.
+    """
+    height, width = dest.shape
+    img_proc = (dest != 255).astype(np.uint8)
+
+    if height >= 3 and width >= 3:
+        rows, cols = np.nonzero(img_proc[1:height - 1, 1:width - 1])
+        rows = rows + 1
+        cols = cols + 1
+        all_foreground = (rows, cols)
+
+        empty = (rows[:0], cols[:0])
+        history = [empty, empty]  # deletions of the last two sub-iterations
+        step = 0
+        thining_continue = True
+        while thining_continue:
+            thining_continue = False
+            for lut in (LUT_SUB1, LUT_SUB2):
+                if step < 2:
+                    rows, cols = all_foreground
+                    # Pixels deleted by the first sub-iteration are gone
+                    keep = img_proc[rows, cols] == 1
+                    rows, cols = rows[keep], cols[keep]
+                else:
+                    rows, cols = _frontier(img_proc, history, height, width)
+
+                remove = lut[_sparse_codes(img_proc, rows, cols)]
+                removed = (rows[remove], cols[remove])
+                if removed[0].size:
+                    img_proc[removed] = 0
+                    thining_continue = True
+
+                history = [history[1], removed]
+                step += 1
+
+    dest[:, :] = np.where(img_proc == 0, 255, 0).astype(np.uint8)
@@ -0,0 +1,162 @@
+import os
+import sys
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from model import metrics
+
+# Process-pool execution for PD_Model.
+#
+# Feature extraction is CPU-bound Python/NumPy work that holds the GIL, so
+# running it on the web server's threads lets one slow spiral stall every
+# other request of the worker. InferencePool runs it in separate processes
+# instead. Each process loads its own PD_Model (booster and template cache)
+# once, when it starts. At most max_pending tasks are accepted at a time;
+# beyond that callers get InferenceBusyError right away rather than queueing
+# without bound.
+
+_worker_model = None
+
+
+class InferenceBusyError(Exception):
+    """ All workers are busy and the queue is full. retry_after is a hint in seconds. """
+    def __init__(self, retry_after: int):
+        super().__init__(f"Inference queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class InferenceTimeoutError(Exception):
+    """ A task did not finish within the pool's task timeout. """
+
+
+def _init_worker():
+    # Imported here: model.inference imports this module.
+    from model.inference import PD_Model
+
+    global _worker_model
+    _worker_model = PD_Model(execution="inline")
+    _worker_model.template_cache.preload()
+
+
+def _ping():
+    return os.getpid()
+
+
+# Worker tasks return (result, timings): the spans recorded while running,
+# so the parent process can add them to its own metrics.
+
+def _run_inference(traced, template, age):
+    with metrics.collect() as timings:
+        result = _worker_model.run_inference(traced, template, age)
+    return result, timings
+
+
+def _get_features(traced, template):
+    with metrics.collect() as timings:
+        result = _worker_model.get_features(traced, template)
+    return result, timings
+
+
+def _kinematic_features(traced):
+    with metrics.collect() as timings:
+        result = _worker_model.kinematic_features(traced)
+    return result, timings
+
+
+class InferencePool:
+    """
+    Runs PD_Model work in a pool of warm worker processes.
+
+    workers: number of processes.
+    max_pending: tasks accepted at once (running + queued) before rejecting.
+    task_timeout: seconds a caller waits for a result. A task that times out
+    keeps its worker busy until it finishes and still counts as pending.
+    """
+    def __init__(self, workers: int, max_pending: int, task_timeout: float,
+                 retry_after: int = 2, start_method: str = "spawn"):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.task_timeout = task_timeout
+        self.retry_after = retry_after
+        self._context = multiprocessing.get_context(start_method)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+
+    @classmethod
+    def from_env(cls) -> "InferencePool":
+        workers = int(os.environ.get("INFERENCE_PROCESSES", str(os.cpu_count() or 1)))
+        return cls(
+            workers=workers,
+            max_pending=int(os.environ.get("INFERENCE_MAX_PENDING", str(2 * workers))),
+            task_timeout=float(os.environ.get("INFERENCE_TASK_TIMEOUT", "30")),
+            retry_after=int(os.environ.get("INFERENCE_RETRY_AFTER", "2")),
+            start_method=os.environ.get("INFERENCE_START_METHOD", "spawn"),
+        )
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=self._context,
+                                   initializer=_init_worker)
+
+    def warm_up(self):
+        """ Starts every worker process now instead of on the first requests. """
+        futures = [self._executor.submit(_ping) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+
+    def submit(self, fn, *args):
+        """ Queues fn(*args), or raises InferenceBusyError if max_pending tasks are already pending. """
+        if not self._slots.acquire(blocking=False):
+            raise InferenceBusyError(self.retry_after)
+        try:
+            with self._lock:
+                future = self._executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._restart()
+            raise
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def call(self, fn, *args):
+        """ Runs fn(*args) in a worker and waits up to task_timeout for its result. """
+        future = self.submit(fn, *args)
+        try:
+            return future.result(timeout=self.task_timeout)
+        except FutureTimeoutError:
+            raise InferenceTimeoutError(f"Inference did not finish within {self.task_timeout:g}s")
+        except BrokenProcessPool:
+            self._restart()
+            raise
+
+    def _restart(self):
+        # A worker died (e.g. killed by the OOM killer); the executor is unusable.
+        with self._lock:
+            if getattr(self._executor, "_broken", False):
+                print("Warning: inference worker pool broke, restarting it", file=sys.stderr)
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor()
+
+    def call_timed(self, fn, *args):
+        """ call() for tasks returning (result, timings); records the worker's timings here. """
+        result, timings = self.call(fn, *args)
+        for stage, seconds in timings:
+            metrics.record(stage, seconds)
+        return result
+
+    def run_inference(self, traced, template, age):
+        return self.call_timed(_run_inference, traced, template, age)
+
+    def get_features(self, traced, template):
+        return self.call_timed(_get_features, traced, template)
+
+    def kinematic_features(self, traced):
+        return self.call_timed(_kinematic_features, traced)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,193 @@
+import importlib
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Process-wide clients, created on first use.
+#
+# app.py used to build the scoring model (twice), the Supabase client and the
+# Gemini client at import time, importing google-genai and supabase on the
+# way, so every gunicorn worker paid all of it before serving anything. Each
+# one is now a Lazy: built once per process, by whichever request needs it
+# first, or ahead of time by warm_up() (in parallel) and preload() (in the
+# gunicorn master, see gunicorn.conf.py). `python -m services` prints what
+# each subsystem costs to import and to initialize.
+
+_UNSET = object()
+
+
+class Lazy:
+    """
+    A value built by factory() on first use, once per process (thread-safe).
+    Attribute access is forwarded to the value, so a Lazy stands in for it:
+    `db.get_patient(...)` builds the client if needed, then calls it.
+    """
+    def __init__(self, name: str, factory):
+        self.name = name
+        self.factory = factory
+        self.seconds = None  # time the factory took
+        self._value = _UNSET
+        self._lock = threading.Lock()
+
+    def get(self):
+        value = self._value
+        if value is _UNSET:
+            with self._lock:
+                if self._value is _UNSET:
+                    start = time.perf_counter()
+                    self._value = self.factory()
+                    self.seconds = time.perf_counter() - start
+                    print(f"Initialized {self.name} in {self.seconds:.2f}s (pid {os.getpid()})", file=sys.stderr)
+                value = self._value
+        return value
+
+    @property
+    def loaded(self) -> bool:
+        return self._value is not _UNSET
+
+    def set(self, value):
+        """ Uses value from now on, e.g. an in-memory fake in tests. """
+        with self._lock:
+            self._value = value
+            self.seconds = 0.0
+
+    def reset(self):
+        """ Forgets the value; the next use builds a new one. """
+        with self._lock:
+            self._value = _UNSET
+            self.seconds = None
+
+    def __getattr__(self, attr):
+        return getattr(self.get(), attr)
+
+
+def _make_model():
+    from model.inference import PD_Model
+    return PD_Model()
+
+
+def _make_db():
+    from db import Database
+    return Database.from_env()
+
+
+def _make_llm():
+    from google import genai
+    return genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+
+
+class FakeLLM:
+    """
+    Stands in for the Gemini client (client.models.generate_content) in tests
+    and local development: `llm.set(FakeLLM())`. Answers with reply(prompt),
+    after delay seconds, and keeps the prompts it was sent.
+    """
+    def __init__(self, reply=lambda prompt: "```markdown\n# Report\n```", delay: float = 0.0):
+        self.reply = reply
+        self.delay = delay
+        self.prompts = []
+        self.models = self
+        self._lock = threading.Lock()
+
+    def generate_content(self, model: str, contents: str):
+        with self._lock:
+            self.prompts.append(contents)
+        time.sleep(self.delay)
+        return _FakeResponse(self.reply(contents))
+
+
+class _FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+model = Lazy("model", _make_model)
+db = Lazy("db", _make_db)
+llm = Lazy("llm", _make_llm)
+
+SERVICES = (model, db, llm)
+
+
+def warm_up(services=SERVICES) -> dict:
+    """
+    Initializes services concurrently (their imports and setup are mostly
+    I/O and C code). Returns {name: seconds, or the exception that stopped
+    it}; failures are reported, not raised, and are retried on first use.
+    """
+    def init(service):
+        try:
+            service.get()
+            return service.seconds
+        except Exception as e:
+            print(f"Warning: could not initialize {service.name}: {e}", file=sys.stderr)
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(1, len(services)), thread_name_prefix="warm-up") as pool:
+        return dict(zip([s.name for s in services], pool.map(init, services)))
+
+
+def preload() -> dict:
+    """
+    Does what can be shared with forked workers, for a preloading gunicorn
+    master: imports the client libraries and, in "inline" execution, builds
+    the model (its tree arrays and cached templates are then shared
+    copy-on-write). A process pool or an HTTP client's connections can't
+    cross fork(), so those are left to the workers.
+    """
+    for module in ("model.inference", "db", "google.genai"):
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            print(f"Warning: could not preload {module}: {e}", file=sys.stderr)
+    if os.environ.get("INFERENCE_EXECUTION", "inline") != "inline":
+        return {}
+    return warm_up((model,))
+
+
+# Subsystems of the startup report: (name, module imported, service built)
+SUBSYSTEMS = (
+    ("flask", "flask_cors", None),
+    ("model", "model.inference", model),
+    ("db", "db", db),
+    ("llm", "google.genai", llm),
+    ("app", "app", None),
+)
+
+
+def import_seconds(module: str) -> float:
+    """ Time to import module, with its dependencies, in a fresh interpreter. """
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "import failed")
+    return float(out.stdout)
+
+
+def startup_report():
+    """ Prints import time (fresh interpreter) and initialization time (after importing) per subsystem. """
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    print(f"{'subsystem':<10} {'import':>9} {'init':>9}")
+    for name, module, service in SUBSYSTEMS:
+        try:
+            imported = f"{import_seconds(module):8.3f}s"
+        except RuntimeError as e:
+            imported = f"failed ({e})"
+        initialized = ""
+        if service is not None:
+            try:
+                importlib.import_module(module)  # so init excludes the import
+                service.get()
+                initialized = f"{service.seconds:8.3f}s"
+            except Exception as e:
+                initialized = f"failed ({e})"
+        print(f"{name:<10} {imported:>9} {initialized:>9}")
+
+
+if __name__ == "__main__":
+    startup_report()
@@ -14,5 +14,8 @@ pip install --upgrade pip
 # Install requirements
 pip install -r requirements.txt
 
+# Build the memory-mapped model artifact (see model/tree_predictor.py)
+python -m model.tree_predictor build
+
 
 echo "Setup complete! Virtual environment is activated."
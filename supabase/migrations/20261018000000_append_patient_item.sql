@@ -0,0 +1,21 @@
+-- Appends one element to a patient's notes or medication array in a single
+-- UPDATE, so concurrent appends are serialized by the row lock instead of
+-- overwriting each other's read-modify-write. Called by db.py as
+-- POST /rest/v1/rpc/append_patient_item; returns the updated patient row
+-- (no rows if there is no such patient). Assumes both columns are jsonb.
+
+create or replace function public.append_patient_item(patient_id bigint, list_column text, item jsonb)
+returns setof public.patients
+language plpgsql
+as $$
+begin
+  if list_column not in ('notes', 'medication') then
+    raise exception 'cannot append to column %', list_column using errcode = '22023';
+  end if;
+  return query execute format(
+    'update public.patients set %1$I = coalesce(%1$I, ''[]''::jsonb) || jsonb_build_array($1) '
+    'where id = $2 returning *',
+    list_column
+  ) using item, patient_id;
+end;
+$$;